@@ -0,0 +1,273 @@
+from __future__ import division
+import os
+import math
+import time
+import platform
+
+from cnc import pulses
+from cnc import gmachine
+from cnc import self_benchmark
+from cnc.gcode import GCode, SourceLine
+from cnc.pulses import PulseGeneratorLinear, PulseGeneratorCircular
+from cnc.coordinates import Coordinates
+from cnc.enums import *
+from cnc.config import *
+
+""" Benchmark of pulses generation throughput. Each move is generated with
+    different settings and generation time is compared with movement time.
+    Movement is faster than generation if generation rate is less than 1.0,
+    so such feed can be run only if all pulses are buffered in advance.
+"""
+
+PLANES = {"XY": PLANE_XY, "YZ": PLANE_YZ, "ZX": PLANE_ZX}
+# 'pulses' just iterates generator, 'gpio' also converts pulses to GPIO
+# writes as Raspberry Pi hal does.
+MODES = ("pulses", "gpio")
+
+
+class PulsesPerStep(object):
+    def __init__(self, pulses_per_step):
+        """ Context manager which temporary changes microstepping for pulses
+            generators.
+        :param pulses_per_step: stepper motors microsteps per whole step.
+        """
+        self._ppm = pulses_per_step * STEPPER_STEPS_PER_MM
+        self._saved = None
+
+    def __enter__(self):
+        names = ("STEPPER_PULSES_PER_MM_X", "STEPPER_PULSES_PER_MM_Y",
+                 "STEPPER_PULSES_PER_MM_Z", "STEPPER_PULSES_PER_MM_E")
+        self._saved = dict((n, getattr(pulses, n)) for n in names)
+        for n in names:
+            setattr(pulses, n, self._ppm)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for n, v in self._saved.items():
+            setattr(pulses, n, v)
+
+
+def _generator(name, plane, feed, length):
+    """ Create generator for benchmark move.
+    :param name: 'linear' for move along X axis or 'circular' for half
+                 of circle.
+    :param plane: plane name for circular move.
+    :param feed: velocity in mm per minute.
+    :param length: length of move in mm.
+    :return: PulseGenerator object.
+    """
+    if name == "linear":
+        return PulseGeneratorLinear(Coordinates(length, 0, 0, 0), feed)
+    r = round(length / math.pi, 3)
+    if plane == "XY":
+        delta, radius = Coordinates(2 * r, 0, 0, 0), Coordinates(r, 0, 0, 0)
+    elif plane == "YZ":
+        delta, radius = Coordinates(0, 2 * r, 0, 0), Coordinates(0, r, 0, 0)
+    else:
+        delta, radius = Coordinates(0, 0, 2 * r, 0), Coordinates(0, 0, r, 0)
+    return PulseGeneratorCircular(delta, radius, PLANES[plane], CW, feed)
+
+
+def _measure(generator, mode):
+    """ Generate all pulses of move.
+    :param generator: PulseGenerator object.
+    :param mode: one of MODES.
+    :return: tuple of number of pulses and generation time in seconds.
+    """
+    if mode == "gpio":
+        return self_benchmark.measure(generator)
+    count = 0
+    st = time.time()
+    for direction, tx, ty, tz, te in generator:
+        if not direction:
+            count += ((tx is not None) + (ty is not None)
+                      + (tz is not None) + (te is not None))
+    # avoid zero time on low resolution timers
+    return count, max(time.time() - st, 1e-6)
+
+
+def run(generators=("linear", "circular"), pulses_per_step=(4, 8, 16, 32),
+        feeds=(600, 1800, 3000), lengths=(2, 20), planes=("XY", "YZ", "ZX"),
+        modes=MODES, progress=None):
+    """ Run benchmark for all combinations of settings.
+    :param generators: generators names, 'linear' and 'circular'.
+    :param pulses_per_step: list of microsteps settings.
+    :param feeds: list of velocities in mm per minute.
+    :param lengths: list of moves lengths in mm.
+    :param planes: list of planes names for circular moves.
+    :param modes: list of MODES.
+    :param progress: optional callable which is called with each result.
+    :return: dict with environment info, 'results' list and 'max_feed', see
+             max_feed().
+    """
+    results = []
+    for pps in pulses_per_step:
+        with PulsesPerStep(pps):
+            for name in generators:
+                for plane in (planes if name == "circular" else ("X",)):
+                    for feed in feeds:
+                        for length in lengths:
+                            for mode in modes:
+                                g = _generator(name, plane, feed, length)
+                                count, t = _measure(g, mode)
+                                r = {"generator": name, "plane": plane,
+                                     "pulses_per_step": pps, "feed": feed,
+                                     "length": length, "mode": mode,
+                                     "pulses": count, "generation_s": t,
+                                     "movement_s": g.total_time_s()}
+                                r["pulses_per_second"] = count / t
+                                r["rate"] = g.total_time_s() / t
+                                results.append(r)
+                                if progress is not None:
+                                    progress(r)
+    return {"python": platform.python_implementation(),
+            "python_version": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results, "max_feed": max_feed(results)}
+
+
+def max_feed(results):
+    """ Estimate maximum feed which can be generated in real time. Pulses
+        generation time is proportional to number of pulses, so it is feed
+        multiplied by generation rate. The worst of all moves is taken.
+    :param results: list of results, see run().
+    :return: dict with {mode: {pulses_per_step: feed}} in mm per minute.
+    """
+    feeds = dict()
+    for r in results:
+        # generator may decrease velocity to axises maximum
+        feed = min(r["feed"], MAX_VELOCITY_MM_PER_MIN_X,
+                   MAX_VELOCITY_MM_PER_MIN_Y, MAX_VELOCITY_MM_PER_MIN_Z)
+        f = feeds.setdefault(r["mode"], dict())
+        v = feed * r["rate"]
+        key = str(r["pulses_per_step"])
+        if key not in f or v < f[key]:
+            f[key] = v
+    return feeds
+
+
+def emulated_hal():
+    """ Load Raspberry Pi hal with emulated hardware.
+    :return: tuple of hal module and Emulator object.
+    """
+    previous = os.environ.get("PYCNC_EMULATE_RPI")
+    os.environ["PYCNC_EMULATE_RPI"] = "1"
+    try:
+        from cnc.hal_raspberry import rpgpio_private
+        from cnc.hal_raspberry import hal
+        from cnc.hal_raspberry.rpgpio_emulator import emulator
+    finally:
+        if previous is None:
+            del os.environ["PYCNC_EMULATE_RPI"]
+        else:
+            os.environ["PYCNC_EMULATE_RPI"] = previous
+    if not rpgpio_private.EMULATE:
+        raise RuntimeError("real hardware is used, can't emulate it")
+    return hal, emulator
+
+
+class _Timed(object):
+    def __init__(self, obj, emulator, times):
+        """ Proxy for hal module and DMA object which measures time of
+            moves and writing to DMA buffer, without emulator's own work.
+        :param obj: hal module or DMAGPIO object.
+        :param emulator: Emulator object.
+        :param times: dict to add times to.
+        """
+        self._obj = obj
+        self._emulator = emulator
+        self._times = times
+
+    def __getattr__(self, name):
+        return getattr(self._obj, name)
+
+    def _call(self, stage, method, *args):
+        busy = self._emulator.busy_s
+        st = time.time()
+        method(*args)
+        self._times[stage] += (time.time() - st
+                               - (self._emulator.busy_s - busy))
+
+    def add_events(self, events):
+        self._call("encode", self._obj.add_events, events)
+
+    def move(self, generator):
+        metrics = self._obj.get_metrics()
+        waited = metrics["sleep_s"] + metrics["wait_s"]
+        self._times["moves"] += 1
+        self._times["job_s"] += generator.total_time_s()
+        gpio_events = generator.gpio_events
+        times = self._times
+
+        def timed(*args):
+            it = gpio_events(*args)
+            while True:
+                st = time.time()
+                try:
+                    event = next(it)
+                except StopIteration:
+                    times["generate"] += time.time() - st
+                    return
+                times["generate"] += time.time() - st
+                yield event
+        generator.gpio_events = timed
+        self._call("hal", self._obj.move, generator)
+        metrics = self._obj.get_metrics()
+        times["wait"] += metrics["sleep_s"] + metrics["wait_s"] - waited
+
+
+def pipeline(lines, speed=100.0):
+    """ Run gcode through the whole pipeline: parsing, GMachine, pulses
+        generation and encoding to DMA control blocks of Raspberry Pi hal
+        with emulated hardware.
+    :param lines: iterable with gcode lines.
+    :param speed: how many times emulated hardware is faster than real one,
+                  it makes waiting for movement shorter and doesn't affect
+                  preparation time, but DMA buffer metrics make sense only
+                  for 1.0.
+    :return: dict with time of each stage in seconds: 'parse', 'plan'
+             (GMachine without hal), 'generate' (pulses generation),
+             'encode' (writing to DMA buffer), 'hal' (the rest of hal work),
+             'wait' (waiting for DMA), 'preparation' (sum of all but
+             waiting),
+             and 'job_s' movement time, 'ratio' of preparation time to
+             movement time, number of 'lines' and 'moves', hal 'metrics'.
+             Ratio should be less than 1.0 for real time running.
+    """
+    hal, emulator = emulated_hal()
+    times = {"parse": 0.0, "command": 0.0, "generate": 0.0, "encode": 0.0,
+             "hal": 0.0, "wait": 0.0, "job_s": 0.0, "moves": 0,
+             "lines": 0}
+    saved = (gmachine.hal, hal.dma, emulator.record)
+    gmachine.hal = _Timed(hal, emulator, times)
+    hal.dma = _Timed(hal.dma, emulator, times)
+    emulator.record = False
+    emulator.set_speed(speed)
+    try:
+        machine = gmachine.GMachine()
+        for n, line in enumerate(lines, 1):
+            st = time.time()
+            g = GCode.parse_line(SourceLine(line, n))
+            busy = emulator.busy_s
+            pt = time.time()
+            machine.do_command(g)
+            times["parse"] += pt - st
+            times["command"] += (time.time() - pt
+                                 - (emulator.busy_s - busy))
+            times["lines"] += 1
+        hal.join()
+        metrics = hal.get_metrics()
+        machine.release()
+    finally:
+        gmachine.hal, hal.dma, emulator.record = saved
+        emulator.set_speed(1.0)
+    res = dict((k, times[k]) for k in ("parse", "generate", "encode", "wait",
+                                       "job_s", "moves", "lines"))
+    res["plan"] = times["command"] - times["hal"]
+    res["hal"] = (times["hal"] - times["generate"] - times["encode"]
+                  - times["wait"])
+    res["preparation"] = (res["parse"] + res["plan"] + res["generate"]
+                          + res["encode"] + res["hal"])
+    res["ratio"] = res["preparation"] / max(res["job_s"], 1e-9)
+    res["metrics"] = metrics
+    return res
@@ -142,7 +142,43 @@ ENDSTOP_PIN_Z = 25
 # buffer will be prepared firstly and then command will run.
 # Before enabling this feature, please make sure that board performance is
 # enough for streaming pulses(faster then real time).
+# Speed of pulses generation is measured for each kind of moves, streaming
+# starts when buffered pulses are enough to finish the move without DMA
+# catching up with generation, plus INSTANT_RUN_MARGIN_S seconds. If
+# generation is too slow, the whole move is buffered. Speed estimate is
+# smoothed over moves with GENERATION_RATE_SMOOTHING factor, generations
+# shorter than GENERATION_RATE_MIN_SAMPLE_S seconds are not measured.
 INSTANT_RUN = True
+INSTANT_RUN_MARGIN_S = 0.1
+GENERATION_RATE_SMOOTHING = 0.3
+GENERATION_RATE_MIN_SAMPLE_S = 0.01
+
+# Generate synthetic moves on start without any output, so JIT of PyPy
+# compiles pulses generation before the first move. Warm-up runs until
+# generation speed changes less than JIT_WARMUP_TOLERANCE between rounds, but
+# not longer than JIT_WARMUP_MAX_TIME_S seconds. Useless with CPython.
+JIT_WARMUP = False
+JIT_WARMUP_MAX_TIME_S = 10.0
+JIT_WARMUP_TOLERANCE = 0.05
+
+# Raspberry Pi hal keeps records of the last MOVE_RECORDS_SIZE moves with
+# source gcode line number, generator, number of pulses, DMA control blocks
+# and memory, generation time, estimated time, minimum buffer lead and actual
+# DMA time. If MOVE_RECORDS_FILE is set, records are also appended to this
+# file as JSON lines.
+MOVE_RECORDS_SIZE = 1000
+MOVE_RECORDS_FILE = None
+
+# Measure how fast this host generates pulses on start, it takes
+# SELF_BENCHMARK_TIME_S seconds. Only SELF_BENCHMARK_MARGIN part of measured
+# speed is used, the rest is left for OS and other work. In 'clamp' mode
+# velocity of moves which can't be generated in time is decreased, in 'buffer'
+# mode velocity is kept and such moves are fully buffered before running(it
+# is supported by Raspberry Pi hal only).
+SELF_BENCHMARK = False
+SELF_BENCHMARK_TIME_S = 1.0
+SELF_BENCHMARK_MARGIN = 0.7
+SELF_BENCHMARK_MODE = 'clamp'
 
 # If this parameter is False, error will be raised on command with velocity
 # more than maximum velocity specified here. If this parameter is True,
@@ -150,6 +186,76 @@ INSTANT_RUN = True
 # velocity.
 AUTO_VELOCITY_ADJUSTMENT = True
 
+# Rapid movement(G0) mode. By default(False) G0 is straight line with the
+# maximum velocity of the slowest axis. If this parameter is True, each axis
+# moves with its own maximum velocity and acceleration and stops
+# independently, so G0 takes less time, but path isn't a straight line. Moves
+# with extruder are always straight. If RAPID_LIFT_Z_FIRST is True, such rapid
+# move is split, Z is moved before X and Y if it goes up and after them if it
+# goes down.
+DECOUPLED_RAPIDS = False
+RAPID_LIFT_Z_FIRST = True
+
+# Circular interpolation(G2, G3) mode. 'exact' always generates pulses for
+# arcs directly, 'linear' converts arcs to line segments which deviate from
+# arc not more than ARC_TOLERANCE_MM. 'auto' converts only small arcs, for
+# which linear segments are cheaper to generate and don't slow down movement
+# more than ARC_LINEARIZATION_MAX_SLOWDOWN times, depending on radius and feed.
+# Set it to 'auto' on slow hosts which can't generate small arcs in time.
+ARC_INTERPOLATION = 'exact'
+ARC_TOLERANCE_MM = 0.01
+ARC_LINEARIZATION_MAX_SEGMENTS = 8
+ARC_LINEARIZATION_MAX_SLOWDOWN = 1.25
+
+# Encoded pulses of recently used moves are cached, so repeated identical
+# moves(patterns, strokes) are copied instead of generating them again. This
+# value is the total number of pulses in cache, 0 disables cache.
+PULSE_CACHE_SIZE = 200000
+
+# When gcode file is executed, consecutive G0/G1 moves with the same feed rate
+# which lie on one line(within one pulse of each axis) are merged into one
+# move, so head doesn't accelerate and brake on each of them. Number of moves
+# in one merged move is limited with COALESCE_MAX_MOVES.
+COALESCE_COLLINEAR_MOVES = False
+COALESCE_MAX_MOVES = 256
+
+# When gcode file is executed, points of G1 polylines which deviate from
+# simplified polyline less than SIMPLIFY_TOLERANCE_MM are removed with
+# Douglas-Peucker algorithm, None means one pulse of each axis. Polyline is
+# finished by any other command and by SIMPLIFY_MAX_POINTS points.
+SIMPLIFY_POLYLINES = False
+SIMPLIFY_TOLERANCE_MM = None
+SIMPLIFY_MAX_POINTS = 1024
+
+# When gcode file is executed, sequences of G1 moves in the current plane
+# which points lie on one circle are replaced with G2/G3 arc. Points and
+# segments of polyline deviate from arc not more than ARC_WELDER_TOLERANCE_MM.
+# At least ARC_WELDER_MIN_MOVES moves are required.
+WELD_ARCS = False
+ARC_WELDER_TOLERANCE_MM = 0.05
+ARC_WELDER_MIN_MOVES = 3
+ARC_WELDER_MAX_MOVES = 512
+ARC_WELDER_MAX_RADIUS_MM = 1000.0
+
+# 'pycnc optimize' reorders strokes between travel moves to minimize travel.
+# Order found with nearest neighbour heuristic is improved with local search,
+# which changes strokes not further than TRAVEL_OPTIMIZER_WINDOW strokes in
+# route, TRAVEL_OPTIMIZER_PASSES times at most. The next passes give much less
+# than the first one.
+TRAVEL_OPTIMIZER_WINDOW = 10
+TRAVEL_OPTIMIZER_PASSES = 1
+
+# Pulses checking in virtual hal, which is used when hardware isn't detected.
+# 'full' checks each pulse of each move, 'sampled' fully checks only the
+# first move of each generator type and then each VIRTUAL_HAL_SAMPLE_MOVES-th
+# one, 'none' just counts pulses without any checks, it is the fastest mode
+# for dry runs.
+VIRTUAL_HAL_VALIDATION = 'full'
+VIRTUAL_HAL_SAMPLE_MOVES = 100
+# File to record all pulses of virtual hal in binary trace, None to disable.
+# Trace can be checked again or converted to VCD file with 'pycnc trace'.
+VIRTUAL_HAL_TRACE_FILE = None
+
 
 # -----------------------------------------------------------------------------
 # Audio config
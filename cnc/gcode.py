@@ -14,6 +14,19 @@ class GCodeException(Exception):
     pass
 
 
+class SourceLine(str):
+    """ Gcode line which keeps number of source file line it was made from.
+    """
+    def __new__(cls, value, number=None):
+        """ Create object.
+        :param value: string with line.
+        :param number: line number in source file or None if it is unknown.
+        """
+        s = super(SourceLine, cls).__new__(cls, value)
+        s.number = number
+        return s
+
+
 class GCode(object):
     """ This object represent single line of gcode.
         Do not create it manually, use parse_line() instead.
@@ -23,6 +36,8 @@ class GCode(object):
         :param params: dict with gcode key-values.
         """
         self.params = params
+        # number of source file line, for diagnostics
+        self.line = None
 
     def has(self, arg_name):
         """
@@ -88,9 +103,11 @@ class GCode(object):
     @staticmethod
     def parse_line(line):
         """ Parse line.
-        :param line: String with gcode line.
+        :param line: String with gcode line, if it is SourceLine object, its
+                     number is kept in 'line' attribute of result.
         :return: gcode objects.
         """
+        number = getattr(line, "number", None)
         line = line.upper()
         line = re.sub(clean_pattern, '', line)
         if len(line) == 0:
@@ -108,4 +125,6 @@ class GCode(object):
             raise GCodeException('duplicated gcode entries')
         if 'G' in params and 'M' in params:
             raise GCodeException('g and m command found')
-        return GCode(params)
+        gcode = GCode(params)
+        gcode.line = number
+        return gcode
@@ -0,0 +1,76 @@
+from __future__ import division
+
+from cnc.config import *
+
+
+class GenerationRate(object):
+    """ Rolling estimate of pulses generation speed.
+        Speed is measured as ratio of movement time which was generated to
+        time spent for generation, i.e. rate 2.0 means that one second of
+        movement is generated in half of second. Different kinds of moves
+        (generators types, copying from cache) have different speed, so rate
+        is kept for each kind separately and is smoothed exponentially over
+        moves.
+        If rate is less than 1.0, generation is slower than movement and DMA
+        would catch up with generation, so streaming should start only after
+        enough pulses are buffered, see preroll().
+    """
+    SMOOTHING = GENERATION_RATE_SMOOTHING
+    MIN_SAMPLE_S = GENERATION_RATE_MIN_SAMPLE_S
+
+    def __init__(self):
+        """ Create object without any measurements.
+        """
+        self._rates = dict()
+        self._samples = dict()
+
+    def update(self, kind, movement_s, generation_s):
+        """ Add measurement.
+        :param kind: hashable kind of moves, e.g. generator class name.
+        :param movement_s: movement time which was generated.
+        :param generation_s: time spent for generation, without waiting.
+        :return: new rate estimate for this kind or None if it's unknown.
+        """
+        if movement_s <= 0.0 or generation_s < self.MIN_SAMPLE_S:
+            # too short measurements are mostly noise
+            return self._rates.get(kind)
+        rate = movement_s / generation_s
+        previous = self._rates.get(kind)
+        if previous is not None:
+            # slowing down is taken immediately to avoid underruns
+            rate = min(rate, previous + (rate - previous) * self.SMOOTHING)
+        self._rates[kind] = rate
+        self._samples[kind] = self._samples.get(kind, 0) + 1
+        return rate
+
+    def rate(self, kind):
+        """ Get rate estimate.
+        :param kind: kind of moves.
+        :return: rate or None if there were no measurements.
+        """
+        return self._rates.get(kind)
+
+    @staticmethod
+    def preroll(total_s, rate, margin_s):
+        """ Calculate how much movement should be buffered before streaming.
+            Generation of move which takes T seconds finishes in T / r
+            seconds, streaming which starts after P seconds of movement are
+            buffered finishes in P / r + T seconds. Generation never falls
+            behind if P >= T * (1 - r).
+        :param total_s: movement time which is not buffered yet.
+        :param rate: generation rate or None if it's unknown.
+        :param margin_s: additional time to be safe from hiccups.
+        :return: movement time to buffer in seconds, it is not less than
+                 total_s if streaming shouldn't be used at all.
+        """
+        preroll = margin_s
+        if rate is not None and rate < 1.0:
+            preroll += total_s * (1.0 - rate)
+        return preroll
+
+    def statistics(self):
+        """ Get estimates.
+        :return: dict with rate and number of measurements for each kind.
+        """
+        return dict((kind, {"rate": rate, "samples": self._samples[kind]})
+                    for kind, rate in self._rates.items())
@@ -0,0 +1,93 @@
+import math
+
+from cnc.enums import *
+
+
+def circle_quarter(a, b):
+    """Takes the coordinates a and b of a point relative to the center of the circle
+        and returns the quarter of the circle the point is in
+
+    Arguments:
+        a {float} -- The first coordinate
+        b {float} -- The second coordinate
+
+    Returns:
+        {int} -- The quarter the specified point exists in
+    """
+
+    if a > 0 and b >= 0:
+        return 1
+    if a <= 0 and b > 0:
+        return 2
+    if a < 0 and b <= 0:
+        return 3
+    if a >= 0 and b < 0:
+        return 4
+
+
+def check_circle(delta_a, delta_b, radius_a, radius_b, direction, position_a, position_b,
+                 table_a, table_b, pulses_per_mm_a, pulses_per_mm_b):
+    """Validates the circle to be drawn, checking for a valid radius, a valid endpoint, and if the circle
+        is bounded within the table
+
+        The coordinates are labeled as a and b because the plane is selectable and a and b stand for arbitrary
+        combinations of x, y and z.
+
+    Arguments:
+        delta_a, delta_b {float} -- coordinates of the endpoint relative to the position
+        radius_a, radius_b {float} -- coordinates of the circle's center relative to the position
+        direction {RotationalDirection(Enum)} -- the direction the circle will draw
+        position_a, position_b {float} -- the current position (starting position) in absolute coordinates
+        table_a, table_b {int} -- the table's maximum for both the a and b axis
+        pulses_per_mm_a, pulses_per_mm_b {float} -- the pulses per mm for both axis'
+
+    Raises:
+        ValueError -- raised if the radius is zero
+        ValueError -- raised if the endpoint not on the defined circle
+        ValueError -- raised if the circle would draw out of bounds
+    """
+
+    radius = math.hypot(radius_a, radius_b)
+    if radius == 0:
+        raise ValueError("circle radius is zero")
+    # check if (delta_a, delta_b) is on the specified circle
+    if not math.isclose(math.hypot(delta_a - radius_a, delta_b - radius_b), radius,
+                        rel_tol=min(1.0 / pulses_per_mm_a, 1.0 / pulses_per_mm_b)):
+        raise ValueError("endpoint not on circle")
+    # check if the drawn circle is inside the table
+    start_quarter = circle_quarter(-radius_a, -radius_b)
+    if delta_a == 0 and delta_b == 0: # If the endpoint and position are the same, check the full circle
+        end_quarter = 5
+    else:
+        end_quarter = circle_quarter(delta_a - radius_a, delta_b - radius_b)
+
+    if start_quarter == end_quarter:
+        return
+
+    # If the start and end points are not in the same quarter, there will be new maximum values that have to be checked against
+    # boundry conditions
+    is_raise = False
+    quarter = start_quarter
+    prev_quarter = quarter
+    for _ in range(4):
+        if direction == CW:
+            quarter -= 1
+            if quarter == 0: quarter = 4
+        else:
+            quarter += 1
+            if quarter == 5: quarter = 1
+
+        if (quarter == 1 and prev_quarter == 4) or (quarter == 4 and prev_quarter == 1):
+            is_raise = (position_a + radius_a + radius > table_a)
+        elif (quarter == 1 and prev_quarter == 2) or (quarter == 2 and prev_quarter == 1):
+            is_raise = (position_b + radius_b + radius > table_b)
+        elif (quarter == 2 and prev_quarter == 3) or (quarter == 3 and prev_quarter == 2):
+            is_raise = (position_a + radius_a - radius < 0)
+        elif (quarter == 3 and prev_quarter == 4) or (quarter == 4 and prev_quarter == 3):
+            is_raise = (position_b + radius_b - radius < 0)
+        if is_raise:
+            raise ValueError("circle out of bounds")
+
+        if quarter == end_quarter:
+            break
+        prev_quarter = quarter
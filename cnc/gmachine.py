@@ -4,10 +4,13 @@ import cnc.logging_config as logging_config
 from cnc import hal
 from cnc.pulses import *
 from cnc.coordinates import *
+from cnc.geometry import *
 from cnc.heater import *
 from cnc.enums import *
 from cnc.watchdog import *
 from cnc.audio import AudioPlayer
+from cnc import self_benchmark
+from cnc import warmup
 
 
 class GMachineException(Exception):
@@ -20,6 +23,9 @@ class GMachine(object):
     """ Main object which control and keep state of whole machine: steppers,
         spindle, extruder etc
     """
+    ARC_INTERPOLATION = ARC_INTERPOLATION
+    DECOUPLED_RAPIDS = DECOUPLED_RAPIDS
+    RAPID_LIFT_Z_FIRST = RAPID_LIFT_Z_FIRST
 
     def __init__(self):
         """ Initialization.
@@ -31,8 +37,15 @@ class GMachine(object):
         self._convertCoordinates = 0
         self._absoluteCoordinates = 0
         self._plane = None
+        self._spline_control = None
         self._extruder_id = 0
+        # source line number of the current command
+        self._line = None
         hal.init()
+        if JIT_WARMUP:
+            warmup.run(hal)
+        if SELF_BENCHMARK:
+            self_benchmark.run(hal)
         self.watchdog = HardwareWatchdog()
 
         self.reset()
@@ -54,6 +67,7 @@ class GMachine(object):
         self._convertCoordinates = 1.0
         self._absoluteCoordinates = True
         self._plane = PLANE_XY
+        self._spline_control = None
 
     def __check_delta(self, delta):
         pos = self._position + delta
@@ -117,100 +131,129 @@ class GMachine(object):
 
         extruder_speed = self._get_extruder_speed(delta, velocity)
         self._start_extruder_move(delta.e, extruder_speed)
+        gen.line = self._line
         hal.move(gen)
 
         # save position
         self._position = self._position + delta
 
-    @staticmethod
-    def __quarter(a, b):
-        """Takes the coordinates a and b of a point relative to the center of the circle
-            and returns the quarter of the circle the point is in
-
-        Arguments:
-            a {float} -- The first coordinate
-            b {float} -- The second coordinate
-
-        Returns:
-            {int} -- The quarter the specified point exists in
+    def _move_rapid(self, delta):
+        """ Move each axis independently with its maximum velocity.
+        :param delta: movement delta.
         """
+        delta = delta.round_to_nearest_pulse()
+        if delta.is_zero():
+            return
+        self.__check_delta(delta)
+        z = Coordinates(0.0, 0.0, delta.z, 0.0)
+        if not self.RAPID_LIFT_Z_FIRST or z.is_zero() or (delta - z).is_zero():
+            moves = (delta,)
+        elif delta.z > 0:
+            # path is unknown, so lift Z first and lower it at the end
+            moves = (z, delta - z)
+        else:
+            moves = (delta - z, z)
+        for d in moves:
+            logging.info("Moving rapidly {}".format(d))
+            gen = PulseGeneratorRapid(d)
+            self.__check_velocity(gen.max_velocity())
+            gen.line = self._line
+            hal.move(gen)
+            # save position
+            self._position = self._position + d
 
-        if a > 0 and b >= 0:
-            return 1
-        if a <= 0 and b > 0:
-            return 2
-        if a < 0 and b <= 0:
-            return 3
-        if a >= 0 and b < 0:
-            return 4
-
-    def __check_circle(self, delta_a, delta_b, radius_a, radius_b, direction, position_a, position_b,
-                       table_a, table_b, pulses_per_mm_a, pulses_per_mm_b):
-        """Validates the circle to be drawn, checking for a valid radius, a valid endpoint, and if the circle
-            is bounded within the table
-
-            The coordinates are labeled as a and b because the plane is selectable and a and b stand for arbitrary
-            combinations of x, y and z.
+    # noinspection PyMethodMayBeStatic
+    def __check_circle(self, delta_a, delta_b, radius_a, radius_b, direction,
+                       position_a, position_b, table_a, table_b,
+                       pulses_per_mm_a, pulses_per_mm_b):
+        try:
+            check_circle(delta_a, delta_b, radius_a, radius_b, direction,
+                         position_a, position_b, table_a, table_b,
+                         pulses_per_mm_a, pulses_per_mm_b)
+        except ValueError as e:
+            raise GMachineException(str(e))
 
-        Arguments:
-            delta_a, delta_b {float} -- coordinates of the endpoint relative to the position
-            radius_a, radius_b {float} -- coordinates of the circle's center relative to the position
-            direction {RotationalDirection(Enum)} -- the direction the circle will draw
-            position_a, position_b {float} -- the current position (starting position) in absolute coordinates
-            table_a, table_b {int} -- the table's maximum for both the a and b axis
-            pulses_per_mm_a, pulses_per_mm_b {float} -- the pulses per mm for both axis'
-
-        Raises:
-            GMachineException -- raised if the radius is zero
-            GMachineException -- raised if the endpoint not on the defined circle
-            GMachineException -- raised if the circle would draw out of bounds
+    @staticmethod
+    def __movement_time(distance, velocity):
+        """ Estimate time of linear movement with acceleration and braking.
+        :param distance: distance in mm.
+        :param velocity: velocity in mm per second.
+        :return: time in seconds.
         """
-
-        radius = math.hypot(radius_a, radius_b)
-        if radius == 0:
-            raise GMachineException("circle radius is zero")
-        # check if (delta_a, delta_b) is on the specified circle
-        if not math.isclose(math.hypot(delta_a - radius_a, delta_b - radius_b), radius,
-                            rel_tol=min(1.0 / pulses_per_mm_a, 1.0 / pulses_per_mm_b)):
-            raise GMachineException("endpoint not on circle")
-        # check if the drawn circle is inside the table
-        start_quarter = GMachine.__quarter(-radius_a, -radius_b)
-        if delta_a == 0 and delta_b == 0: # If the endpoint and position are the same, check the full circle
-            end_quarter = 5
+        a = STEPPER_MAX_ACCELERATION_MM_PER_S2
+        if distance >= velocity * velocity / a:
+            return distance / velocity + velocity / a
+        return 2.0 * math.sqrt(distance / a)
+
+    def _linearize_arc(self, delta, radius, velocity, direction):
+        """ Split arc into line segments which deviate from arc not more than
+            ARC_TOLERANCE_MM. With 'auto' interpolation mode arc is split only
+            if it's small enough, i.e. number of segments and time penalty
+            for stopping at each segment are small.
+        :param delta: arc end point relative to the current position.
+        :param radius: vector from the current position to arc center.
+        :param velocity: velocity in mm per min.
+        :param direction: CW or CCW.
+        :return: list of segments deltas or None if arc shouldn't be split.
+        """
+        if self.ARC_INTERPOLATION == 'exact':
+            return None
+        if self._plane == PLANE_XY:
+            sa, sb, da, db, dc = -radius.x, -radius.y, delta.x, delta.y, \
+                                 delta.z
+        elif self._plane == PLANE_YZ:
+            sa, sb, da, db, dc = -radius.y, -radius.z, delta.y, delta.z, \
+                                 delta.x
+        else:  # self._plane == PLANE_ZX
+            sa, sb, da, db, dc = -radius.z, -radius.x, delta.z, delta.x, \
+                                 delta.y
+        r = math.hypot(sa, sb)
+        start_angle = math.atan2(sb, sa)
+        sweep = (math.atan2(sb + db, sa + da) - start_angle) % (2.0 * math.pi)
+        if direction == CW:
+            sweep -= 2.0 * math.pi
+        elif sweep == 0.0:
+            sweep = 2.0 * math.pi
+        # maximum angle of segment for chordal tolerance
+        if ARC_TOLERANCE_MM < r:
+            max_angle = min(2.0 * math.acos(1.0 - ARC_TOLERANCE_MM / r),
+                            math.pi / 2.0)
         else:
-            end_quarter = GMachine.__quarter(delta_a - radius_a, delta_b - radius_b)
-
-        if start_quarter == end_quarter:
-            return
-
-        # If the start and end points are not in the same quarter, there will be new maximum values that have to be checked against
-        # boundry conditions
-        is_raise = False
-        quarter = start_quarter
-        prev_quarter = quarter
-        for _ in range(4):
-            if direction == CW:
-                quarter -= 1
-                if quarter == 0: quarter = 4
+            max_angle = math.pi / 2.0
+        n = int(math.ceil(abs(sweep) / max_angle))
+        if self.ARC_INTERPOLATION == 'auto':
+            if n > ARC_LINEARIZATION_MAX_SEGMENTS:
+                return None
+            v = velocity / SECONDS_IN_MINUTE
+            arc_length = math.hypot(abs(sweep) * r, dc, delta.e)
+            chord = 2.0 * r * math.sin(abs(sweep) / n / 2.0)
+            segment_length = math.hypot(chord, dc / n, delta.e / n)
+            if n * self.__movement_time(segment_length, v) \
+                    > ARC_LINEARIZATION_MAX_SLOWDOWN \
+                    * self.__movement_time(arc_length, v):
+                return None
+        # points are rounded to pulses, so rounding errors don't accumulate
+        segments = []
+        previous = Coordinates(0.0, 0.0, 0.0, 0.0)
+        for i in range(1, n + 1):
+            if i == n:
+                point = delta
             else:
-                quarter += 1
-                if quarter == 5: quarter = 1
-
-            if (quarter == 1 and prev_quarter == 4) or (quarter == 4 and prev_quarter == 1):
-                is_raise = (position_a + radius_a + radius > table_a)
-            elif (quarter == 1 and prev_quarter == 2) or (quarter == 2 and prev_quarter == 1):
-                is_raise = (position_b + radius_b + radius > table_b)
-            elif (quarter == 2 and prev_quarter == 3) or (quarter == 3 and prev_quarter == 2):
-                is_raise = (position_a + radius_a - radius < 0)
-            elif (quarter == 3 and prev_quarter == 4) or (quarter == 4 and prev_quarter == 3):
-                is_raise = (position_b + radius_b - radius < 0)
-            if is_raise:
-                raise GMachineException("circle out of bounds")
-
-            if quarter == end_quarter:
-                break
-            prev_quarter = quarter
-
+                angle = start_angle + sweep * i / n
+                a = r * math.cos(angle) - sa
+                b = r * math.sin(angle) - sb
+                c = dc * i / n
+                e = delta.e * i / n
+                if self._plane == PLANE_XY:
+                    point = Coordinates(a, b, c, e)
+                elif self._plane == PLANE_YZ:
+                    point = Coordinates(c, a, b, e)
+                else:  # self._plane == PLANE_ZX
+                    point = Coordinates(b, c, a, e)
+                point = point.round_to_nearest_pulse()
+            segments.append(point - previous)
+            previous = point
+        return segments
 
     def _move_circular(self, delta, radius, velocity, direction):
         delta = delta.round_to_nearest_pulse()
@@ -235,6 +278,25 @@ class GMachine(object):
                                 TABLE_SIZE_X_MM, STEPPER_PULSES_PER_MM_Z,
                                 STEPPER_PULSES_PER_MM_X)
         radius = radius.round_to_nearest_pulse()
+        if self._plane == PLANE_XY:
+            ra, rb = radius.x, radius.y
+        elif self._plane == PLANE_YZ:
+            ra, rb = radius.y, radius.z
+        else:  # self._plane == PLANE_ZX
+            ra, rb = radius.z, radius.x
+        if ra == 0.0 and rb == 0.0:
+            # radius is less than a single pulse, arc is a line
+            self._move_linear(delta, velocity)
+            return
+        segments = self._linearize_arc(delta, radius, velocity, direction)
+        if segments is not None:
+            logging.info("Moving circularly {} {} {} with radius {} as {} "
+                         "linear segments".format(self._plane, delta,
+                                                  direction, radius,
+                                                  len(segments)))
+            for segment in segments:
+                self._move_linear(segment, velocity)
+            return
         logging.info("Moving circularly {} {} {} with radius {}"
                      " and velocity {}".format(self._plane, delta,
                                                direction, radius, velocity))
@@ -244,6 +306,32 @@ class GMachine(object):
         # do movements
         extruder_speed = self._get_extruder_speed(delta, velocity)
         self._start_extruder_move(delta.e, extruder_speed)
+        gen.line = self._line
+        hal.move(gen)
+        # save position
+        self._position = self._position + delta
+
+    def _move_bezier(self, delta, control1, control2, velocity):
+        delta = delta.round_to_nearest_pulse()
+        if self._plane != PLANE_XY:
+            raise GMachineException("cubic spline is supported in XY plane "
+                                    "only")
+        if delta.is_zero() and control1.is_zero() and control2.is_zero():
+            return
+        gen = PulseGeneratorBezier(delta, control1, control2, velocity)
+        # the whole curve should be inside table, not only end point
+        low, high = gen.bounds()
+        self.__check_delta(low)
+        self.__check_delta(high)
+        self.__check_delta(delta)
+        logging.info("Moving by cubic spline {} with control points {} {}"
+                     " and velocity {}".format(delta, control1, control2,
+                                               velocity))
+        self.__check_velocity(gen.max_velocity())
+        # do movements
+        extruder_speed = self._get_extruder_speed(delta, velocity)
+        self._start_extruder_move(delta.e, extruder_speed)
+        gen.line = self._line
         hal.move(gen)
         # save position
         self._position = self._position + delta
@@ -318,7 +406,9 @@ class GMachine(object):
         """
         if gcode is None:
             return None
+        self._line = gcode.line
         answer = None
+        spline_control = None
         logging.debug("got command " + str(gcode.params))
         # read command
         c = gcode.command()
@@ -341,7 +431,9 @@ class GMachine(object):
         if velocity < MIN_VELOCITY_MM_PER_MIN:
             raise GMachineException("feed speed too low")
         # select command and run it
-        if c == 'G0':  # rapid move
+        if c == 'G0' and self.DECOUPLED_RAPIDS and delta.e == 0.0:
+            self._move_rapid(delta)
+        elif c == 'G0':  # rapid move
             vl = max(MAX_VELOCITY_MM_PER_MIN_X,
                      MAX_VELOCITY_MM_PER_MIN_Y,
                      MAX_VELOCITY_MM_PER_MIN_Z,
@@ -372,6 +464,26 @@ class GMachine(object):
             self._move_circular(delta, radius, velocity, CW)
         elif c == 'G3':  # circular interpolation, counterclockwise
             self._move_circular(delta, radius, velocity, CCW)
+        elif c == 'G5':  # cubic spline
+            # first control point is relative to the current position, the
+            # second one is relative to the end point
+            if gcode.has('I') or gcode.has('J'):
+                control1 = Coordinates(
+                    gcode.get('I', 0.0, self._convertCoordinates),
+                    gcode.get('J', 0.0, self._convertCoordinates), 0, 0)
+            elif self._spline_control is not None:
+                # continue previous spline smoothly
+                control1 = Coordinates(-self._spline_control.x,
+                                       -self._spline_control.y, 0, 0)
+            else:
+                raise GMachineException("I and J are not specified")
+            if not gcode.has('P') or not gcode.has('Q'):
+                raise GMachineException("P and Q are not specified")
+            control2 = Coordinates(
+                gcode.get('P', 0.0, self._convertCoordinates),
+                gcode.get('Q', 0.0, self._convertCoordinates), 0, 0)
+            self._move_bezier(delta, control1, delta + control2, velocity)
+            spline_control = control2
         elif c == 'G4':  # delay in s
             if not gcode.has('P'):
                 raise GMachineException("P is not specified")
@@ -434,6 +546,12 @@ class GMachine(object):
             hal.join()
             p = self.position()
             answer = "X:{} Y:{} Z:{} E:{}".format(p.x, p.y, p.z, p.e)
+        elif c == 'M408':  # report buffer health metrics
+            m = hal.get_metrics()
+            answer = "moves:{} streamed:{} underruns:{} min_lead_us:{} " \
+                     "sleep_s:{}".format(m["moves"], m["streamed_moves"],
+                                         m["underruns"], m["min_lead_us"],
+                                         round(m["sleep_s"], 3))
         elif c == 'T':  # select tool (extruder)
             self._set_extruder(int(gcode.get('T')))
         elif c is None:  # command not specified(ie just F was passed)
@@ -449,5 +567,6 @@ class GMachine(object):
             raise GMachineException("unknown command")
         # save parameters on success
         self._velocity = velocity
+        self._spline_control = spline_control
         logging.debug("position {}".format(self._position))
         return answer
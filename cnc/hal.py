@@ -76,6 +76,16 @@
 #        do_something()
 #
 #
+#    def get_metrics():
+#        """ Get buffer health metrics of moves.
+#        :return: dict with number of moves, number of streamed moves, number
+#                 of buffer underruns, minimum time in microseconds which was
+#                 prepared ahead of hardware, time spent waiting for buffer
+#                 space and the same values for the last move.
+#        """
+#        return get_something()
+#
+#
 #    def join():
 #        """ Wait till motors work.
 #        """
@@ -127,6 +137,8 @@ if 'move' not in locals():
     raise NotImplementedError("hal.move() not implemented")
 if 'get_extruder' not in locals():
     raise NotImplementedError("hal.get_extruder() not implemented")
+if 'get_metrics' not in locals():
+    raise NotImplementedError("hal.get_metrics() not implemented")
 if 'join' not in locals():
     raise NotImplementedError("hal.join() not implemented")
 if 'deinit' not in locals():
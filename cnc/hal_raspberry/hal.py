@@ -1,4 +1,6 @@
 import time
+import json
+from collections import deque
 
 from cnc.hal_raspberry import rpgpio
 from cnc.pulses import *
@@ -6,17 +8,39 @@ from cnc.config import *
 from cnc.sensors import thermistor
 from cnc.actuators.servo_motor import ServoMotor
 from cnc.actuators.extruder import Extruder
+from cnc.pulse_cache import PulseCache
+from cnc.generation_rate import GenerationRate
 
 US_IN_SECONDS = 1000000
+# all pulses times are integer ticks of DMA clock, see TICKS_PER_SECOND and
+# PULSE_LENGTH_TICKS in pulses.py
+# maximum number of events which are written to DMA buffer at once
+DMA_BATCH_EVENTS = 256
+STEP_PINS_MASK = STEP_PIN_MASK_X | STEP_PIN_MASK_Y | STEP_PIN_MASK_Z
 
 gpio = rpgpio.GPIO()
 dma = rpgpio.DMAGPIO()
 pwm = rpgpio.DMAPWM()
 watchdog = rpgpio.DMAWatchdog()
 
-STEP_PIN_MASK_X = 1 << STEPPER_STEP_PIN_X
-STEP_PIN_MASK_Y = 1 << STEPPER_STEP_PIN_Y
-STEP_PIN_MASK_Z = 1 << STEPPER_STEP_PIN_Z
+# mask of direction pins which are high now, None if it is unknown
+_direction_pins = None
+# speed of pulses generation for each generator type and for cache copying
+generation_rate = GenerationRate()
+# DMA buffer health, see get_metrics()
+_metrics = {"moves": 0, "streamed_moves": 0, "underruns": 0,
+            "min_lead_us": None, "sleep_s": 0.0, "wait_s": 0.0,
+            "last_move": None}
+# records of the last moves, see get_move_records()
+_records = deque(maxlen=MOVE_RECORDS_SIZE)
+_records_file = None
+# record of move which DMA is running
+_running = None
+
+if PULSE_CACHE_SIZE > 0:
+    pulse_cache = PulseCache(PULSE_CACHE_SIZE)
+else:
+    pulse_cache = None
 
 # will be populated in init()
 extruders = []
@@ -25,6 +49,9 @@ extruders = []
 def init():
     """ Initialize GPIO pins and machine itself.
     """
+    global _records_file
+    if MOVE_RECORDS_FILE is not None and _records_file is None:
+        _records_file = open(MOVE_RECORDS_FILE, "a")
     gpio.init(STEPPER_STEP_PIN_X, rpgpio.GPIO.MODE_OUTPUT)
     gpio.init(STEPPER_STEP_PIN_Y, rpgpio.GPIO.MODE_OUTPUT)
     gpio.init(STEPPER_STEP_PIN_Z, rpgpio.GPIO.MODE_OUTPUT)
@@ -201,15 +228,51 @@ def calibrate(x, y, z):
     # enable steppers
     gpio.clear(STEPPERS_ENABLE_PIN)
     logging.info("hal calibrate, x={}, y={}, z={}".format(x, y, z))
+    # direction pins are written directly
+    global _direction_pins
+    _direction_pins = None
     if not __calibrate_private(x, y, z, True):  # move from endstop switch
         return False
     return __calibrate_private(x, y, z, False)  # move to endstop switch
 
 
+def _batches(events):
+    """ Split events into lists which are written to DMA buffer at once.
+    :param events: iterable with events from PulseGenerator.gpio_events().
+    :return: generator of lists with up to DMA_BATCH_EVENTS events.
+    """
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) >= DMA_BATCH_EVENTS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def warmup(events):
+    """ Write events to DMA buffer without running it, so JIT compiles buffer
+        writing before the first move. Buffer is cleared after each batch,
+        nothing is written if DMA is active.
+    :param events: iterable with events from PulseGenerator.gpio_events().
+    :return: number of events.
+    """
+    count = 0
+    write = not dma.is_active()
+    for batch in _batches(events):
+        if write:
+            dma.add_events(batch)
+            dma.clear()
+        count += len(batch)
+    return count
+
+
 def move(generator):
     """ Move head to specified position
     :param generator: PulseGenerator object.
     """
+    global _direction_pins, _running
     # Fill buffer right before currently running(previous sequence) dma
     # this mode implements kind of round buffer, but protects if CPU is not
     # powerful enough to calculate buffer in advance, faster then machine
@@ -218,90 +281,234 @@ def move(generator):
 
     # enable steppers
     gpio.clear(STEPPERS_ENABLE_PIN)
-    # 4 control blocks per 32 bytes
-    bytes_per_iter = 4 * dma.control_block_size()
+    # delay and write control blocks for each event
+    bytes_per_event = 2 * dma.control_block_size()
+    # identical moves are copied from cache, writes of direction pins depend
+    # on their state before move
+    key = None
+    recording = None
+    events = None
+    if pulse_cache is not None:
+        key = (generator.cache_key(), _direction_pins)
+        events = pulse_cache.get(key)
+    generated = events is None
+    if not generated:
+        _direction_pins = pulse_cache.data(key)
+    else:
+        events = generator.gpio_events(TICKS_PER_SECOND, PULSE_LENGTH_TICKS,
+                                       _direction_pins)
+        if key is not None:
+            recording = []
+    # kind of moves for generation rate estimation
+    if generated:
+        kind = generator.__class__.__name__
+    else:
+        kind = "cache"
+    total_s = generator.total_time_s()
     # prepare and run dma
     dma.clear()  # should just clear current address, but not stop current DMA
-    prev = 0
     is_ran = False
     instant = INSTANT_RUN
     st = time.time()
+    mt = st  # when rate measurement started
+    slept = 0.0  # time spent waiting for buffer space since mt
     current_cb = 0
     k = 0
     k0 = 0
-    for direction, tx, ty, tz, te in generator:
+    preroll = None
+    # buffer offsets and ticks of written batches which DMA hasn't passed
+    # yet, to find how far writing is ahead of streaming DMA
+    marks = deque(((0, 0), ))
+    min_lead = None
+    underruns = 0
+    underrun = False
+    pulses = 0
+    started = None
+    waited = 0.0  # time spent waiting for the previous move to finish
+    active = False  # if previous dma sequence was seen running
+    for batch in _batches(events):
         if current_cb is not None:
-            while dma.current_address() + bytes_per_iter >= current_cb:
+            while dma.current_address() + bytes_per_event * len(batch) \
+                    >= current_cb:
+                sl = time.time()
                 time.sleep(0.001)
+                slept += time.time() - sl
                 current_cb = dma.current_control_block()
                 if current_cb is None:
+                    _dma_stopped(active)
                     k0 = k
                     st = time.time()
                     break  # previous dma sequence has stopped
-        if direction:  # set up directions
-            pins_to_set = 0
-            pins_to_clear = 0
-            if tx > 0:
-                pins_to_clear |= 1 << STEPPER_DIR_PIN_X
-            elif tx < 0:
-                pins_to_set |= 1 << STEPPER_DIR_PIN_X
-            if ty > 0:
-                pins_to_clear |= 1 << STEPPER_DIR_PIN_Y
-            elif ty < 0:
-                pins_to_set |= 1 << STEPPER_DIR_PIN_Y
-            if tz > 0:
-                pins_to_clear |= 1 << STEPPER_DIR_PIN_Z
-            elif tz < 0:
-                pins_to_set |= 1 << STEPPER_DIR_PIN_Z
-            # ignore te
-            dma.add_set_clear(pins_to_set, pins_to_clear)
-            continue
-        pins = 0
-        m = None
-        for i in (tx, ty, tz, te):
-            if i is not None and (m is None or i < m):
-                m = i
-        k = int(round(m * US_IN_SECONDS))
-        if tx is not None:
-            pins |= STEP_PIN_MASK_X
-        if ty is not None:
-            pins |= STEP_PIN_MASK_Y
-        if tz is not None:
-            pins |= STEP_PIN_MASK_Z
-        # ignore te
-        if k - prev > 0:
-            dma.add_delay(k - prev)
-        dma.add_pulse(pins, STEPPER_PULSE_LENGTH_US)
-        # TODO not a precise way! pulses will set in queue, instead of crossing
-        # if next pulse start during pulse length. Though it almost doesn't
-        # matter for pulses with 1-2us length.
-        prev = k + STEPPER_PULSE_LENGTH_US
+                active = True
+        if recording is not None:
+            recording.extend(batch)
+            if not pulse_cache.fits(len(recording)):
+                recording = None
+        dma.add_events(batch)
+        for delay, pins_set, _ in batch:
+            k += delay
+            if pins_set & STEP_PINS_MASK:
+                pulses += bin(pins_set & STEP_PINS_MASK).count("1")
+        if is_ran:
+            position = dma.current_control_block()
+            if position is None:
+                # DMA stopped at the end of written data
+                lead = 0
+            else:
+                while len(marks) > 1 and marks[1][0] <= position:
+                    marks.popleft()
+                a0, k0m = marks[0]
+                lead = k - k0m
+                if len(marks) > 1:
+                    a1, k1m = marks[1]
+                    lead -= (k1m - k0m) * (position - a0) // (a1 - a0)
+            marks.append((dma.current_address(), k))
+            if min_lead is None or lead < min_lead:
+                min_lead = lead
+            if lead <= 0 and not underrun:
+                underruns += 1
+                logging.warning("DMA buffer underrun, {}s of move is "
+                                "written".format(k / float(TICKS_PER_SECOND)))
+            underrun = lead <= 0
+        else:
+            marks.append((dma.current_address(), k))
         # instant run handling
         if not is_ran and instant and current_cb is None:
-            if k - k0 > 100000:  # wait at least 100 ms is uploaded
+            if preroll is None:
+                # predict how much should be buffered with the previous moves
+                left_s = total_s - k0 / float(TICKS_PER_SECOND)
+                preroll = GenerationRate.preroll(
+                    left_s, generation_rate.rate(kind), INSTANT_RUN_MARGIN_S)
+                # buffer the whole move if generation is too slow
+                instant = preroll < left_s
+            ng = (k - k0) / float(TICKS_PER_SECOND)
+            if instant and ng > preroll:
+                # check prediction with rate of this move
                 nt = time.time() - st
-                ng = (k - k0) / 1000000.0
-                if nt > ng:
-                    logging.warn("Buffer preparing for instant run took more "
-                                 "time then buffer time"
-                                 " {}/{}".format(nt, ng))
+                rate = None
+                if nt > 0.0:
+                    rate = ng / nt
+                left_s = total_s - k0 / float(TICKS_PER_SECOND)
+                preroll = GenerationRate.preroll(left_s, rate,
+                                                 INSTANT_RUN_MARGIN_S)
+                if preroll >= left_s:
+                    logging.warning("Buffer preparing for instant run is "
+                                    "slower then movement, rate {}"
+                                    .format(rate))
                     instant = False
-                else:
+                elif ng > preroll:
                     dma.run_stream()
+                    started = time.time()
                     is_ran = True
     pt = time.time()
     if not is_ran:
         # after long command, we can fill short buffer, that why we may need to
         #  wait until long command finishes
+        wt = time.time()
         while dma.is_active():
+            active = True
             time.sleep(0.01)
+        waited = time.time() - wt
+        _dma_stopped(active)
         dma.run(False)
+        started = time.time()
     else:
         # stream mode can be activated only if previous command was finished.
         dma.finalize_stream()
+    generation_rate.update(kind, k / float(TICKS_PER_SECOND),
+                           pt - mt - slept)
+    if min_lead is not None:
+        min_lead = min_lead * US_IN_SECONDS // TICKS_PER_SECOND
+    _update_metrics(is_ran, min_lead, underruns, slept, waited)
+    _running = {"line": generator.line,
+                "generator": generator.__class__.__name__,
+                "cached": not generated, "pulses": pulses,
+                "control_blocks": (dma.current_address()
+                                   // dma.control_block_size()),
+                "cma_bytes": dma.current_address(),
+                "generation_s": pt - mt - slept, "estimated_s": total_s,
+                "min_lead_us": min_lead, "underruns": underruns,
+                "streamed": is_ran, "started": started, "dma_s": None}
+    _records.append(_running)
+    if generated:
+        _direction_pins = generator.direction_pins()
+        if recording is not None:
+            pulse_cache.put(key, recording, _direction_pins)
 
     logging.info("prepared in " + str(round(pt - st, 2)) + "s, estimated in "
                  + str(round(generator.total_time_s(), 2)) + "s")
+    if pulse_cache is not None:
+        logging.debug("pulse cache {}".format(pulse_cache.statistics()))
+
+
+def _update_metrics(streamed, min_lead_us, underruns, sleep_s, wait_s):
+    """ Add move to buffer health metrics.
+    :param streamed: boolean, True if DMA was started before move was written.
+    :param min_lead_us: minimum time which was written ahead of DMA or None if
+                        move wasn't streamed.
+    :param underruns: number of times DMA reached the end of written data.
+    :param sleep_s: time spent waiting for buffer space.
+    :param wait_s: time spent waiting for the previous move to finish before
+                   running buffered move.
+    """
+    _metrics["moves"] += 1
+    if streamed:
+        _metrics["streamed_moves"] += 1
+    _metrics["underruns"] += underruns
+    _metrics["sleep_s"] += sleep_s
+    _metrics["wait_s"] += wait_s
+    if min_lead_us is not None and (_metrics["min_lead_us"] is None
+                                    or min_lead_us < _metrics["min_lead_us"]):
+        _metrics["min_lead_us"] = min_lead_us
+    _metrics["last_move"] = {"streamed": streamed,
+                             "min_lead_us": min_lead_us,
+                             "underruns": underruns,
+                             "sleep_s": sleep_s, "wait_s": wait_s}
+
+
+def _dma_stopped(active):
+    """ Complete record of move which DMA was running.
+    :param active: boolean, True if DMA was seen running right before it
+                   stopped, otherwise it stopped at unknown time and actual
+                   DMA time is left None.
+    """
+    global _running
+    if _running is None:
+        return
+    if active:
+        _running["dma_s"] = time.time() - _running["started"]
+    if _records_file is not None:
+        _records_file.write(json.dumps(_running, sort_keys=True) + "\n")
+        _records_file.flush()
+    _running = None
+
+
+def get_move_records():
+    """ Get records of the last moves, see MOVE_RECORDS_SIZE in config.
+    :return: list of dicts, the oldest move first. Each dict has gcode 'line'
+             number, 'generator' class name, 'cached' flag, number of
+             'pulses', 'control_blocks' and 'cma_bytes' written to DMA
+             buffer, 'generation_s' time, 'estimated_s' movement time,
+             'min_lead_us' (None if move wasn't streamed), 'underruns',
+             'streamed' flag, 'started' time of DMA and 'dma_s' actual DMA
+             time. DMA time is known when DMA is seen stopping by the next
+             move or join(), otherwise it is None.
+    """
+    return [dict(r) for r in _records]
+
+
+def get_metrics():
+    """ Get DMA buffer health metrics.
+    :return: dict with number of moves, number of moves which were streamed,
+             number of underruns, minimum time in microseconds which was
+             written ahead of DMA, total time spent waiting for buffer space,
+             total time spent waiting for the previous move to finish and
+             the same values for the last move.
+    """
+    metrics = dict(_metrics)
+    if metrics["last_move"] is not None:
+        metrics["last_move"] = dict(metrics["last_move"])
+    return metrics
 
 
 def get_extruder(id):
@@ -318,19 +525,26 @@ def join():
         extruder.join()
 
     # wait till dma works
+    active = False
     while dma.is_active():
+        active = True
         time.sleep(0.01)
+    _dma_stopped(active)
 
 
 def deinit():
     """ De-initialize hardware.
     """
+    global _records_file
     join()
     disable_steppers()
     pwm.remove_all()
     for extruder_config in EXTRUDER_CONFIG:
         gpio.clear(extruder_config['pin'])
     watchdog.stop()
+    if _records_file is not None:
+        _records_file.close()
+        _records_file = None
 
 
 def watchdog_feed():
@@ -83,6 +83,8 @@ class GPIO(object):
 class DMAGPIO(DMAProto):
     _DMA_CONTROL_BLOCK_SIZE = 32
     _DMA_CHANNEL = 4
+    # delay resolution, each tick is one 4 bytes word written to PWM FIFO
+    TICKS_PER_US = 4
 
     def __init__(self):
         """ Create object which control GPIO pins via DMA(Direct Memory
@@ -151,16 +153,54 @@ class DMAGPIO(DMAProto):
         self._phys_memory.write(self.__current_address, "24I", data)
         self.__current_address = next_cb
 
+    def add_events(self, events):
+        """ Add sequence of delays and pins changes at the current position.
+            It is the same as calling add_delay_ticks() and add_set_clear()
+            for each event, but all control blocks are packed and written at
+            once.
+            :param events: list of tuples (delay_ticks, pins_to_set,
+                           pins_to_clear). Delay is added before pins change,
+                           zero delay doesn't take control block.
+        """
+        size = self._DMA_CONTROL_BLOCK_SIZE
+        bus_address = self._phys_memory.get_bus_address()
+        address = bus_address + self.__current_address
+        data = []
+        for delay_ticks, pins_to_set, pins_to_clear in events:
+            if delay_ticks > 0:
+                address += size
+                # last 8 bytes are padding, use it to store data
+                data.extend((self._delay_info, address - 8,
+                             self._delay_destination, delay_ticks << 2,
+                             self._delay_stride, address, 0, 0))
+            address += size
+            data.extend((self._pulse_info, address - 8,
+                         self._pulse_destination, self._pulse_length,
+                         self._pulse_stride, address, pins_to_set,
+                         pins_to_clear))
+        next_cb = address - bus_address
+        if next_cb > self._phys_memory.get_size():
+            raise MemoryError("Out of allocated memory.")
+        self._phys_memory.write(self.__current_address,
+                                str(len(data)) + "I", data)
+        self.__current_address = next_cb
+
     def add_delay(self, delay_us):
         """ Add delay at the current position.
             :param delay_us: delay in us.
         """
+        self.add_delay_ticks(delay_us * self.TICKS_PER_US)
+
+    def add_delay_ticks(self, delay_ticks):
+        """ Add delay at the current position.
+            :param delay_ticks: delay in ticks, see TICKS_PER_US.
+        """
         next_cb = self.__current_address + self._DMA_CONTROL_BLOCK_SIZE
         if next_cb > self._phys_memory.get_size():
             raise MemoryError("Out of allocated memory.")
         next1 = self._phys_memory.get_bus_address() + next_cb
         source = next1 - 8  # last 8 bytes are padding, use it to store data
-        length = delay_us << 4  # * 16
+        length = delay_ticks << 2  # * 4
         data = (
                 self._delay_info, source, self._delay_destination, length,
                 self._delay_stride, next1, 0, 0
@@ -353,7 +393,7 @@ class DMAPWM(DMAProto):
     def remove_all(self):
         """ Remove all pins from PWM and stop it.
         """
-        pins_list = self._clear_pins.keys()
+        pins_list = list(self._clear_pins.keys())
         for pin in pins_list:
             self.remove_pin(pin)
         assert len(self._clear_pins) == 0
@@ -0,0 +1,607 @@
+""" Emulation of Raspberry Pi hardware which is used by rpgpio.
+    It is enabled with PYCNC_EMULATE_RPI environment variable, in this case
+    rpgpio_private doesn't detect board and uses PhysicalMemory and
+    CMAPhysicalMemory from this module, so rpgpio and hal_raspberry run
+    unmodified on any Linux machine, e.g. for profiling and tests.
+    Peripherals registers and CMA buffers are anonymous memory maps. Writes
+    and reads of GPIO and DMA registers are handled by emulator, other
+    registers just keep written values. DMA channels walk control blocks
+    chains in emulated time, which goes with wall clock multiplied by speed
+    (see Emulator.set_speed()) and stops while emulator works, so emulation
+    overhead isn't visible to emulated hardware. Channel is moved to the
+    current time each time its registers are read or its buffer is written,
+    so DMA never executes control blocks which were written after it should
+    have reached them.
+    If Emulator.record is set, each write to GPIO set and clear registers is
+    recorded to timeline with emulated time in nanoseconds, input pins can be
+    changed with Emulator.set_input().
+    Timing model:
+    - transfers to PWM FIFO paced with DREQ take 1/PWM_FIFO_WORDS_PER_US us
+      for each word, it is the rate which DMAGPIO delays rely on,
+    - other transfers are instant on full DMA channels,
+    - each control block takes LITE_CONTROL_BLOCK_NS on lite channels, plus
+      BYTE_WAIT_NS for each byte and each wait cycle.
+    Looping chains are executed once after each change, the next cycles
+    just repeat GPIO writes of the first one.
+"""
+
+from __future__ import division
+import bisect
+import mmap
+import struct
+import threading
+import time
+
+from .rpgpio_private import PAGE_SIZE, PERI_BASE, GPIO_REGISTER_BASE, \
+    GPIO_INPUT_OFFSET, GPIO_SET_OFFSET, GPIO_CLEAR_OFFSET, GPIO_FSEL_OFFSET, \
+    GPIO_PULLUPDN_OFFSET, GPIO_PULLUPDNCLK_OFFSET, DMA_BASE, DMA_CS, \
+    DMA_CONBLK_AD, DMA_NEXTCONBK, DMA_TI_SRC_INC, DMA_TI_DEST_INC, \
+    DMA_SRC_IGNORE, DMA_DEST_IGNORE, DMA_TI_TDMODE, DMA_TI_DEST_DREQ, \
+    DMA_CS_RESET, DMA_CS_ABORT, DMA_CS_ACTIVE, DMA_TI_PER_MAP_PWM
+
+PERIPHERALS_BUS = 0x7E000000
+PERIPHERALS_SIZE = 0x01000000
+GPIO_SET_BUS = PERIPHERALS_BUS + GPIO_REGISTER_BASE + GPIO_SET_OFFSET
+GPIO_CLEAR_BUS = PERIPHERALS_BUS + GPIO_REGISTER_BASE + GPIO_CLEAR_OFFSET
+# fake addresses of CMA buffers
+CMA_PHYS_BASE = 0x10000000
+CMA_BUS_FLAGS = 0xC0000000
+DMA_CHANNELS = 15
+DMA_LITE_CHANNELS = range(7, 15)
+# DMAGPIO.TICKS_PER_US
+PWM_FIFO_WORDS_PER_US = 4
+# DMAPWM makes ~90 Hz with 32768 control blocks
+LITE_CONTROL_BLOCK_NS = 339
+# DMAWatchdog timeouts in ~15 s with 2047 blocks of 65535 bytes with 31 waits
+BYTE_WAIT_NS = 3.5
+
+
+class DMAChannel(object):
+    def __init__(self, emulator, number):
+        """ Create stopped channel.
+        :param emulator: Emulator object.
+        :param number: channel number.
+        """
+        self._emulator = emulator
+        self.number = number
+        self.lite = number in DMA_LITE_CHANNELS
+        self.active = False
+        self.control_block = 0  # bus address of the current control block
+        self.next_control_block = None  # written to NEXTCONBK register
+        self.time = 0  # when the current control block starts, ns
+        self.buffer = None  # CMAPhysicalMemory with the current block
+        # Looping chain: the first control block, time when the current
+        # cycle started, duration of cycle, start time and address of each
+        # control block and GPIO writes during cycle relatively to its start,
+        # index of the next write to repeat.
+        self._first = 0
+        self._first_time = None
+        self._period = None
+        self._cycle_blocks = None
+        self._cycle_writes = None
+        self._cycle_index = 0
+
+    def start(self, control_block, now):
+        """ Start chain.
+        :param control_block: bus address of the first control block.
+        :param now: current emulated time.
+        """
+        self.active = control_block != 0
+        self.control_block = control_block
+        self.next_control_block = None
+        self.time = now
+        self.buffer = self._emulator.find_buffer(control_block)
+        self._first = control_block
+        self.invalidate()
+        self._start_cycle()
+
+    def stop(self):
+        """ Stop chain.
+        """
+        self.active = False
+        self.control_block = 0
+        self.buffer = None
+        self.invalidate()
+
+    def invalidate(self):
+        """ Forget chain cycle, should be called when chain is changed.
+        """
+        self._first_time = None
+        self._period = None
+        self._cycle_blocks = None
+        self._cycle_writes = None
+
+    def _start_cycle(self):
+        self._first_time = self.time
+        self._cycle_blocks = ([], [])
+        self._cycle_writes = []
+
+    def advance(self, target):
+        """ Execute control blocks till specified time.
+        :param target: emulated time.
+        """
+        if self._period is not None:
+            self._repeat(target)
+            return
+        while self.active:
+            buf = self.buffer
+            offset = self.control_block - buf.get_bus_address()
+            info, source, destination, length, stride, next_cb, _, _ = \
+                struct.unpack_from("8I", buf._memmap, offset)
+            duration = self._duration(info, length)
+            if self.time + duration > target:
+                break  # the current control block is in progress
+            if self._cycle_blocks is not None:
+                self._cycle_blocks[0].append(self.time - self._first_time)
+                self._cycle_blocks[1].append(self.control_block)
+            self._emulator.capture = self._cycle_writes
+            self._execute(info, source, destination, length, stride,
+                          self.time)
+            self._emulator.capture = None
+            self.time += duration
+            if self.next_control_block is not None:
+                next_cb = self.next_control_block
+                self.next_control_block = None
+            if next_cb == 0:
+                self.stop()
+                break
+            if not buf.contains(next_cb):
+                buf = self._emulator.find_buffer(next_cb)
+            self.control_block = next_cb
+            self.buffer = buf
+            if next_cb == self._first:
+                if self._cycle_blocks is None:
+                    self._start_cycle()
+                    continue
+                # chain is a loop, the next cycles are the same
+                self._period = self.time - self._first_time
+                if self._period <= 0:
+                    raise RuntimeError("DMA channel {} loops without delays"
+                                       .format(self.number))
+                self._cycle_writes = [(t - self._first_time, s, c)
+                                      for t, s, c in self._cycle_writes]
+                self._first_time = self.time
+                self._cycle_index = 0
+                self._repeat(target)
+                return
+
+    def _repeat(self, target):
+        """ Move looping chain till specified time without executing control
+            blocks, GPIO writes of the first cycle are repeated.
+        :param target: emulated time.
+        """
+        writes = self._cycle_writes
+        while True:
+            i = self._cycle_index
+            while i < len(writes) and self._first_time + writes[i][0] \
+                    <= target:
+                self._emulator.gpio_write(self._first_time + writes[i][0],
+                                          writes[i][1], writes[i][2])
+                i += 1
+            self._cycle_index = i
+            if i < len(writes) or self._first_time + self._period > target:
+                break
+            self._first_time += self._period
+            self._cycle_index = 0
+        times, blocks = self._cycle_blocks
+        i = bisect.bisect_right(times, target - self._first_time) - 1
+        self.time = self._first_time + times[i]
+        self.control_block = blocks[i]
+
+    def _duration(self, info, length):
+        """ Calculate time of control block execution.
+        :return: duration in nanoseconds.
+        """
+        if info & DMA_TI_TDMODE:
+            total = ((length >> 16) & 0x3fff) * (length & 0xffff)
+        else:
+            total = length
+        duration = 0
+        if info & DMA_TI_DEST_DREQ \
+                and (info >> 16) & 0x1f == DMA_TI_PER_MAP_PWM:
+            duration = total // 4 * 1000 // PWM_FIFO_WORDS_PER_US
+        elif self.lite:
+            waits = (info >> 21) & 0x1f
+            duration = int(total * waits * BYTE_WAIT_NS)
+        if self.lite:
+            duration += LITE_CONTROL_BLOCK_NS
+        return duration
+
+    def _execute(self, info, source, destination, length, stride, t):
+        """ Execute transfers of control block.
+        """
+        if info & DMA_DEST_IGNORE or (info & DMA_TI_DEST_DREQ and (
+                info >> 16) & 0x1f == DMA_TI_PER_MAP_PWM):
+            return  # nothing is written or it is PWM FIFO
+        if info & DMA_TI_TDMODE:
+            count = (length >> 16) & 0x3fff
+            size = length & 0xffff
+        else:
+            count = 1
+            size = length
+        emulator = self._emulator
+        if info & DMA_SRC_IGNORE:
+            pass
+        elif (info & DMA_TI_TDMODE and destination == GPIO_SET_BUS
+                and count == 2 and size == 4 and stride == (12 << 16 | 4)
+                and not info & (DMA_TI_SRC_INC | DMA_TI_DEST_INC)):
+            # DMAGPIO pins change, the most frequent case
+            emulator.gpio_write(t, emulator.read_bus(source),
+                                emulator.read_bus(source + 4))
+            return
+        elif size == 4 and count == 1 and destination in (GPIO_SET_BUS,
+                                                          GPIO_CLEAR_BUS):
+            # DMAPWM pins change
+            value = emulator.read_bus(source)
+            if destination == GPIO_SET_BUS:
+                emulator.gpio_write(t, value, 0)
+            else:
+                emulator.gpio_write(t, 0, value)
+            return
+        self._transfer(info, source, destination, count, size, stride, t)
+
+    def _transfer(self, info, source, destination, count, size, stride, t):
+        """ Copy data word by word.
+        """
+        source_stride = stride & 0xffff
+        destination_stride = (stride >> 16) & 0xffff
+        for _ in range(count):
+            s = source
+            d = destination
+            for _ in range(size // 4):
+                if info & DMA_SRC_IGNORE:
+                    value = 0
+                else:
+                    value = self._emulator.read_bus(s)
+                self._emulator.write_bus(d, value, t)
+                if info & DMA_TI_SRC_INC:
+                    s += 4
+                if info & DMA_TI_DEST_INC:
+                    d += 4
+            source = s + source_stride
+            destination = d + destination_stride
+
+
+class Emulator(object):
+    def __init__(self):
+        """ Create emulator with all pins low and stopped DMA.
+        """
+        self._lock = threading.RLock()
+        self._registers = dict()  # physical address of page -> mmap
+        self._buffers = []
+        self._next_phys = CMA_PHYS_BASE
+        self._channels = [DMAChannel(self, i) for i in range(DMA_CHANNELS)]
+        self._levels = 0
+        self._inputs = dict()
+        self._pulls = dict()
+        self._speed = 1.0
+        self._wall = time.time()
+        self._base = 0
+        self._paused = 0
+        self._pause_time = None
+        # wall time spent executing control blocks, it isn't emulated time
+        # and can be excluded from profiling
+        self.busy_s = 0.0
+        # GPIO writes are recorded to timeline if True, it may take a lot
+        # of memory for long jobs
+        self.record = False
+        self._timeline = []
+        # list to collect GPIO writes of looping DMA chain cycle
+        self.capture = None
+
+    def now(self):
+        """ Get emulated time.
+        :return: time in nanoseconds since emulator was created.
+        """
+        if self._paused:
+            wall = self._pause_time
+        else:
+            wall = time.time()
+        return self._base + int((wall - self._wall) * self._speed
+                                * 1000000000)
+
+    def _pause(self):
+        """ Stop emulated time while emulator executes control blocks, so
+            its own slowness doesn't affect emulated hardware.
+        """
+        if self._paused == 0:
+            self._pause_time = time.time()
+        self._paused += 1
+
+    def _resume(self):
+        self._paused -= 1
+        if self._paused == 0:
+            busy = time.time() - self._pause_time
+            self._wall += busy
+            self.busy_s += busy
+
+    def set_speed(self, speed):
+        """ Set how many times emulated time goes faster than wall clock.
+        :param speed: positive number.
+        """
+        with self._lock:
+            self._base = self.now()
+            self._wall = time.time()
+            self._speed = float(speed)
+
+    def set_input(self, pin, value):
+        """ Set level of input pin, e.g. end stop switch.
+        :param pin: pin number.
+        :param value: 0 or 1, None to use pull up or pull down level.
+        """
+        with self._lock:
+            if value is None:
+                self._inputs.pop(pin, None)
+            else:
+                self._inputs[pin] = 1 if value else 0
+
+    def levels(self):
+        """ Get GPIO outputs levels.
+        :return: bitwise mask of pins with high level.
+        """
+        with self._lock:
+            self.advance()
+            return self._levels
+
+    def timeline(self):
+        """ Get recorded writes to GPIO set and clear registers.
+        :return: list of tuples (time_ns, pins_to_set, pins_to_clear).
+        """
+        with self._lock:
+            self.advance()
+            return sorted(self._timeline, key=lambda w: w[0])
+
+    def clear_timeline(self):
+        """ Remove recorded writes.
+        """
+        with self._lock:
+            self.advance()
+            self._timeline = []
+
+    def advance(self):
+        """ Execute DMA control blocks till the current time.
+        """
+        with self._lock:
+            self._pause()
+            now = self.now()
+            for channel in self._channels:
+                channel.advance(now)
+            self._resume()
+
+    def registers(self, phys_address, size):
+        """ Get memory with peripheral registers.
+        :param phys_address: physical address of page.
+        :param size: size of memory.
+        :return: mmap object, the same for the same address.
+        """
+        memory = self._registers.get(phys_address)
+        if memory is None:
+            memory = mmap.mmap(-1, size)
+            self._registers[phys_address] = memory
+        return memory
+
+    def allocate(self, buf):
+        """ Register CMA buffer.
+        :param buf: CMAPhysicalMemory object.
+        :return: physical address for buffer.
+        """
+        address = self._next_phys
+        self._next_phys += buf.get_size()
+        self._buffers.append(buf)
+        return address
+
+    def find_buffer(self, bus_address):
+        """ Find CMA buffer.
+        :param bus_address: bus address inside of buffer.
+        :return: CMAPhysicalMemory object.
+        """
+        for buf in self._buffers:
+            if buf.contains(bus_address):
+                return buf
+        raise MemoryError("DMA accessed unknown address {}"
+                          .format(hex(bus_address)))
+
+    def before_buffer_write(self, buf):
+        """ Bring channels which run in buffer to the current time, since
+            DMA should not see data written in the future.
+        :param buf: CMAPhysicalMemory object which is going to be changed.
+        """
+        with self._lock:
+            self._pause()
+            now = self.now()
+            for channel in self._channels:
+                if channel.buffer is buf:
+                    channel.advance(now)
+                    channel.invalidate()
+            self._resume()
+
+    def read_bus(self, bus_address):
+        """ Read word with DMA.
+        """
+        if PERIPHERALS_BUS <= bus_address < PERIPHERALS_BUS + PERIPHERALS_SIZE:
+            return self.read_register(PERI_BASE + bus_address
+                                      - PERIPHERALS_BUS)
+        buf = self.find_buffer(bus_address)
+        return struct.unpack_from("I", buf._memmap,
+                                  bus_address - buf.get_bus_address())[0]
+
+    def write_bus(self, bus_address, value, t):
+        """ Write word with DMA.
+        """
+        if PERIPHERALS_BUS <= bus_address < PERIPHERALS_BUS + PERIPHERALS_SIZE:
+            self.write_register(PERI_BASE + bus_address - PERIPHERALS_BUS,
+                                value, t)
+            return
+        buf = self.find_buffer(bus_address)
+        struct.pack_into("I", buf._memmap,
+                         bus_address - buf.get_bus_address(), value)
+
+    def _register(self, phys_address):
+        page = phys_address - phys_address % PAGE_SIZE
+        return self.registers(page, PAGE_SIZE), phys_address - page
+
+    def read_register(self, phys_address):
+        """ Read peripheral register.
+        :param phys_address: physical address of register.
+        :return: integer value.
+        """
+        with self._lock:
+            memory, offset = self._register(phys_address)
+            page = phys_address - offset
+            if page == PERI_BASE + GPIO_REGISTER_BASE \
+                    and offset == GPIO_INPUT_OFFSET:
+                self.advance()
+                return self._read_gpio(memory)
+            if page == PERI_BASE + DMA_BASE:
+                channel = self._channels[offset // 0x100]
+                self.advance()
+                if offset % 0x100 == DMA_CS:
+                    value = struct.unpack_from("I", memory, offset)[0]
+                    if channel.active:
+                        return value | DMA_CS_ACTIVE
+                    return value & ~DMA_CS_ACTIVE
+                if offset % 0x100 == DMA_CONBLK_AD:
+                    return channel.control_block
+            return struct.unpack_from("I", memory, offset)[0]
+
+    def write_register(self, phys_address, value, t=None):
+        """ Write peripheral register.
+        :param phys_address: physical address of register.
+        :param value: integer value.
+        :param t: time of writing, None for the current time.
+        """
+        with self._lock:
+            memory, offset = self._register(phys_address)
+            page = phys_address - offset
+            if page == PERI_BASE + GPIO_REGISTER_BASE:
+                if t is None:
+                    self.advance()
+                    t = self.now()
+                if offset == GPIO_SET_OFFSET:
+                    self.gpio_write(t, value, 0)
+                    return
+                if offset == GPIO_CLEAR_OFFSET:
+                    self.gpio_write(t, 0, value)
+                    return
+                if offset == GPIO_PULLUPDNCLK_OFFSET:
+                    pull = struct.unpack_from("I", memory,
+                                              GPIO_PULLUPDN_OFFSET)[0] & 3
+                    for pin in range(32):
+                        if value & (1 << pin):
+                            self._pulls[pin] = pull
+            elif page == PERI_BASE + DMA_BASE:
+                channel = self._channels[offset // 0x100]
+                self.advance()
+                if offset % 0x100 == DMA_CS:
+                    if value & (DMA_CS_ABORT | DMA_CS_RESET):
+                        channel.stop()
+                    elif value & DMA_CS_ACTIVE and not channel.active:
+                        channel.start(struct.unpack_from(
+                            "I", memory, offset - DMA_CS + DMA_CONBLK_AD)[0],
+                            self.now())
+                    elif not value & DMA_CS_ACTIVE:
+                        channel.stop()
+                elif offset % 0x100 == DMA_NEXTCONBK:
+                    channel.next_control_block = value
+                    channel.invalidate()
+            struct.pack_into("I", memory, offset, value)
+
+    def gpio_write(self, t, pins_to_set, pins_to_clear):
+        """ Change outputs levels.
+        :param t: emulated time.
+        :param pins_to_set: bitwise mask of pins to set.
+        :param pins_to_clear: bitwise mask of pins to clear.
+        """
+        if not pins_to_set and not pins_to_clear:
+            return
+        self._levels = (self._levels | pins_to_set) & ~pins_to_clear
+        if self.capture is not None:
+            self.capture.append((t, pins_to_set, pins_to_clear))
+        if self.record:
+            self._timeline.append((t, pins_to_set, pins_to_clear))
+
+    def _read_gpio(self, memory):
+        value = 0
+        for pin in range(32):
+            if pin in self._inputs:
+                level = self._inputs[pin]
+            else:
+                fsel = struct.unpack_from(
+                    "I", memory, GPIO_FSEL_OFFSET + 4 * (pin // 10))[0]
+                if (fsel >> (pin % 10 * 3)) & 7 == 1:  # output
+                    level = (self._levels >> pin) & 1
+                else:
+                    level = 1 if self._pulls.get(pin) == 2 else 0
+            value |= level << pin
+        return value
+
+
+emulator = Emulator()
+
+
+class PhysicalMemory(object):
+    def __init__(self, phys_address, size=PAGE_SIZE):
+        """ Create object which emulates physical memory with peripheral
+            registers.
+        :param phys_address: based address of physical memory
+        """
+        self._size = size
+        phys_address -= phys_address % PAGE_SIZE
+        self._phys_address = phys_address
+        self._memmap = emulator.registers(phys_address, size)
+
+    def cleanup(self):
+        pass
+
+    def write_int(self, address, int_value):
+        emulator.write_register(self._phys_address + address, int_value)
+
+    def write(self, address, fmt, data):
+        for i, value in enumerate(struct.unpack(fmt, struct.pack(fmt,
+                                                                 *data))):
+            self.write_int(address + 4 * i, value)
+
+    def read_int(self, address):
+        return emulator.read_register(self._phys_address + address)
+
+    def get_size(self):
+        return self._size
+
+
+class CMAPhysicalMemory(PhysicalMemory):
+    # noinspection PyMissingConstructor
+    def __init__(self, size):
+        """ This class allocates anonymous memory which emulates continuous
+            memory for DMA.
+        :param size: number of bytes to allocate
+        """
+        size = (size + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+        self._size = size
+        self._memmap = mmap.mmap(-1, size)
+        self._phys_address = emulator.allocate(self)
+        self._bus_memory = self._phys_address | CMA_BUS_FLAGS
+
+    def free(self):
+        pass
+
+    def write_int(self, address, int_value):
+        emulator.before_buffer_write(self)
+        struct.pack_into("I", self._memmap, address, int_value)
+
+    def write(self, address, fmt, data):
+        emulator.before_buffer_write(self)
+        struct.pack_into(fmt, self._memmap, address, *data)
+
+    def read_int(self, address):
+        return struct.unpack_from("I", self._memmap, address)[0]
+
+    def contains(self, bus_address):
+        """ Check if bus address belongs to this memory.
+        """
+        return 0 <= bus_address - self._bus_memory < self._size
+
+    def get_bus_address(self):
+        return self._bus_memory
+
+    def get_phys_address(self):
+        return self._phys_address
@@ -11,26 +11,32 @@ import ctypes
 # https://www.raspberrypi.org/wp-content/uploads/2012/02/BCM2835-ARM-Peripherals.pdf
 RPI1_PERI_BASE = 0x20000000
 RPI2_3_PERI_BASE = 0x3F000000
+# Hardware can be emulated for running on any Linux machine, see
+# rpgpio_emulator.py.
+EMULATE = os.environ.get("PYCNC_EMULATE_RPI", "0") not in ("", "0")
 # detect board version
-try:
-    with open("/proc/cpuinfo", "r") as f:
-        d = f.read()
-        r = re.search("^Revision\s+:\s+(.+)$", d, flags=re.MULTILINE)
-        h = re.search("^Hardware\s+:\s+(.+)$", d, flags=re.MULTILINE)
-        RPI_1_REVISIONS = ['0002', '0003', '0004', '0005', '0006', '0007',
-                           '0008', '0009', '000d', '000e', '000f', '0010',
-                           '0011', '0012', '0013', '0014', '0015', '900021',
-                           '900032']
-        if h is None:
-            raise ImportError("This is not raspberry pi board.")
-        elif r.group(1) in RPI_1_REVISIONS:
-            PERI_BASE = RPI1_PERI_BASE
-        elif "BCM2" in h.group(1):
-            PERI_BASE = RPI2_3_PERI_BASE
-        else:
-            raise ImportError("Unknown board.")
-except IOError:
-    raise ImportError("/proc/cpuinfo not found. Not Linux device?")
+if EMULATE:
+    PERI_BASE = RPI2_3_PERI_BASE
+else:
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            d = f.read()
+            r = re.search("^Revision\s+:\s+(.+)$", d, flags=re.MULTILINE)
+            h = re.search("^Hardware\s+:\s+(.+)$", d, flags=re.MULTILINE)
+            RPI_1_REVISIONS = ['0002', '0003', '0004', '0005', '0006', '0007',
+                               '0008', '0009', '000d', '000e', '000f', '0010',
+                               '0011', '0012', '0013', '0014', '0015', '900021',
+                               '900032']
+            if h is None:
+                raise ImportError("This is not raspberry pi board.")
+            elif r.group(1) in RPI_1_REVISIONS:
+                PERI_BASE = RPI1_PERI_BASE
+            elif "BCM2" in h.group(1):
+                PERI_BASE = RPI2_3_PERI_BASE
+            else:
+                raise ImportError("Unknown board.")
+    except IOError:
+        raise ImportError("/proc/cpuinfo not found. Not Linux device?")
 PAGE_SIZE = 4096
 GPIO_REGISTER_BASE = 0x200000
 GPIO_INPUT_OFFSET = 0x34
@@ -251,3 +257,7 @@ class DMAProto(object):
         if cb == 0:
             return None
         return cb - self._phys_memory.get_bus_address()
+
+
+if EMULATE:
+    from .rpgpio_emulator import PhysicalMemory, CMAPhysicalMemory
@@ -3,6 +3,7 @@ import time
 
 from cnc.actuators.extruder import Extruder
 from cnc.pulses import *
+from cnc.pulse_trace import TraceWriter, read_trace
 from cnc.config import *
 
 """ This is virtual device class which is very useful for debugging.
@@ -32,11 +33,24 @@ extruders = [
     ) for config in EXTRUDER_CONFIG
 ]
 
+VALIDATION_LEVELS = ('full', 'sampled', 'none')
+_validation = VIRTUAL_HAL_VALIDATION
+# number of checked moves of each generator type in 'sampled' mode
+_sampled = dict()
+# number of moves, pulses and total movement time, see get_metrics()
+_moves = 0
+_pulses = 0
+_movement_s = 0.0
+# TraceWriter object if pulses are recorded, see set_trace()
+_trace = None
+
 
 def init():
     """ Initialize GPIO pins and machine itself.
     """
     logging.info("initialize hal")
+    if VIRTUAL_HAL_TRACE_FILE is not None:
+        set_trace(open(VIRTUAL_HAL_TRACE_FILE, "wb"))
 
 
 def spindle_control(percent):
@@ -104,10 +118,88 @@ def calibrate(x, y, z):
     return True
 
 
-# noinspection PyUnusedLocal
+def set_validation(level):
+    """ Set how pulses are checked, see VIRTUAL_HAL_VALIDATION in config.
+    :param level: 'full', 'sampled' or 'none'.
+    """
+    global _validation
+    if level not in VALIDATION_LEVELS:
+        raise ValueError("unknown validation level {}".format(level))
+    _validation = level
+
+
+def set_trace(f):
+    """ Record all pulses to binary trace, see pulse_trace.py.
+    :param f: binary file object to write trace to, None to stop recording.
+    """
+    global _trace
+    if _trace is not None:
+        _trace.close()
+    _trace = None if f is None else TraceWriter(f)
+
+
+def replay(f):
+    """ Check and count pulses of recorded trace as if they were generated.
+    :param f: binary file object with trace.
+    """
+    for m in read_trace(f):
+        move(m)
+
+
 def move(generator):
     """ Move head to specified position.
+    :param generator: PulseGenerator object or TraceMove object.
+    """
+    global _moves, _pulses, _movement_s
+    _moves += 1
+    _movement_s += generator.total_time_s()
+    pulses = generator
+    if _trace is not None:
+        pulses = _trace.record(generator)
+    if _validation == 'full':
+        _pulses += _validate(generator, pulses)
+        return
+    if _validation == 'sampled':
+        name = getattr(generator, "name", generator.__class__.__name__)
+        n = _sampled.get(name, 0)
+        _sampled[name] = n + 1
+        if n % VIRTUAL_HAL_SAMPLE_MOVES == 0:
+            _pulses += _validate(generator, pulses)
+            return
+    # just count pulses, straight moves are counted by delta without
+    # generating them, unless they are recorded
+    if _trace is None and _is_straight(generator):
+        delta = generator.delta()
+        _pulses += int(round(abs(delta.x) * STEPPER_PULSES_PER_MM_X)
+                       + round(abs(delta.y) * STEPPER_PULSES_PER_MM_Y)
+                       + round(abs(delta.z) * STEPPER_PULSES_PER_MM_Z)
+                       + round(abs(delta.e) * STEPPER_PULSES_PER_MM_E))
+        return
+    # arcs and curves can't be counted by delta since axises may change
+    # direction during movement
+    for direction, tx, ty, tz, te in pulses:
+        if not direction:
+            _pulses += ((tx is not None) + (ty is not None)
+                        + (tz is not None) + (te is not None))
+
+
+def _is_straight(generator):
+    """ Check if all axises of move go in one direction.
+    :param generator: PulseGenerator object or TraceMove object.
+    :return: boolean, True for linear and rapid moves.
+    """
+    # moves from trace keep name of generator class
+    return (isinstance(generator, (PulseGeneratorLinear, PulseGeneratorRapid))
+            or getattr(generator, "name", None) in (
+                PulseGeneratorLinear.__name__, PulseGeneratorRapid.__name__))
+
+
+# noinspection PyUnusedLocal
+def _validate(generator, pulses):
+    """ Check all pulses of generator.
     :param generator: PulseGenerator object.
+    :param pulses: iterable with pulses of generator.
+    :return: number of pulses.
     """
     delta = generator.delta()
     ix = iy = iz = ie = 0
@@ -116,9 +208,10 @@ def move(generator):
     mx, my, mz, me = 0, 0, 0, 0
     cx, cy, cz, ce = 0, 0, 0, 0
     direction_x, direction_y, direction_z, direction_e = 1, 1, 1, 1
+    straight = _is_straight(generator)
     st = time.time()
     direction_found = False
-    for direction, tx, ty, tz, te in generator:
+    for direction, tx, ty, tz, te in pulses:
         if direction:
             direction_found = True
             direction_x, direction_y, direction_z, direction_e = tx, ty, tz, te
@@ -130,7 +223,7 @@ def move(generator):
                 direction_z = -direction_z
             if STEPPER_INVERTED_E:
                 direction_e = -direction_e
-            if isinstance(generator, PulseGeneratorLinear):
+            if straight:
                 assert ((direction_x < 0 and delta.x < 0)
                         or (direction_x > 0 and delta.x > 0) or delta.x == 0)
                 assert ((direction_y < 0 and delta.y < 0)
@@ -191,8 +284,11 @@ def move(generator):
         # very verbose, uncomment on demand
         # logging.debug("Iteration {} is {} {} {} {}".
         #               format(max(ix, iy, iz, ie), tx, ty, tz, te))
-        f = list(x for x in (tx, ty, tz, te) if x is not None)
-        assert f.count(f[0]) == len(f), "fast forwarded pulse detected"
+        k = None
+        for i in (tx, ty, tz, te):
+            if i is not None:
+                assert k is None or k == i, "fast forwarded pulse detected"
+                k = i
     pt = time.time()
     assert direction_found, "direction not found"
     assert round(ix / STEPPER_PULSES_PER_MM_X, 10) == delta.x,\
@@ -208,6 +304,18 @@ def move(generator):
     logging.debug("Moved {}, {}, {}, {} iterations".format(ix, iy, iz, ie))
     logging.info("prepared in " + str(round(pt - st, 2)) + "s, estimated "
                  + str(round(generator.total_time_s(), 2)) + "s")
+    return cx + cy + cz + ce
+
+
+def get_metrics():
+    """ Get buffer health metrics. There is no DMA buffer in virtual
+        environment, so moves are never streamed and never underrun.
+    :return: dict with the same keys as hal_raspberry returns, plus total
+             number of pulses and movement time in seconds.
+    """
+    return {"moves": _moves, "streamed_moves": 0, "underruns": 0,
+            "min_lead_us": None, "sleep_s": 0.0, "wait_s": 0.0,
+            "last_move": None, "pulses": _pulses, "movement_s": _movement_s}
 
 
 def get_extruder(id):
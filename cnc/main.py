@@ -2,12 +2,23 @@
 
 import os
 import sys
+import json
+import argparse
 import readline
 import atexit
 
 import cnc.logging_config as logging_config
-from cnc.gcode import GCode, GCodeException
+from cnc.config import *
+from cnc.gcode import GCode, GCodeException, SourceLine
 from cnc.gmachine import GMachine, GMachineException
+from cnc.pulse_trace import read_trace, export_vcd, compare
+from cnc import hal_virtual
+from cnc import bench
+from cnc import workloads
+from cnc.transforms.arcs import ArcWelder
+from cnc.transforms.coalesce import CollinearCoalescer
+from cnc.transforms.simplify import PolylineSimplifier
+from cnc.transforms.travel import TravelOptimizer
 
 try:  # python3 compatibility
     type(raw_input)
@@ -28,7 +39,8 @@ except IOError:
 readline.set_history_length(1000)
 atexit.register(readline.write_history_file, history_file)
 
-machine = GMachine()
+# machine is created in main(), so tools don't initialize hardware
+machine = None
 
 
 def do_line(line):
@@ -45,17 +57,215 @@ def do_line(line):
     return True
 
 
+def pipeline(lines):
+    """ Chain enabled gcode transformations for file.
+    :param lines: iterable with gcode lines.
+    :return: Tuple of two values, iterable with transformed lines and list of
+             (name, transformation) for statistics.
+    """
+    stages = []
+    if SIMPLIFY_POLYLINES:
+        lines = PolylineSimplifier(lines)
+        stages.append(("polylines", lines))
+    if COALESCE_COLLINEAR_MOVES:
+        lines = CollinearCoalescer(lines)
+        stages.append(("collinear moves", lines))
+    if WELD_ARCS:
+        lines = ArcWelder(lines)
+        stages.append(("arcs", lines))
+    return lines, stages
+
+
+def print_statistics(stages):
+    for name, stage in stages:
+        print('Transform ' + name + ': ' + ', '.join(
+            "%s %s" % (k, round(v, 2)) for k, v in
+            sorted(stage.statistics().items())))
+
+
+def optimize_main(args):
+    """ Reorder strokes of gcode file to minimize travel moves.
+    :param args: command line arguments after 'optimize'.
+    """
+    parser = argparse.ArgumentParser(
+        prog='pycnc optimize',
+        description='Reorder strokes of gcode file to minimize travel.')
+    parser.add_argument('input', help='gcode file')
+    parser.add_argument('output', help='output gcode file')
+    parser.add_argument('--reverse', action='store_true',
+                        help='allow drawing strokes backward')
+    args = parser.parse_args(args)
+    with open(args.input, 'r') as f, open(args.output, 'w') as out:
+        optimizer = TravelOptimizer(f, args.reverse)
+        for line in optimizer:
+            out.write(line + '\n')
+    print_statistics([("travel", optimizer)])
+
+
+def trace_main(args):
+    """ Check pulses trace or convert it to VCD file.
+    :param args: command line arguments after 'trace'.
+    """
+    parser = argparse.ArgumentParser(
+        prog='pycnc trace',
+        description='Check pulses trace recorded by virtual hal or convert '
+                    'it to VCD file for logic analyzer software.')
+    parser.add_argument('input', help='trace file')
+    parser.add_argument('--vcd', help='output VCD file')
+    parser.add_argument('--compare', metavar='EXPECTED',
+                        help='compare pulses with expected trace file')
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='allowed pulse time deviation in ticks for '
+                             '--compare, a tick is 0.25 us')
+    args = parser.parse_args(args)
+    with open(args.input, 'rb') as f:
+        if args.compare is not None:
+            with open(args.compare, 'rb') as e:
+                r = compare(read_trace(e), read_trace(f), args.tolerance)
+            for error in r["errors"]:
+                print('ERROR ' + error)
+            for d, move, axis, pulse in r["worst"]:
+                print('move {} {} pulse {} is {} ticks off'.format(
+                    move, axis, pulse, d))
+            print('compared {} moves, {} pulses, max deviation {} ticks'
+                  .format(r["moves"], r["pulses"], r["max_deviation"]))
+            return
+        if args.vcd is not None:
+            with open(args.vcd, 'w') as out:
+                export_vcd(read_trace(f), out)
+            return
+        hal_virtual.replay(f)
+    print(', '.join("%s %s" % (k, round(v, 2)) for k, v in
+                    sorted(hal_virtual.get_metrics().items())
+                    if k in ("moves", "pulses", "movement_s")))
+
+
+def bench_main(args):
+    """ Measure pulses generation throughput.
+    :param args: command line arguments after 'bench'.
+    """
+    def numbers(s):
+        return [float(v) if '.' in v else int(v) for v in s.split(',')]
+
+    def names(s):
+        return s.split(',')
+    parser = argparse.ArgumentParser(
+        prog='pycnc bench',
+        description='Measure pulses generation throughput.')
+    parser.add_argument('--generators', type=names,
+                        default=['linear', 'circular'])
+    parser.add_argument('--pulses-per-step', type=numbers,
+                        default=[4, 8, 16, 32])
+    parser.add_argument('--feeds', type=numbers, default=[600, 1800, 3000],
+                        help='velocities in mm per min')
+    parser.add_argument('--lengths', type=numbers, default=[2, 20],
+                        help='lengths of moves in mm')
+    parser.add_argument('--planes', type=names, default=['XY', 'YZ', 'ZX'])
+    parser.add_argument('--modes', type=names, default=list(bench.MODES))
+    parser.add_argument('--output', help='JSON file to write results to')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='run gcode job through the whole pipeline with '
+                             'emulated Raspberry Pi hardware instead')
+    parser.add_argument('--input', help='gcode file for --pipeline, '
+                                        'synthetic workload by default')
+    parser.add_argument('--workload', default='painting',
+                        choices=sorted(workloads.WORKLOADS.keys()),
+                        help='synthetic workload for --pipeline')
+    parser.add_argument('--size', type=int, default=1000,
+                        help='size of synthetic workload')
+    parser.add_argument('--speed', type=float, default=100.0,
+                        help='speed of emulated hardware for --pipeline')
+    args = parser.parse_args(args)
+    if args.pipeline:
+        if args.input is not None:
+            with open(args.input, 'r') as f:
+                res = bench.pipeline(f.readlines(), args.speed)
+        else:
+            res = bench.pipeline(
+                workloads.WORKLOADS[args.workload](args.size), args.speed)
+        print('{lines} lines, {moves} moves, {job_s:.1f}s of movement'
+              .format(**res))
+        for stage in ('parse', 'plan', 'generate', 'encode', 'hal', 'wait'):
+            print('{}: {:.3f}s'.format(stage, res[stage]))
+        print('Preparation takes {:.1f}% of movement time'.format(
+            res['ratio'] * 100.0))
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(res, f, indent=2, sort_keys=True)
+        return
+
+    def progress(r):
+        print('{generator} {plane} {pulses_per_step} {feed} mm/min '
+              '{length} mm {mode}: {pulses} pulses in {generation_s:.3f}s, '
+              '{pulses_per_second:.0f} pulses/s, rate {rate:.2f}'
+              .format(**r))
+    res = bench.run(args.generators, args.pulses_per_step, args.feeds,
+                    args.lengths, args.planes, args.modes, progress)
+    for mode, feeds in sorted(res["max_feed"].items()):
+        print('Max feed for ' + mode + ': ' + ', '.join(
+            '%s pulses per step %d mm/min' % (k, v) for k, v in
+            sorted(feeds.items(), key=lambda i: int(i[0]))))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(res, f, indent=2, sort_keys=True)
+
+
+def workload_main(args):
+    """ Write synthetic gcode workload to file.
+    :param args: command line arguments after 'workload'.
+    """
+    parser = argparse.ArgumentParser(
+        prog='pycnc workload',
+        description='Generate synthetic gcode workload.')
+    parser.add_argument('name', choices=sorted(workloads.WORKLOADS.keys())
+                        + ['mixed'])
+    parser.add_argument('output', help='output gcode file')
+    parser.add_argument('--size', type=float,
+                        help='size of workload, e.g. number of strokes, '
+                             'scale of all workloads sizes for mixed')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+    if args.name == 'mixed':
+        lines = workloads.mixed(1.0 if args.size is None else args.size,
+                                args.seed)
+    elif args.size is None:
+        lines = workloads.WORKLOADS[args.name](seed=args.seed)
+    else:
+        lines = workloads.WORKLOADS[args.name](int(args.size), args.seed)
+    with open(args.output, 'w') as out:
+        for line in lines:
+            out.write(line + '\n')
+
+
 def main():
+    global machine
+    if len(sys.argv) > 1 and sys.argv[1] == 'optimize':
+        optimize_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        bench_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'workload':
+        workload_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'trace':
+        trace_main(sys.argv[2:])
+        return
     logging_config.debug_disable()
+    machine = GMachine()
     try:
         if len(sys.argv) > 1:
             # Read file with gcode
             with open(sys.argv[1], 'r') as f:
-                for line in f:
-                    line = line.strip()
+                lines, stages = pipeline(SourceLine(l, n)
+                                         for n, l in enumerate(f, 1))
+                for line in lines:
+                    line = SourceLine(line.strip(),
+                                      getattr(line, "number", None))
                     print('> ' + line)
                     if not do_line(line):
                         break
+                print_statistics(stages)
         else:
             # Main loop for interactive shell
             # Use stdin/stdout, additional interfaces like
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+
+
+class PulseCache(object):
+    """ Cache of already encoded pulses sequences.
+        Painting strokes and test patterns repeat identical moves many times.
+        Each PulseGenerator can provide a key which identifies the whole pulses
+        sequence it generates (see PulseGenerator.cache_key()), so hal can
+        store encoded sequence once and then just copy it for the next
+        identical move instead of generating it again.
+        Cache size is limited with total number of stored events, the least
+        recently used sequences are evicted first.
+    """
+
+    def __init__(self, max_events, max_entry_events=None):
+        """ Create cache.
+        :param max_events: maximum number of events in all stored sequences.
+        :param max_entry_events: maximum number of events in a single
+                                 sequence, longer sequences are not stored.
+                                 By default, it is 1/8 of the total size.
+        """
+        self._max_events = max_events
+        if max_entry_events is None:
+            max_entry_events = max_events // 8
+        self._max_entry_events = min(max_entry_events, max_events)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        """ Find sequence in cache.
+        :param key: sequence key, None is never found.
+        :return: list of events or None if sequence isn't cached.
+        """
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        # mark as the most recently used
+        del self._entries[key]
+        self._entries[key] = entry
+        self._hits += 1
+        return entry[0]
+
+    def data(self, key):
+        """ Get data which was stored with sequence. Statistics and order of
+            sequences are not changed.
+        :param key: sequence key.
+        :return: data or None if sequence isn't cached.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def put(self, key, events, data=None):
+        """ Store sequence in cache, the least recently used sequences are
+            evicted if there is no space.
+        :param key: sequence key.
+        :param events: list of events.
+        :param data: any object to store with sequence, e.g. state of
+                     hardware after it.
+        :return: boolean value, True if sequence was stored.
+        """
+        if key is None or not self.fits(len(events)):
+            return False
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key)[0])
+        while self._size + len(events) > self._max_events:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted[0])
+            self._evictions += 1
+        self._entries[key] = (events, data)
+        self._size += len(events)
+        return True
+
+    def fits(self, length):
+        """ Check if sequence with specified length can be stored.
+        :param length: number of events.
+        :return: boolean value.
+        """
+        return length <= self._max_entry_events
+
+    def clear(self):
+        """ Remove all stored sequences. Statistics is kept.
+        """
+        self._entries.clear()
+        self._size = 0
+
+    def statistics(self):
+        """ Get cache statistics.
+        :return: dict with number of hits, misses, evictions, stored
+                 sequences and total number of stored events.
+        """
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "size": self._size}
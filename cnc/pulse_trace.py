@@ -0,0 +1,347 @@
+from __future__ import division
+import heapq
+import struct
+
+from cnc.coordinates import Coordinates
+from cnc.pulses import TICKS_PER_SECOND
+from cnc.config import *
+
+""" Compact binary trace of pulses generated by PulseGenerator objects.
+    File starts with MAGIC and ticks per second rate, then goes records:
+    move header:  MOVE, generator name, delta and total time of move.
+    direction:    DIRECTION | mask of axises with negative direction.
+    pulses:       PULSES | mask of axises, time delta in ticks.
+    Bits of axises masks are X, Y, Z, E from the lowest one. Time of pulses
+    is measured from the beginning of move and is delta encoded with zigzag
+    varint, so typical pulse takes two or three bytes. Pulses of single
+    iteration normally have the same time, if they don't, each distinct time
+    is stored as separate record with PULSES_CONTINUE flag.
+"""
+
+MAGIC = b"PYCNCTR1"
+MOVE = 0x80
+DIRECTION = 0x40
+PULSES = 0x00
+PULSES_CONTINUE = 0x20
+AXIS_MASK = 0x0F
+HEADER_FORMAT = "<ddddd"
+# traces are read by chunks, so the whole file is never in memory
+READ_CHUNK_SIZE = 65536
+# the longest record without generator name: tag, two varints and header
+RECORD_MAX_SIZE = 21 + struct.calcsize(HEADER_FORMAT)
+
+
+def _write_varint(out, value):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value > 0x7F:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), pos
+
+
+class TraceWriter(object):
+    def __init__(self, f, ticks_per_second=TICKS_PER_SECOND):
+        """ Create trace writer.
+        :param f: binary file object to write to.
+        :param ticks_per_second: time resolution of trace.
+        """
+        self._f = f
+        self._tps = ticks_per_second
+        header = bytearray(MAGIC)
+        _write_varint(header, ticks_per_second)
+        f.write(header)
+        self._moves = 0
+        self._pulses = 0
+
+    def record(self, generator):
+        """ Record move while it is being iterated.
+        :param generator: PulseGenerator object.
+        :return: generator which yields the same values as PulseGenerator.
+        """
+        out = bytearray([MOVE])
+        name = getattr(generator, "name",
+                       generator.__class__.__name__).encode()
+        _write_varint(out, len(name))
+        out.extend(name)
+        delta = generator.delta()
+        out.extend(struct.pack(HEADER_FORMAT, delta.x, delta.y, delta.z,
+                               delta.e, generator.total_time_s()))
+        last = 0
+        tps = self._tps
+        for item in generator:
+            direction, tx, ty, tz, te = item
+            if direction:
+                mask = 0
+                for i, d in enumerate((tx, ty, tz, te)):
+                    if d < 0:
+                        mask |= 1 << i
+                out.append(DIRECTION | mask)
+            else:
+                flag = PULSES
+                times = set(t for t in (tx, ty, tz, te) if t is not None)
+                for t in sorted(times):
+                    mask = 0
+                    for i, p in enumerate((tx, ty, tz, te)):
+                        if p == t:
+                            mask |= 1 << i
+                    t = int(round(t * tps))
+                    out.append(flag | mask)
+                    _write_varint(out, t - last)
+                    last = t
+                    flag = PULSES_CONTINUE
+                    self._pulses += bin(mask).count("1")
+            yield item
+            if len(out) > 65536:
+                self._f.write(out)
+                del out[:]
+        self._f.write(out)
+        self._moves += 1
+
+    def close(self):
+        """ Close trace file.
+        """
+        self._f.close()
+
+    def statistics(self):
+        """ Get statistics.
+        :return: dict with number of recorded moves and pulses.
+        """
+        return {"moves": self._moves, "pulses": self._pulses}
+
+
+class TraceMove(object):
+    def __init__(self, name, delta, total_time_s, items):
+        """ Move which was read from trace. Object can be iterated as
+            PulseGenerator object, so it can be checked with the same code.
+        :param name: name of generator class which produced move.
+        :param delta: Coordinates object with movement delta.
+        :param total_time_s: total time of movement in seconds.
+        :param items: list of (direction, tx, ty, tz, te) tuples.
+        """
+        self.name = name
+        self._delta = delta
+        self._total_time_s = total_time_s
+        self.items = items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def delta(self):
+        """ Get movement delta.
+        :return: Coordinates object.
+        """
+        return self._delta
+
+    def total_time_s(self):
+        """ Get total time of movement.
+        :return: time in seconds.
+        """
+        return self._total_time_s
+
+
+def _fill(f, data, pos, size):
+    """ Read more data from file if less than size bytes are left.
+    :param f: binary file object to read from.
+    :param data: bytearray with data which was read.
+    :param pos: current position in data.
+    :param size: number of bytes which are needed.
+    :return: tuple of data and position in it.
+    """
+    if len(data) - pos >= size:
+        return data, pos
+    data = data[pos:]
+    while len(data) < size:
+        chunk = f.read(max(READ_CHUNK_SIZE, size - len(data)))
+        if not chunk:
+            break
+        data.extend(chunk)
+    return data, 0
+
+
+def read_trace(f):
+    """ Read all moves from trace. Moves are read one by one, so only the
+        current move is kept in memory.
+    :param f: binary file object to read from.
+    :return: generator of TraceMove objects.
+    """
+    data, pos = _fill(f, bytearray(), 0, RECORD_MAX_SIZE)
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a pulses trace file")
+    tps, pos = _read_varint(data, len(MAGIC))
+    move = None
+    last = 0
+    header_size = struct.calcsize(HEADER_FORMAT)
+    while True:
+        data, pos = _fill(f, data, pos, RECORD_MAX_SIZE)
+        if pos >= len(data):
+            break
+        tag = data[pos]
+        pos += 1
+        if tag & MOVE:
+            if move is not None:
+                yield move
+            size, pos = _read_varint(data, pos)
+            data, pos = _fill(f, data, pos, size + header_size)
+            name = bytes(data[pos:pos + size]).decode()
+            pos += size
+            x, y, z, e, total = struct.unpack_from(HEADER_FORMAT, data, pos)
+            pos += header_size
+            move = TraceMove(name, Coordinates(x, y, z, e), total, [])
+            last = 0
+        elif move is None:
+            raise ValueError("trace record without move header")
+        elif tag & DIRECTION:
+            move.items.append((True,) + tuple(-1 if tag & (1 << i) else 1
+                                              for i in range(4)))
+        else:
+            delta, pos = _read_varint(data, pos)
+            last += delta
+            t = last / tps
+            pulses = tuple(t if tag & (1 << i) else None for i in range(4))
+            if tag & PULSES_CONTINUE:
+                # merge into previous iteration
+                previous = move.items[-1]
+                pulses = (False,) + tuple(p if p is not None else q for p, q
+                                          in zip(pulses, previous[1:]))
+                move.items[-1] = pulses
+            else:
+                move.items.append((False,) + pulses)
+    if move is not None:
+        yield move
+
+
+def export_vcd(moves, out, pulse_length_us=STEPPER_PULSE_LENGTH_US):
+    """ Write moves as Value Change Dump file which can be opened with
+        logic analyzers software, e.g. GTKWave or PulseView. Moves are
+        placed one by one as they would be run by machine.
+    :param moves: iterable of TraceMove objects.
+    :param out: text file object to write to.
+    :param pulse_length_us: length of step pulses.
+    """
+    names = ("x", "y", "z", "e")
+    out.write("$timescale 1 ns $end\n$scope module pycnc $end\n")
+    for i, n in enumerate(names):
+        out.write("$var wire 1 s{} step_{} $end\n".format(i, n))
+        out.write("$var wire 1 d{} dir_{} $end\n".format(i, n))
+    out.write("$upscope $end\n$enddefinitions $end\n#0\n$dumpvars\n")
+    for i in range(len(names)):
+        out.write("0s{}\n0d{}\n".format(i, i))
+    out.write("$end\n")
+    pulse_ns = int(pulse_length_us * 1000)
+    start_ns = 0
+    for move in moves:
+        changes = []
+        t_ns = start_ns
+        for direction, tx, ty, tz, te in move:
+            for i, v in enumerate((tx, ty, tz, te)):
+                if direction:
+                    changes.append((t_ns, 0, "{}d{}".format(
+                        1 if v < 0 else 0, i)))
+                elif v is not None:
+                    t_ns = start_ns + int(round(v * 1000000000))
+                    changes.append((t_ns, 1, "1s{}".format(i)))
+                    changes.append((t_ns + pulse_ns, 2, "0s{}".format(i)))
+        changes.sort()
+        last = None
+        for t, _, change in changes:
+            if t != last:
+                out.write("#{}\n".format(t))
+                last = t
+            out.write(change + "\n")
+        start_ns += int(round(move.total_time_s() * 1000000000))
+
+
+def _axises_pulses(move):
+    """ Split move pulses by axises.
+    :param move: TraceMove object.
+    :return: list with list of (time, direction) for each axis.
+    """
+    axises = ([], [], [], [])
+    directions = (1, 1, 1, 1)
+    for item in move:
+        if item[0]:
+            directions = item[1:]
+            continue
+        for i, t in enumerate(item[1:]):
+            if t is not None:
+                axises[i].append((t, directions[i]))
+    return axises
+
+
+def compare(expected, actual, tolerance_ticks=0, worst=10,
+            ticks_per_second=TICKS_PER_SECOND):
+    """ Compare two sequences of moves, e.g. golden trace and trace of
+        modified generators. Number of moves, pulses on each axis and
+        directions should be exactly the same, time of each pulse should not
+        differ more than tolerance.
+    :param expected: iterable of TraceMove objects.
+    :param actual: iterable of TraceMove objects.
+    :param tolerance_ticks: maximum allowed time deviation in ticks.
+    :param worst: number of the worst deviations to report.
+    :param ticks_per_second: ticks rate for tolerance and deviations.
+    :return: dict with 'errors' list of strings, 'worst' list of the worst
+             (deviation_ticks, move, axis, pulse) tuples, 'max_deviation'
+             in ticks, 'moves' and 'pulses' which were compared.
+    """
+    errors = []
+    # heap with the worst deviations
+    deviations = []
+    max_deviation = 0
+    moves = pulses = 0
+    names = "XYZE"
+    # moves are compared one by one, so traces are never loaded entirely
+    expected = iter(expected)
+    actual = iter(actual)
+    while True:
+        e = next(expected, None)
+        a = next(actual, None)
+        if e is None or a is None:
+            break
+        n = moves
+        moves += 1
+        if e.delta() != a.delta():
+            errors.append("move {}: expected delta {}, got {}".format(
+                n, e.delta(), a.delta()))
+        for axis, (ep, ap) in enumerate(zip(_axises_pulses(e),
+                                            _axises_pulses(a))):
+            if len(ep) != len(ap):
+                errors.append("move {}: expected {} pulses on {}, got {}"
+                              .format(n, len(ep), names[axis], len(ap)))
+                continue
+            for i, ((et, ed), (at, ad)) in enumerate(zip(ep, ap)):
+                pulses += 1
+                if ed != ad:
+                    errors.append("move {}: wrong direction of {} pulse {}"
+                                  .format(n, names[axis], i))
+                d = int(round(abs(et - at) * ticks_per_second))
+                if d > 0:
+                    max_deviation = max(max_deviation, d)
+                    if len(deviations) < worst:
+                        heapq.heappush(deviations, (d, n, names[axis], i))
+                    elif deviations and d > deviations[0][0]:
+                        heapq.heapreplace(deviations, (d, n, names[axis], i))
+                if d > tolerance_ticks:
+                    errors.append("move {}: {} pulse {} is {} ticks off"
+                                  .format(n, names[axis], i, d))
+    if e is not None or a is not None:
+        left_e = (e is not None) + sum(1 for _ in expected)
+        left_a = (a is not None) + sum(1 for _ in actual)
+        errors.insert(0, "expected {} moves, got {}".format(moves + left_e,
+                                                            moves + left_a))
+    deviations.sort(reverse=True)
+    return {"errors": errors, "worst": deviations,
+            "max_deviation": max_deviation,
+            "moves": moves, "pulses": pulses}
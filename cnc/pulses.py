@@ -1,11 +1,25 @@
 from __future__ import division
 import logging
+import itertools
 
 from cnc.config import *
 from cnc.coordinates import *
 from cnc.enums import *
 
 SECONDS_IN_MINUTE = 60.0
+# GPIO masks of steppers pins
+STEP_PIN_MASK_X = 1 << STEPPER_STEP_PIN_X
+STEP_PIN_MASK_Y = 1 << STEPPER_STEP_PIN_Y
+STEP_PIN_MASK_Z = 1 << STEPPER_STEP_PIN_Z
+DIR_PIN_MASK_X = 1 << STEPPER_DIR_PIN_X
+DIR_PIN_MASK_Y = 1 << STEPPER_DIR_PIN_Y
+DIR_PIN_MASK_Z = 1 << STEPPER_DIR_PIN_Z
+DIR_PINS_MASK = DIR_PIN_MASK_X | DIR_PIN_MASK_Y | DIR_PIN_MASK_Z
+# resolution of gpio_events() timings, it is DMA clock of Raspberry Pi hal,
+# see DMAGPIO.TICKS_PER_US
+GPIO_TICKS_PER_US = 4
+TICKS_PER_SECOND = GPIO_TICKS_PER_US * 1000000
+PULSE_LENGTH_TICKS = STEPPER_PULSE_LENGTH_US * GPIO_TICKS_PER_US
 
 
 class PulseGenerator(object):
@@ -31,6 +45,9 @@ class PulseGenerator(object):
         based this class.
     """
     AUTO_VELOCITY_ADJUSTMENT = AUTO_VELOCITY_ADJUSTMENT
+    # maximum number of pulses per second of all axises which this host can
+    # generate in time, None if it isn't limited, see self_benchmark.py
+    MAX_PULSES_PER_SECOND = None
 
     def __init__(self, delta):
         """ Create object. Do not create directly this object, inherit this
@@ -47,6 +64,10 @@ class PulseGenerator(object):
         self._linear_time_s = 0.0
         self._2Vmax_per_a = 0.0
         self._delta = delta
+        self._ticks_per_second = None
+        self._direction_pins = None
+        # number of gcode line which created this move, for diagnostics
+        self.line = None
 
     def _adjust_velocity(self, velocity_mm_sec):
         """ Automatically decrease velocity to all axises proportionally if
@@ -54,8 +75,13 @@ class PulseGenerator(object):
         :param velocity_mm_sec: input velocity.
         :return: adjusted(decreased if needed) velocity.
         """
+        k = self._pulses_rate_factor(velocity_mm_sec)
+        if k != 1.0:
+            logging.debug("Host is too slow for velocity, multiply it by {}"
+                          .format(k))
         if not self.AUTO_VELOCITY_ADJUSTMENT:
-            return velocity_mm_sec
+            return velocity_mm_sec * k
+        velocity_mm_sec = velocity_mm_sec * k
         k = 1.0
         if velocity_mm_sec.x * SECONDS_IN_MINUTE > MAX_VELOCITY_MM_PER_MIN_X:
             k = min(k, MAX_VELOCITY_MM_PER_MIN_X
@@ -70,6 +96,22 @@ class PulseGenerator(object):
             logging.warning("Out of speed, multiply velocity by {}".format(k))
         return velocity_mm_sec * k
 
+    def _pulses_rate_factor(self, velocity_mm_sec):
+        """ Calculate how velocity should be decreased to fit the maximum
+            pulses rate of this host.
+        :param velocity_mm_sec: velocity of each axis.
+        :return: multiplier for velocity, 1.0 if velocity fits.
+        """
+        if self.MAX_PULSES_PER_SECOND is None:
+            return 1.0
+        rate = (abs(velocity_mm_sec.x) * STEPPER_PULSES_PER_MM_X
+                + abs(velocity_mm_sec.y) * STEPPER_PULSES_PER_MM_Y
+                + abs(velocity_mm_sec.z) * STEPPER_PULSES_PER_MM_Z
+                + abs(velocity_mm_sec.e) * STEPPER_PULSES_PER_MM_E)
+        if rate <= self.MAX_PULSES_PER_SECOND:
+            return 1.0
+        return self.MAX_PULSES_PER_SECOND / rate
+
     def _get_movement_parameters(self):
         """ Get parameters for interpolation. This method have to be
             reimplemented in parent classes and should calculate 3 parameters.
@@ -119,6 +161,151 @@ class PulseGenerator(object):
         logging.debug(', '.join("%s: %s" % i for i in vars(self).items()))
         return self
 
+    def ticks(self, ticks_per_second=None):
+        """ Get iterator which returns pulses times as integer number of
+            ticks instead of seconds, i.e. time is converted once here and
+            hardware clock is used for the rest of processing.
+        :param ticks_per_second: clock frequency, None to use seconds.
+        :return: iterable object.
+        """
+        self._ticks_per_second = ticks_per_second
+        return self
+
+    def gpio_events(self, ticks_per_second, pulse_length_ticks,
+                    direction_pins=None):
+        """ Iterate pulses as ready GPIO writes for hardware which changes
+            pins with delays between writes, like DMA. Pins are taken from
+            config.
+            Each pulse sets step pins and clears them pulse length later. To
+            reduce number of writes, pulses of different axises which start
+            within pulse length are merged into one pulse, clearing of step
+            pins is postponed till the next pulse if it uses other pins and
+            direction pins are changed with clearing of the previous pulse.
+            Pins stay high and low at least pulse length, directions are set
+            at least pulse length before pulse, pulses are delayed if needed.
+        :param ticks_per_second: clock frequency.
+        :param pulse_length_ticks: length of step pulse in ticks.
+        :param direction_pins: mask of direction pins which are high before
+                               movement or None if it is unknown. Writes which
+                               don't change direction pins are skipped.
+        :return: generator of tuples (delta_ticks, pins_to_set,
+                 pins_to_clear). Delta is time since the previous write.
+                 Mask of direction pins after movement is available with
+                 direction_pins() method when iteration is finished.
+        """
+        known = 0 if direction_pins is None else DIR_PINS_MASK
+        high_dir = direction_pins or 0
+        last = 0  # time of the previous write
+        high = 0  # step pins which are set now
+        high_t = 0  # time when they were set
+        # time when step pins were cleared
+        low_t = {STEP_PIN_MASK_X: -pulse_length_ticks,
+                 STEP_PIN_MASK_Y: -pulse_length_ticks,
+                 STEP_PIN_MASK_Z: -pulse_length_ticks}
+        dir_set = 0
+        dir_clear = 0
+        # pulse which waits for the next one to be merged with it, list of
+        # time, step pins and direction pins to set and clear before it
+        held = None
+        self._direction_pins = None
+        for item in itertools.chain(self.ticks(ticks_per_second), (None, )):
+            if item is not None:
+                direction, tx, ty, tz, te = item
+                if direction:  # set up directions
+                    dir_set = 0
+                    dir_clear = 0
+                    if tx > 0:
+                        dir_clear |= DIR_PIN_MASK_X
+                    elif tx < 0:
+                        dir_set |= DIR_PIN_MASK_X
+                    if ty > 0:
+                        dir_clear |= DIR_PIN_MASK_Y
+                    elif ty < 0:
+                        dir_set |= DIR_PIN_MASK_Y
+                    if tz > 0:
+                        dir_clear |= DIR_PIN_MASK_Z
+                    elif tz < 0:
+                        dir_set |= DIR_PIN_MASK_Z
+                    # ignore te
+                    continue
+                pins = 0
+                k = None
+                for i in (tx, ty, tz, te):
+                    if i is not None and (k is None or i < k):
+                        k = i
+                if tx is not None:
+                    pins |= STEP_PIN_MASK_X
+                if ty is not None:
+                    pins |= STEP_PIN_MASK_Y
+                if tz is not None:
+                    pins |= STEP_PIN_MASK_Z
+                # ignore te
+                if pins == 0:
+                    continue
+                if held is not None and dir_set == 0 and dir_clear == 0 \
+                        and pins & held[1] == 0 \
+                        and k - held[0] < pulse_length_ticks:
+                    held[1] |= pins
+                    continue
+            if held is not None:
+                t, pins_h, ds, dc = held
+                # skip direction pins which are already in required state
+                ds, dc = ds & ~(known & high_dir), dc & ~(known & ~high_dir)
+                known |= held[2] | held[3]
+                high_dir = (high_dir | held[2]) & ~held[3]
+                for mask, cleared in low_t.items():
+                    if pins_h & mask:
+                        t = max(t, cleared + pulse_length_ticks)
+                if high != 0 and (high & pins_h or ds != 0 or dc != 0):
+                    # clear the previous pulse separately
+                    c = max(high_t + pulse_length_ticks, last)
+                    yield c - last, ds, dc | high
+                    for mask in low_t:
+                        if high & mask:
+                            low_t[mask] = c
+                    last = c
+                    high = 0
+                    t = max(t, c + pulse_length_ticks)
+                elif ds != 0 or dc != 0:
+                    c = max(t - pulse_length_ticks, last)
+                    yield c - last, ds, dc
+                    last = c
+                    t = max(t, c + pulse_length_ticks)
+                if high != 0:
+                    t = max(t, high_t + pulse_length_ticks)
+                t = max(t, last)
+                yield t - last, pins_h, high
+                for mask in low_t:
+                    if high & mask:
+                        low_t[mask] = t
+                last = t
+                high = pins_h
+                high_t = t
+                held = None
+            if item is None:
+                break
+            held = [k, pins, dir_set, dir_clear]
+            dir_set = 0
+            dir_clear = 0
+        # directions without pulses
+        ds, dc = dir_set & ~(known & high_dir), dir_clear & ~(known & ~high_dir)
+        known |= dir_set | dir_clear
+        high_dir = (high_dir | dir_set) & ~dir_clear
+        if high != 0:
+            yield (max(high_t + pulse_length_ticks, last) - last, ds,
+                   dc | high)
+        elif ds != 0 or dc != 0:
+            yield 0, ds, dc
+        if known == DIR_PINS_MASK:
+            self._direction_pins = high_dir
+
+    def direction_pins(self):
+        """ Get state of direction pins after gpio_events() iteration.
+        :return: mask of direction pins which are high or None if it is
+                 unknown.
+        """
+        return self._direction_pins
+
     def _to_accelerated_time(self, pt_s):
         """ Internal function to translate uniform movement time to time for
             accelerated movement.
@@ -195,6 +382,8 @@ class PulseGenerator(object):
             if i is not None and (m is None or i < m):
                 m = i
         am = self._to_accelerated_time(m)
+        if self._ticks_per_second is not None:
+            am = int(round(am * self._ticks_per_second))
         # sort pulses in time
         if tx is not None:
             if tx > m:
@@ -243,6 +432,22 @@ class PulseGenerator(object):
         _, _, v = self._get_movement_parameters()
         return v * SECONDS_IN_MINUTE
 
+    def _profile_key(self):
+        """ Get settings which affect velocity profile of any movement.
+        :return: tuple with settings.
+        """
+        return (STEPPER_MAX_ACCELERATION_MM_PER_S2,
+                self.AUTO_VELOCITY_ADJUSTMENT, self.MAX_PULSES_PER_SECOND)
+
+    def cache_key(self):
+        """ Get key which identifies pulses sequence of this generator.
+            Generators with equal keys produce exactly the same pulses, so
+            already encoded pulses can be reused instead of generating them
+            again. Child classes should reimplement this method.
+        :return: hashable tuple or None if pulses can't be cached.
+        """
+        return None
+
 
 class PulseGeneratorLinear(PulseGenerator):
     def __init__(self, delta_mm, velocity_mm_per_min):
@@ -286,6 +491,7 @@ class PulseGeneratorLinear(PulseGenerator):
                            math.copysign(1, delta_mm.y),
                            math.copysign(1, delta_mm.z),
                            math.copysign(1, delta_mm.e))
+        self._velocity_mm_per_min = velocity_mm_per_min
 
     def _get_movement_parameters(self):
         """ Return movement parameters, see super class for details.
@@ -294,6 +500,16 @@ class PulseGeneratorLinear(PulseGenerator):
                 self.linear_time_s,
                 self.max_velocity_mm_per_sec)
 
+    def cache_key(self):
+        """ Return key for pulses cache, see super class for details.
+        """
+        return ("linear",
+                round(self._delta.x * STEPPER_PULSES_PER_MM_X),
+                round(self._delta.y * STEPPER_PULSES_PER_MM_Y),
+                round(self._delta.z * STEPPER_PULSES_PER_MM_Z),
+                round(self._delta.e * STEPPER_PULSES_PER_MM_E),
+                self._velocity_mm_per_min, self._profile_key())
+
     @staticmethod
     def __linear(i, pulses_per_mm, total_pulses, velocity_mm_per_sec):
         """ Helper function for linear movement.
@@ -319,6 +535,126 @@ class PulseGeneratorLinear(PulseGenerator):
         return self._direction, (t_x, t_y, t_z, t_e)
 
 
+class PulseGeneratorRapid(PulseGenerator):
+    """ Generator for rapid movement without interpolation. Each axis moves
+        with its own maximum velocity and acceleration and finishes
+        independently, so path isn't a straight line, but movement takes
+        minimum time. Since there is no common pseudo time for axises,
+        interpolation function returns real time of each pulse.
+    """
+
+    def __init__(self, delta_mm):
+        """ Create pulse generator for rapid movement.
+        :param delta_mm: movement distance of each axis, E axis isn't
+                         supported.
+        """
+        super(PulseGeneratorRapid, self).__init__(delta_mm)
+        distance_mm = abs(delta_mm)  # type: Coordinates
+        self._total_pulses = (round(distance_mm.x * STEPPER_PULSES_PER_MM_X),
+                              round(distance_mm.y * STEPPER_PULSES_PER_MM_Y),
+                              round(distance_mm.z * STEPPER_PULSES_PER_MM_Z),
+                              round(distance_mm.e * STEPPER_PULSES_PER_MM_E))
+        # host may be unable to generate pulses of all axises at the maximum
+        # velocity
+        k = self._pulses_rate_factor(Coordinates(
+            MAX_VELOCITY_MM_PER_MIN_X if distance_mm.x else 0.0,
+            MAX_VELOCITY_MM_PER_MIN_Y if distance_mm.y else 0.0,
+            MAX_VELOCITY_MM_PER_MIN_Z if distance_mm.z else 0.0,
+            0.0) / SECONDS_IN_MINUTE)
+        # trapezoidal profile of each axis, tuples of acceleration time,
+        # linear time and top velocity
+        self._profiles = (
+            self.__profile(distance_mm.x, MAX_VELOCITY_MM_PER_MIN_X * k),
+            self.__profile(distance_mm.y, MAX_VELOCITY_MM_PER_MIN_Y * k),
+            self.__profile(distance_mm.z, MAX_VELOCITY_MM_PER_MIN_Z * k),
+            (0.0, 0.0, 0.0))
+        self.max_velocity_mm_per_sec = Coordinates(
+            *(velocity for _, _, velocity in self._profiles))
+        self._total_time_s = max(2.0 * acceleration_time_s + linear_time_s
+                                 for acceleration_time_s, linear_time_s, _
+                                 in self._profiles)
+        self._direction = (math.copysign(1, delta_mm.x),
+                           math.copysign(1, delta_mm.y),
+                           math.copysign(1, delta_mm.z),
+                           math.copysign(1, delta_mm.e))
+
+    @staticmethod
+    def __profile(distance_mm, max_velocity_mm_per_min):
+        """ Calculate trapezoidal velocity profile for one axis.
+        :return: Tuple of acceleration time, linear time and top velocity.
+        """
+        if distance_mm == 0.0:
+            return 0.0, 0.0, 0.0
+        velocity = max_velocity_mm_per_min / SECONDS_IN_MINUTE
+        acceleration_time_s = velocity / STEPPER_MAX_ACCELERATION_MM_PER_S2
+        # S = a * t^2 / 2 for both acceleration and braking
+        if STEPPER_MAX_ACCELERATION_MM_PER_S2 * acceleration_time_s ** 2 \
+                > distance_mm:
+            acceleration_time_s = math.sqrt(
+                distance_mm / STEPPER_MAX_ACCELERATION_MM_PER_S2)
+            return (acceleration_time_s, 0.0,
+                    acceleration_time_s * STEPPER_MAX_ACCELERATION_MM_PER_S2)
+        linear_distance_mm = distance_mm - acceleration_time_s ** 2 \
+            * STEPPER_MAX_ACCELERATION_MM_PER_S2
+        return acceleration_time_s, linear_distance_mm / velocity, velocity
+
+    def _get_movement_parameters(self):
+        """ Return movement parameters, see super class for details. Axises
+            have own profiles, so the whole movement is reported as linear.
+        """
+        return 0.0, self._total_time_s, self.max_velocity_mm_per_sec
+
+    def _to_accelerated_time(self, pt_s):
+        """ Interpolation function already returns real time.
+        """
+        return pt_s
+
+    def cache_key(self):
+        """ Return key for pulses cache, see super class for details.
+        """
+        return ("rapid",
+                round(self._delta.x * STEPPER_PULSES_PER_MM_X),
+                round(self._delta.y * STEPPER_PULSES_PER_MM_Y),
+                round(self._delta.z * STEPPER_PULSES_PER_MM_Z),
+                round(self._delta.e * STEPPER_PULSES_PER_MM_E),
+                MAX_VELOCITY_MM_PER_MIN_X, MAX_VELOCITY_MM_PER_MIN_Y,
+                MAX_VELOCITY_MM_PER_MIN_Z, self._profile_key())
+
+    @staticmethod
+    def __time(i, pulses_per_mm, total_pulses, profile):
+        """ Helper function to find time of pulse with trapezoidal profile.
+        """
+        if i >= total_pulses:
+            return None
+        acceleration_time_s, linear_time_s, velocity = profile
+        a = STEPPER_MAX_ACCELERATION_MM_PER_S2
+        s = i / pulses_per_mm
+        acceleration_distance_mm = a * acceleration_time_s ** 2 / 2.0
+        # acceleration, S = a * t^2 / 2
+        if s <= acceleration_distance_mm:
+            return math.sqrt(2.0 * s / a)
+        # linear, S = V * t
+        linear_distance_mm = s - acceleration_distance_mm
+        if linear_distance_mm <= velocity * linear_time_s:
+            return acceleration_time_s + linear_distance_mm / velocity
+        # braking, time is counted backward from the end
+        left_mm = total_pulses / pulses_per_mm - s
+        return (2.0 * acceleration_time_s + linear_time_s
+                - math.sqrt(max(0.0, 2.0 * left_mm / a)))
+
+    def _interpolation_function(self, ix, iy, iz, ie):
+        """ Calculate real time of the next pulses, see super class for
+            details.
+        """
+        t_x = self.__time(ix, STEPPER_PULSES_PER_MM_X, self._total_pulses[0],
+                          self._profiles[0])
+        t_y = self.__time(iy, STEPPER_PULSES_PER_MM_Y, self._total_pulses[1],
+                          self._profiles[1])
+        t_z = self.__time(iz, STEPPER_PULSES_PER_MM_Z, self._total_pulses[2],
+                          self._profiles[2])
+        return self._direction, (t_x, t_y, t_z, None)
+
+
 class PulseGeneratorCircular(PulseGenerator):
     def __init__(self, delta, radius, plane, direction, velocity):
         """ Create pulse generator for circular interpolation.
@@ -345,6 +681,16 @@ class PulseGeneratorCircular(PulseGenerator):
         super(PulseGeneratorCircular, self).__init__(delta)
         self._plane = plane
         self._direction = direction
+        self._cache_key = ("circular",
+                           round(delta.x * STEPPER_PULSES_PER_MM_X),
+                           round(delta.y * STEPPER_PULSES_PER_MM_Y),
+                           round(delta.z * STEPPER_PULSES_PER_MM_Z),
+                           round(delta.e * STEPPER_PULSES_PER_MM_E),
+                           round(radius.x * STEPPER_PULSES_PER_MM_X),
+                           round(radius.y * STEPPER_PULSES_PER_MM_Y),
+                           round(radius.z * STEPPER_PULSES_PER_MM_Z),
+                           str(plane), str(direction), velocity,
+                           self._profile_key())
         velocity = velocity / SECONDS_IN_MINUTE
         # Get circle start point and end point.
         if self._plane == PLANE_XY:
@@ -511,6 +857,19 @@ class PulseGeneratorCircular(PulseGenerator):
         else:
             circular_velocity = arc / full_length * velocity
             self._e_velocity = abs(delta.e) / full_length * velocity
+        # Centripetal acceleration a = V^2 / R can't be more then maximum
+        # acceleration, i.e. V <= sqrt(a * R). Decrease velocity for all
+        # axises proportionally if arc radius is too small for this velocity.
+        # Radius which is rounded to zero pulses has no circular part.
+        centripetal_velocity = math.sqrt(STEPPER_MAX_ACCELERATION_MM_PER_S2
+                                         * radius)
+        if radius > 0 and circular_velocity > centripetal_velocity:
+            k = centripetal_velocity / circular_velocity
+            logging.debug("Centripetal acceleration limit, multiply velocity "
+                          "by {}".format(k))
+            circular_velocity *= k
+            self._velocity_3rd *= k
+            self._e_velocity *= k
         if self._plane == PLANE_XY:
             self.max_velocity_mm_per_sec = self._adjust_velocity(
                 Coordinates(circular_velocity, circular_velocity,
@@ -561,6 +920,11 @@ class PulseGeneratorCircular(PulseGenerator):
                 circular_velocity ** 2 + self._velocity_3rd ** 2
                 + self._e_velocity ** 2)
 
+    def cache_key(self):
+        """ Return key for pulses cache, see super class for details.
+        """
+        return self._cache_key
+
     @staticmethod
     def __angle(a, b):
         # Calculate angle of entry point (a, b) of circle with center in (0,0)
@@ -666,3 +1030,264 @@ class PulseGeneratorCircular(PulseGenerator):
         te = self.__linear(ie, self._iterations_e, STEPPER_PULSES_PER_MM_E,
                            self._e_velocity)
         return (dx, dy, dz, self._e_dir), (tx, ty, tz, te)
+
+
+class PulseGeneratorBezier(PulseGenerator):
+    # Flattening accuracy of curve in pulses.
+    FLATNESS_PULSES = 0.25
+    # Maximum depth of curve subdivision.
+    MAX_SUBDIVISION_DEPTH = 20
+
+    def __init__(self, delta, control1, control2, velocity):
+        """ Create pulse generator for cubic Bezier curve in XY plane.
+            Curve is defined with formula:
+            B(u) = 3 * (1 - u)^2 * u * P1 + 3 * (1 - u) * u^2 * P2 + u^3 * P3
+            where u is in range 0..1, start point P0 is zero, P1 and P2 are
+            control points and P3 is end point.
+            Curve is adaptively subdivided into polyline which deviates from
+            curve less then FLATNESS_PULSES, so short and straight parts
+            require only a few points. Then for each pulse of X and Y axises
+            we find distance S along the polyline where axis crosses pulse
+            position and time is calculated with arc length
+            parameterization, t = S / V. Axis can reverse its direction
+            multiple times, so pulse is made when position differs from
+            current axis position more than 3/4 of pulse. This hysteresis
+            prevents jitter when curve goes near pulse boundary.
+            Z and E axises move linearly along curve length.
+            :param delta: finish position delta from the beginning.
+            :param control1: first control point relative to the beginning.
+            :param control2: second control point relative to the beginning.
+            :param velocity: velocity in mm per min.
+        """
+        super(PulseGeneratorBezier, self).__init__(delta)
+        self._cache_key = ("bezier",
+                           round(delta.x * STEPPER_PULSES_PER_MM_X),
+                           round(delta.y * STEPPER_PULSES_PER_MM_Y),
+                           round(delta.z * STEPPER_PULSES_PER_MM_Z),
+                           round(delta.e * STEPPER_PULSES_PER_MM_E),
+                           round(control1.x, 10), round(control1.y, 10),
+                           round(control2.x, 10), round(control2.y, 10),
+                           velocity, self._profile_key())
+        velocity = velocity / SECONDS_IN_MINUTE
+        self._control = ((0.0, 0.0), (control1.x, control1.y),
+                         (control2.x, control2.y), (delta.x, delta.y))
+        self._flatten()
+        # curve length
+        length = 0.0
+        self._distances = [0.0]
+        for i in range(1, len(self._points_x)):
+            length += math.hypot(self._points_x[i] - self._points_x[i - 1],
+                                 self._points_y[i] - self._points_y[i - 1])
+            self._distances.append(length)
+        full_length = math.sqrt(length * length + delta.z * delta.z
+                                + delta.e * delta.e)
+        # Velocity splits with corresponding distance.
+        if full_length == 0:
+            curve_velocity = velocity
+            self._velocity_z = velocity
+            self._velocity_e = velocity
+        else:
+            curve_velocity = length / full_length * velocity
+            self._velocity_z = abs(delta.z) / full_length * velocity
+            self._velocity_e = abs(delta.e) / full_length * velocity
+        # Limit velocity with centripetal acceleration in the sharpest point
+        # of curve, see PulseGeneratorCircular for details.
+        centripetal_velocity = math.sqrt(STEPPER_MAX_ACCELERATION_MM_PER_S2
+                                         * self._min_radius())
+        if curve_velocity > centripetal_velocity:
+            k = centripetal_velocity / curve_velocity
+            logging.debug("Centripetal acceleration limit, multiply velocity "
+                          "by {}".format(k))
+            curve_velocity *= k
+            self._velocity_z *= k
+            self._velocity_e *= k
+        self.max_velocity_mm_per_sec = self._adjust_velocity(
+            Coordinates(curve_velocity, curve_velocity,
+                        self._velocity_z, self._velocity_e))
+        curve_velocity = min(self.max_velocity_mm_per_sec.x,
+                             self.max_velocity_mm_per_sec.y)
+        self._velocity_z = self.max_velocity_mm_per_sec.z
+        self._velocity_e = self.max_velocity_mm_per_sec.e
+        # find pulses on curve and translate distances to time
+        self._dir_x, self._pulses_x = self.__curve_pulses(
+            self._points_x, self._distances, STEPPER_PULSES_PER_MM_X,
+            curve_velocity)
+        self._dir_y, self._pulses_y = self.__curve_pulses(
+            self._points_y, self._distances, STEPPER_PULSES_PER_MM_Y,
+            curve_velocity)
+        self._iterations_z = round(abs(delta.z) * STEPPER_PULSES_PER_MM_Z)
+        self._iterations_e = round(abs(delta.e) * STEPPER_PULSES_PER_MM_E)
+        self._z_dir = math.copysign(1, delta.z)
+        self._e_dir = math.copysign(1, delta.e)
+        self.acceleration_time_s = (self.max_velocity_mm_per_sec.find_max()
+                                    / STEPPER_MAX_ACCELERATION_MM_PER_S2)
+        if full_length == 0:
+            self.linear_time_s = 0.0
+            self.max_velocity_mm_per_sec = Coordinates(0, 0, 0, 0)
+        elif STEPPER_MAX_ACCELERATION_MM_PER_S2 * self.acceleration_time_s \
+                ** 2 > full_length:
+            self.acceleration_time_s = \
+                math.sqrt(full_length / STEPPER_MAX_ACCELERATION_MM_PER_S2)
+            self.linear_time_s = 0.0
+            v = full_length / self.acceleration_time_s
+            if self.max_velocity_mm_per_sec.x > 0.0:
+                self.max_velocity_mm_per_sec.x = v
+            if self.max_velocity_mm_per_sec.y > 0.0:
+                self.max_velocity_mm_per_sec.y = v
+            if self.max_velocity_mm_per_sec.z > 0.0:
+                self.max_velocity_mm_per_sec.z = v
+            if self.max_velocity_mm_per_sec.e > 0.0:
+                self.max_velocity_mm_per_sec.e = v
+        else:
+            linear_distance_mm = full_length - self.acceleration_time_s ** 2 \
+                                 * STEPPER_MAX_ACCELERATION_MM_PER_S2
+            self.linear_time_s = linear_distance_mm / math.sqrt(
+                curve_velocity ** 2 + self._velocity_z ** 2
+                + self._velocity_e ** 2)
+
+    def _flatten(self):
+        """ Subdivide curve with de Casteljau algorithm till each part is
+            flat enough to be replaced with line segment.
+        """
+        tolerance = self.FLATNESS_PULSES / max(STEPPER_PULSES_PER_MM_X,
+                                               STEPPER_PULSES_PER_MM_Y)
+        self._points_x = [0.0]
+        self._points_y = [0.0]
+        self._points_u = [0.0]
+        # stack of curve parts, the first part of curve is on top
+        stack = [(0.0, 1.0, self._control, 0)]
+        while stack:
+            u0, u1, (p0, p1, p2, p3), depth = stack.pop()
+            # distance of control points from points of uniformly
+            # parameterized chord limits deviation of curve from chord
+            d1 = math.hypot(p1[0] - (2.0 * p0[0] + p3[0]) / 3.0,
+                            p1[1] - (2.0 * p0[1] + p3[1]) / 3.0)
+            d2 = math.hypot(p2[0] - (p0[0] + 2.0 * p3[0]) / 3.0,
+                            p2[1] - (p0[1] + 2.0 * p3[1]) / 3.0)
+            if max(d1, d2) <= tolerance \
+                    or depth >= self.MAX_SUBDIVISION_DEPTH:
+                self._points_x.append(p3[0])
+                self._points_y.append(p3[1])
+                self._points_u.append(u1)
+                continue
+            p01 = self.__middle(p0, p1)
+            p12 = self.__middle(p1, p2)
+            p23 = self.__middle(p2, p3)
+            p012 = self.__middle(p01, p12)
+            p123 = self.__middle(p12, p23)
+            p0123 = self.__middle(p012, p123)
+            um = (u0 + u1) / 2.0
+            stack.append((um, u1, (p0123, p123, p23, p3), depth + 1))
+            stack.append((u0, um, (p0, p01, p012, p0123), depth + 1))
+        # end point is exact
+        self._points_x[-1] = self._delta.x
+        self._points_y[-1] = self._delta.y
+
+    @staticmethod
+    def __middle(a, b):
+        return (a[0] + b[0]) / 2.0, (a[1] + b[1]) / 2.0
+
+    def _min_radius(self):
+        """ Find minimal radius of curvature in curve points.
+            R = |B'|^3 / |B' x B''|
+        :return: radius in mm, it's never less then one pulse.
+        """
+        p0, p1, p2, p3 = self._control
+        radius = float("inf")
+        for u in self._points_u:
+            w = 1.0 - u
+            dx = 3.0 * (w * w * (p1[0] - p0[0]) + 2.0 * w * u * (p2[0] - p1[0])
+                        + u * u * (p3[0] - p2[0]))
+            dy = 3.0 * (w * w * (p1[1] - p0[1]) + 2.0 * w * u * (p2[1] - p1[1])
+                        + u * u * (p3[1] - p2[1]))
+            ddx = 6.0 * (w * (p2[0] - 2.0 * p1[0] + p0[0])
+                         + u * (p3[0] - 2.0 * p2[0] + p1[0]))
+            ddy = 6.0 * (w * (p2[1] - 2.0 * p1[1] + p0[1])
+                         + u * (p3[1] - 2.0 * p2[1] + p1[1]))
+            cross = abs(dx * ddy - dy * ddx)
+            if cross == 0.0:
+                continue
+            radius = min(radius, math.hypot(dx, dy) ** 3 / cross)
+        return max(radius, 1.0 / min(STEPPER_PULSES_PER_MM_X,
+                                     STEPPER_PULSES_PER_MM_Y))
+
+    @staticmethod
+    def __curve_pulses(points, distances, pulses_per_mm, velocity):
+        """ Find pulses of axis on curve polyline.
+        :param points: axis positions of polyline points in mm.
+        :param distances: distance along polyline for each point in mm.
+        :param pulses_per_mm: axis pulses per mm.
+        :param velocity: velocity along curve in mm per sec.
+        :return: Tuple of two lists, directions and times of pulses.
+        """
+        directions = []
+        times = []
+        position = 0
+        previous = 0.0
+        for i in range(1, len(points)):
+            current = points[i] * pulses_per_mm
+            if i == len(points) - 1:
+                current = round(current)
+            while True:
+                if current >= position + 0.75:
+                    direction = 1
+                elif current <= position - 0.75:
+                    direction = -1
+                else:
+                    break
+                f = (position + 0.75 * direction - previous) \
+                    / (current - previous)
+                s = distances[i - 1] + f * (distances[i] - distances[i - 1])
+                position += direction
+                directions.append(direction)
+                times.append(s / velocity)
+            previous = current
+        return directions, times
+
+    def bounds(self):
+        """ Get bounding box of movement.
+        :return: Tuple of two Coordinates, minimum and maximum position of
+                 each axis relative to the beginning.
+        """
+        return (Coordinates(min(self._points_x), min(self._points_y),
+                            min(0.0, self._delta.z), min(0.0, self._delta.e)),
+                Coordinates(max(self._points_x), max(self._points_y),
+                            max(0.0, self._delta.z), max(0.0, self._delta.e)))
+
+    def cache_key(self):
+        """ Return key for pulses cache, see super class for details.
+        """
+        return self._cache_key
+
+    def _get_movement_parameters(self):
+        """ Return movement parameters, see super class for details.
+        """
+        return (self.acceleration_time_s,
+                self.linear_time_s,
+                self.max_velocity_mm_per_sec)
+
+    @staticmethod
+    def __curve(i, directions, times):
+        if i >= len(times):
+            if directions:
+                return directions[-1], None
+            return 1, None
+        return directions[i], times[i]
+
+    @staticmethod
+    def __linear(i, total_i, pulses_per_mm, velocity):
+        if i >= total_i:
+            return None
+        return i / pulses_per_mm / velocity
+
+    def _interpolation_function(self, ix, iy, iz, ie):
+        """ Calculate interpolation values for curve movement, see super class
+            for details.
+        """
+        dx, tx = self.__curve(ix, self._dir_x, self._pulses_x)
+        dy, ty = self.__curve(iy, self._dir_y, self._pulses_y)
+        tz = self.__linear(iz, self._iterations_z, STEPPER_PULSES_PER_MM_Z,
+                           self._velocity_z)
+        te = self.__linear(ie, self._iterations_e, STEPPER_PULSES_PER_MM_E,
+                           self._velocity_e)
+        return (dx, dy, self._z_dir, self._e_dir), (tx, ty, tz, te)
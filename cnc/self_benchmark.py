@@ -0,0 +1,96 @@
+from __future__ import division
+import time
+
+from cnc.pulses import *
+from cnc.coordinates import Coordinates
+from cnc.enums import *
+from cnc.config import *
+
+""" Startup measurement of pulses generation speed on this host. Velocity
+    limits in config are limits of machine, but slow host (e.g. CPython on
+    Raspberry Pi 2) may be unable to generate pulses that fast. Measured
+    speed is used to decrease velocity of moves or to buffer such moves
+    before running, see SELF_BENCHMARK_MODE in config.
+"""
+
+STEP_PINS_MASK = STEP_PIN_MASK_X | STEP_PIN_MASK_Y | STEP_PIN_MASK_Z
+# number of events which are encoded at once
+BATCH_EVENTS = 256
+
+
+def measure(generator, hal=None):
+    """ Generate all pulses of move and convert them to GPIO writes.
+    :param generator: PulseGenerator object.
+    :param hal: hal module, if it has 'warmup' function, GPIO writes are also
+                encoded to its scratch buffer.
+    :return: tuple of number of pulses and generation time in seconds.
+    """
+    encode = getattr(hal, "warmup", None)
+    count = 0
+    batch = []
+    st = time.time()
+    for event in generator.gpio_events(TICKS_PER_SECOND, PULSE_LENGTH_TICKS):
+        if event[1] & STEP_PINS_MASK:
+            count += bin(event[1] & STEP_PINS_MASK).count("1")
+        if encode is not None:
+            batch.append(event)
+            if len(batch) >= BATCH_EVENTS:
+                encode(batch)
+                batch = []
+    if batch:
+        encode(batch)
+    # avoid zero time on low resolution timers
+    return count, max(time.time() - st, 1e-6)
+
+
+def representative_moves():
+    """ Moves which are typical for jobs.
+    :return: list of PulseGenerator objects.
+    """
+    v = min(MAX_VELOCITY_MM_PER_MIN_X, MAX_VELOCITY_MM_PER_MIN_Y)
+    return [PulseGeneratorLinear(Coordinates(20, 10, 0, 0), v),
+            PulseGeneratorCircular(Coordinates(0, 0, 0, 0),
+                                   Coordinates(5, 0, 0, 0), PLANE_XY, CW, v),
+            PulseGeneratorRapid(Coordinates(-20, -10, 1, 0))]
+
+
+def run(hal=None, duration_s=SELF_BENCHMARK_TIME_S,
+        margin=SELF_BENCHMARK_MARGIN, mode=SELF_BENCHMARK_MODE):
+    """ Measure pulses generation speed and apply it.
+    :param hal: hal module, if it has 'warmup' function, encoding to DMA
+                buffer is measured too, if it has 'generation_rate'
+                GenerationRate object, measured rates are added to it.
+    :param duration_s: time to measure.
+    :param margin: part of measured speed which can be used, the rest is
+                   left for OS and other work.
+    :param mode: 'clamp' to decrease velocity of moves which can't be
+                 generated in time, 'buffer' to keep velocity.
+    :return: dict with 'pulses_per_second' of each generator type and
+             'max_pulses_per_second' which is used.
+    """
+    if mode not in ('clamp', 'buffer'):
+        raise ValueError("unknown self benchmark mode {}".format(mode))
+    # measure without limits of the previous run
+    PulseGenerator.MAX_PULSES_PER_SECOND = None
+    moves = representative_moves()
+    stats = dict((g.__class__.__name__, [0, 0.0, 0.0]) for g in moves)
+    st = time.time()
+    while time.time() - st < duration_s:
+        for g in moves:
+            pulses, t = measure(g, hal)
+            s = stats[g.__class__.__name__]
+            s[0] += pulses
+            s[1] += t
+            s[2] += g.total_time_s()
+    rates = dict((name, pulses / t) for name, (pulses, t, _)
+                 in stats.items())
+    max_rate = min(rates.values()) * margin
+    generation_rate = getattr(hal, "generation_rate", None)
+    if generation_rate is not None:
+        for name, (_, t, movement_s) in stats.items():
+            generation_rate.update(name, movement_s * margin, t)
+    if mode == 'clamp':
+        PulseGenerator.MAX_PULSES_PER_SECOND = max_rate
+    logging.info("Host generates {} pulses per second, {} mode".format(
+        int(max_rate), mode))
+    return {"pulses_per_second": rates, "max_pulses_per_second": max_rate}
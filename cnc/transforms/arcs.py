@@ -0,0 +1,262 @@
+from __future__ import division
+
+import math
+
+from cnc.geometry import *
+from cnc.transforms.base import *
+
+# axises indexes of each plane, the first two are circle axises
+PLANE_AXISES = {PLANE_XY: (0, 1, 2), PLANE_ZX: (2, 0, 1),
+                PLANE_YZ: (1, 2, 0)}
+TABLE_SIZE_MM = (TABLE_SIZE_X_MM, TABLE_SIZE_Y_MM, TABLE_SIZE_Z_MM)
+
+
+class ArcWelder(GCodeTransform):
+    """ Replace sequences of G1 moves which points lie on one circle with
+        G2/G3 arc.
+        Points are collected while circle through the first, the middle and
+        the last point fits all of them, i.e. each point and the middle of
+        each segment is not further from circle than tolerance and head goes
+        around center in one direction less than a full turn. Moves should
+        be in the current plane and have the same feed rate, E axis should
+        extrude proportionally to distance. Arc center and end point are
+        rounded to pulses in the same way as GMachine does and arc is
+        validated with the same checks, otherwise moves are output as is.
+        Position should be known, so arcs are never made before the first
+        absolute move.
+    """
+    MIN_MOVES = ARC_WELDER_MIN_MOVES
+    MAX_MOVES = ARC_WELDER_MAX_MOVES
+    MAX_RADIUS_MM = ARC_WELDER_MAX_RADIUS_MM
+
+    def __init__(self, source, tolerance_mm=ARC_WELDER_TOLERANCE_MM):
+        """ Create object.
+        :param source: iterable object with gcode lines.
+        :param tolerance_mm: maximum deviation of polyline from arc.
+        """
+        super(ArcWelder, self).__init__(source)
+        self._tolerance_mm = tolerance_mm
+        self._run = []
+        self._run_lines = []
+        # absolute positions of all axises, the first one is start point
+        self._run_points = []
+        self._run_velocity = None
+        self._run_plane = None
+        self._held = []
+        self._moves_in = 0
+        self._moves_out = 0
+        self._arcs = 0
+
+    def _process(self, line, gcode):
+        """ Process line, see super class for details.
+        """
+        if gcode is None:
+            if self._run:
+                self._held.append(line)
+                return []
+            return [line]
+        c = self.move_command(gcode)
+        if c is not None:
+            self._moves_in += 1
+        delta = None
+        if c == 'G1':
+            delta = self._delta(gcode)
+        a, b, third = PLANE_AXISES[self._plane]
+        if delta is None or delta[third] != 0.0 or self._position[a] is None \
+                or self._position[b] is None:
+            out = self._flush()
+            out.append(line)
+            if c is not None:
+                self._moves_out += 1
+            return out
+        velocity = gcode.get('F', self._velocity)
+        out = []
+        if self._run and (velocity != self._run_velocity
+                          or self._plane != self._run_plane
+                          or len(self._run) >= self.MAX_MOVES):
+            out = self._flush()
+        # unknown positions are not used, since they are not changed
+        position = [0.0 if p is None else p for p in self._position]
+        if not self._run:
+            self._run_points = [position]
+            self._run_velocity = velocity
+            self._run_plane = self._plane
+        point = [p + d for p, d in zip(position, delta)]
+        while self._run and self._fit(self._run_points + [point]) is None:
+            if len(self._run) >= self.MIN_MOVES:
+                out.extend(self._flush())
+                self._run_points = [position]
+            else:
+                # output the first move as is and try without it
+                out.append(self._run_lines.pop(0))
+                self._run.pop(0)
+                self._run_points.pop(0)
+                self._moves_out += 1
+                out.extend(self._held)
+                self._held = []
+        self._run.append(gcode)
+        self._run_lines.append(line)
+        self._run_points.append(point)
+        return out
+
+    def _finish(self):
+        """ Output buffered moves, see super class for details.
+        """
+        return self._flush()
+
+    def _fit(self, points):
+        """ Find circle for points.
+        :param points: list of absolute positions.
+        :return: Tuple of center coordinates, radius and direction or None if
+                 points don't lie on circle.
+        """
+        a, b, _ = PLANE_AXISES[self._run_plane]
+        tolerance = self._tolerance_mm
+        # circle through the first, the middle and the last point
+        ax, ay = points[0][a], points[0][b]
+        bx, by = points[len(points) // 2][a], points[len(points) // 2][b]
+        cx, cy = points[-1][a], points[-1][b]
+        d = 2.0 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+        if d == 0.0:
+            return None
+        a2 = ax * ax + ay * ay
+        b2 = bx * bx + by * by
+        c2 = cx * cx + cy * cy
+        ca = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+        cb = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+        radius = math.hypot(ax - ca, ay - cb)
+        if radius > self.MAX_RADIUS_MM:
+            return None
+        sweep = 0.0
+        sign = 0.0
+        length = 0.0
+        lengths = [0.0]
+        for i in range(1, len(points)):
+            pa, pb = points[i - 1][a] - ca, points[i - 1][b] - cb
+            qa, qb = points[i][a] - ca, points[i][b] - cb
+            if abs(math.hypot(qa, qb) - radius) > tolerance:
+                return None
+            cross = pa * qb - pb * qa
+            if cross == 0.0 or (sign != 0.0 and (cross > 0) != (sign > 0)):
+                return None
+            sign = cross
+            angle = abs(math.atan2(cross, pa * qa + pb * qb))
+            # segment deviation from arc
+            if radius * (1.0 - math.cos(angle / 2.0)) > tolerance:
+                return None
+            sweep += angle
+            length += math.hypot(qa - pa, qb - pb)
+            lengths.append(length)
+        if sweep >= 2.0 * math.pi - tolerance / radius:
+            return None
+        # extruder should be proportional to distance
+        e0 = points[0][3]
+        de = points[-1][3] - e0
+        for point, l in zip(points, lengths):
+            if abs(point[3] - e0 - de * l / length) \
+                    > 1.0 / STEPPER_PULSES_PER_MM_E:
+                return None
+        if sign < 0:
+            return ca, cb, radius, CW
+        return ca, cb, radius, CCW
+
+    def _is_center(self, ra, rb, sa, sb, da, db):
+        """ Check if rounded center fits arc.
+        :param ra, rb: center relative to start point.
+        :param sa, sb: start point.
+        :param da, db: end point relative to start point.
+        :return: boolean value.
+        """
+        a, b, _ = PLANE_AXISES[self._run_plane]
+        m = min(PULSES_PER_MM[a], PULSES_PER_MM[b])
+        r = math.hypot(ra, rb)
+        if round(r * m) != round(math.hypot(da - ra, db - rb) * m):
+            return False
+        for p in self._run_points:
+            if abs(math.hypot(p[a] - sa - ra, p[b] - sb - rb) - r) \
+                    > self._tolerance_mm:
+                return False
+        return True
+
+    def _arc(self):
+        """ Make arc line for current run.
+        :return: arc line or None if arc isn't valid.
+        """
+        fit = self._fit(self._run_points)
+        if fit is None:
+            return None
+        ca, cb, radius, direction = fit
+        a, b, _ = PLANE_AXISES[self._run_plane]
+        start = self._run_points[0]
+        end = self._run_points[-1]
+        # round in the same way as GMachine does, machine position is always
+        # rounded to pulses
+        rpa, rpb = PULSES_PER_MM[a], PULSES_PER_MM[b]
+        sa = round(start[a] * rpa) / rpa
+        sb = round(start[b] * rpb) / rpb
+        da = round(end[a] * rpa) / rpa - sa
+        db = round(end[b] * rpb) / rpb - sb
+        if da == 0.0 and db == 0.0:
+            return None
+        # center is rounded to pulses too, so start and end radius can
+        # differ, try neighbour centers
+        ia = round((ca - sa) * rpa)
+        ib = round((cb - sb) * rpb)
+        candidates = sorted(((ia + i, ib + j) for i in range(-2, 3)
+                             for j in range(-2, 3)),
+                            key=lambda c: math.hypot(c[0] / rpa - ca + sa,
+                                                     c[1] / rpb - cb + sb))
+        for ia, ib in candidates:
+            ra = ia / rpa
+            rb = ib / rpb
+            if self._is_center(ra, rb, sa, sb, da, db):
+                break
+        else:
+            return None
+        try:
+            check_circle(da, db, ra, rb, direction, sa, sb,
+                         TABLE_SIZE_MM[a], TABLE_SIZE_MM[b], rpa, rpb)
+        except ValueError:
+            return None
+        line = self._merged_line('G2' if direction == CW else 'G3', self._run,
+                                 [e - s for s, e in zip(start, end)])
+        ia = format_value(ra / self._multiply)
+        ib = format_value(rb / self._multiply)
+        line += ' {}{} {}{}'.format('IJK'[a], ia, 'IJK'[b], ib)
+        return SourceLine(line, self._run[0].line)
+
+    def _flush(self):
+        """ Finish current run.
+        :return: list of lines to output.
+        """
+        if not self._run:
+            return []
+        arc = None
+        if len(self._run) >= self.MIN_MOVES:
+            arc = self._arc()
+        if arc is None:
+            out = list(self._run_lines)
+            self._moves_out += len(self._run_lines)
+        else:
+            out = [arc]
+            self._moves_out += 1
+            self._arcs += 1
+        out.extend(self._held)
+        self._run = []
+        self._run_lines = []
+        self._run_points = []
+        self._held = []
+        return out
+
+    def statistics(self):
+        """ Get arcs welding statistics.
+        :return: dict with number of input moves, output moves, arcs made and
+                 ratio of input and output moves.
+        """
+        ratio = 1.0
+        if self._moves_out > 0:
+            ratio = self._moves_in / self._moves_out
+        return {"moves_in": self._moves_in,
+                "moves_out": self._moves_out,
+                "arcs": self._arcs,
+                "merge_ratio": ratio}
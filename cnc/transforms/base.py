@@ -0,0 +1,196 @@
+from __future__ import division
+
+from cnc.config import *
+from cnc.coordinates import *
+from cnc.enums import *
+from cnc.gcode import GCode, GCodeException, SourceLine
+
+# commands which move head linearly
+LINEAR_MOVES = ('G0', 'G1')
+PULSES_PER_MM = (STEPPER_PULSES_PER_MM_X, STEPPER_PULSES_PER_MM_Y,
+                 STEPPER_PULSES_PER_MM_Z, STEPPER_PULSES_PER_MM_E)
+
+
+def format_value(value):
+    """ Format number for gcode line.
+    :param value: float number.
+    :return: string with number without trailing zeros.
+    """
+    s = '{:.6f}'.format(value).rstrip('0').rstrip('.')
+    if s == '-0':
+        return '0'
+    return s
+
+
+class GCodeTransform(object):
+    """ Base class for streaming gcode transformations.
+        Transformation is iterable object which reads gcode lines from source
+        iterable(file or another transformation) and yields lines, so
+        transformations can be chained into pipeline between reading and
+        GMachine without buffering the whole file. Numbers of SourceLine
+        lines are kept, merged lines get number of their first line.
+        This class parses lines and keeps track of modal state, i.e. absolute
+        or relative mode, units, plane, feed rate and position. Child classes
+        should implement _process() and _finish() methods.
+        Lines which can't be parsed are passed as is, so GMachine reports
+        error at the same line.
+    """
+
+    def __init__(self, source):
+        """ Create object.
+        :param source: iterable object with gcode lines.
+        """
+        self._source = source
+        self._absolute = True
+        self._multiply = 1.0
+        self._plane = PLANE_XY
+        self._velocity = None
+        # position in mm of each axis, None if position is unknown
+        self._position = [None, None, None, None]
+
+    def __iter__(self):
+        """ Iterate transformed lines.
+        """
+        for line in self._source:
+            line = SourceLine(line.strip(), getattr(line, "number", None))
+            try:
+                gcode = GCode.parse_line(line)
+            except GCodeException:
+                gcode = False
+            for l in self._process(line, gcode):
+                yield l
+            if gcode:
+                self._update_state(gcode)
+        for l in self._finish():
+            yield l
+
+    def _process(self, line, gcode):
+        """ Process line. This method have to be reimplemented in child
+            classes. It is called before state is updated with this line.
+        :param line: stripped source line.
+        :param gcode: GCode object, None for empty or comment line, False
+                      if line can't be parsed.
+        :return: iterable with lines to output.
+        """
+        raise NotImplementedError
+
+    def _finish(self):
+        """ Called when source is finished, child classes can reimplement it
+            to output buffered lines.
+        :return: iterable with lines to output.
+        """
+        return ()
+
+    @staticmethod
+    def move_command(gcode):
+        """ Get command of line if it is G0 or G1 move.
+        :param gcode: GCode object.
+        :return: 'G0', 'G1' or None if line isn't a linear move.
+        """
+        if not gcode:
+            return None
+        c = gcode.command()
+        if c is None and gcode.has_coordinates():
+            c = 'G1'
+        if c in LINEAR_MOVES:
+            return c
+        return None
+
+    @staticmethod
+    def modal_only(gcode):
+        """ Check if line only changes modal state of moves, i.e. it is feed
+            rate or G0/G1 word without coordinates.
+        :param gcode: GCode object.
+        :return: Boolean value.
+        """
+        if not gcode or gcode.has_coordinates():
+            return False
+        if gcode.command() not in (None, ) + LINEAR_MOVES:
+            return False
+        return all(k in ('G', 'F') for k in gcode.params)
+
+    def _delta(self, gcode):
+        """ Get movement delta of line in mm. Relative movements are rounded
+            to pulses like GMachine does, so sum of deltas is exactly the
+            same as machine movement.
+        :param gcode: GCode object.
+        :return: list with delta for each axis or None if it can't be found
+                 because position is unknown.
+        """
+        delta = []
+        for axis, position, ppm in zip('XYZE', self._position, PULSES_PER_MM):
+            value = gcode.get(axis, None, self._multiply)
+            if value is None:
+                delta.append(0.0)
+            elif not self._absolute:
+                delta.append(round(value * ppm) / ppm)
+            elif position is None:
+                return None
+            else:
+                delta.append(value - position)
+        return delta
+
+    def _merged_line(self, command, gcodes, delta):
+        """ Make one line for sequence of moves.
+        :param command: command of line.
+        :param gcodes: list of GCode objects of moves.
+        :param delta: overall movement delta in mm, it is used in relative
+                      mode only.
+        :return: SourceLine with line.
+        """
+        params = [command]
+        for i, axis in enumerate('XYZE'):
+            if not any(g.has(axis) for g in gcodes):
+                continue
+            if self._absolute:
+                # the last specified value is end position
+                value = [g.params[axis] for g in gcodes if g.has(axis)][-1]
+            else:
+                value = format_value(delta[i] / self._multiply)
+            params.append(axis + value)
+        for g in gcodes:
+            if g.has('F'):
+                params.append('F' + g.params['F'])
+                break
+        return SourceLine(' '.join(params), gcodes[0].line)
+
+    def _update_state(self, gcode):
+        """ Update modal state after line.
+        :param gcode: GCode object.
+        """
+        # feed rate is modal for any command, like in GMachine
+        self._velocity = gcode.get('F', self._velocity)
+        c = gcode.command()
+        if c is None and gcode.has_coordinates():
+            c = 'G1'
+        if c in ('G0', 'G1', 'G2', 'G3', 'G5'):
+            for i, axis in enumerate('XYZE'):
+                value = gcode.get(axis, None, self._multiply)
+                if value is None:
+                    continue
+                if self._absolute:
+                    self._position[i] = value
+                elif self._position[i] is not None:
+                    self._position[i] += (round(value * PULSES_PER_MM[i])
+                                          / PULSES_PER_MM[i])
+        elif c == 'G17':
+            self._plane = PLANE_XY
+        elif c == 'G18':
+            self._plane = PLANE_ZX
+        elif c == 'G19':
+            self._plane = PLANE_YZ
+        elif c == 'G20':
+            self._multiply = 25.4
+        elif c == 'G21':
+            self._multiply = 1.0
+        elif c == 'G90':
+            self._absolute = True
+        elif c == 'G91':
+            self._absolute = False
+        elif c in ('G28', 'G53', 'G92', 'M2', 'M30', 'T'):
+            # position can be changed by machine, forget it
+            self._position = [None, None, None, None]
+            if c in ('M2', 'M30'):
+                self._absolute = True
+                self._multiply = 1.0
+                self._plane = PLANE_XY
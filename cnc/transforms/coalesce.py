@@ -0,0 +1,137 @@
+from __future__ import division
+
+from cnc.transforms.base import *
+
+
+class CollinearCoalescer(GCodeTransform):
+    """ Merge consecutive collinear G0/G1 moves into one move.
+        Moves are merged only if they have the same command and feed rate,
+        each intermediate point deviates from the merged move not more than
+        tolerance and head doesn't go back along the line. E axis is treated
+        as usual axis, so extrusion stays proportional to distance. Any other
+        command finishes merging, so moves are never reordered with other
+        commands. Comments inside merged moves are output after merged move.
+    """
+    MAX_MOVES = COALESCE_MAX_MOVES
+
+    def __init__(self, source, tolerance_mm=None):
+        """ Create object.
+        :param source: iterable object with gcode lines.
+        :param tolerance_mm: maximum deviation of intermediate points, one
+                             pulse of each axis by default.
+        """
+        super(CollinearCoalescer, self).__init__(source)
+        if tolerance_mm is None:
+            self._tolerance = (1.0 / STEPPER_PULSES_PER_MM_X,
+                               1.0 / STEPPER_PULSES_PER_MM_Y,
+                               1.0 / STEPPER_PULSES_PER_MM_Z,
+                               1.0 / STEPPER_PULSES_PER_MM_E)
+        else:
+            self._tolerance = (tolerance_mm, ) * 4
+        self._run = []
+        self._run_lines = []
+        self._run_points = []
+        self._run_command = None
+        self._run_velocity = None
+        self._held = []
+        self._moves_in = 0
+        self._moves_out = 0
+
+    def _process(self, line, gcode):
+        """ Process line, see super class for details.
+        """
+        if gcode is None:
+            if self._run:
+                self._held.append(line)
+                return []
+            return [line]
+        c = self.move_command(gcode)
+        if c is None:
+            out = self._flush()
+            out.append(line)
+            return out
+        self._moves_in += 1
+        velocity = gcode.get('F', self._velocity)
+        delta = self._delta(gcode)
+        if delta is None:
+            # position is unknown, can't merge
+            out = self._flush()
+            out.append(line)
+            self._moves_out += 1
+            return out
+        out = []
+        if self._run:
+            end = [a + b for a, b in zip(self._run_points[-1], delta)]
+            if c != self._run_command or velocity != self._run_velocity \
+                    or len(self._run) >= self.MAX_MOVES \
+                    or not self._is_collinear(end):
+                out = self._flush()
+        if not self._run:
+            self._run_command = c
+            self._run_velocity = velocity
+            end = delta
+        self._run.append(gcode)
+        self._run_lines.append(line)
+        self._run_points.append(end)
+        return out
+
+    def _finish(self):
+        """ Output buffered moves, see super class for details.
+        """
+        return self._flush()
+
+    def _is_collinear(self, end):
+        """ Check if all points of current run lie on the line from the
+            beginning of run to the specified end point.
+        :param end: end point relative to the beginning of run.
+        :return: boolean value.
+        """
+        length2 = sum(v * v for v in end)
+        # allow going back for less than tolerance
+        back = 0.0
+        if length2 > 0.0:
+            back = min(self._tolerance) / length2 ** 0.5
+        previous = 0.0
+        for point in self._run_points:
+            if length2 > 0.0:
+                t = sum(p * v for p, v in zip(point, end)) / length2
+            else:
+                t = 0.0
+            if t < previous - back or t > 1.0 + back:
+                return False
+            previous = max(t, previous)
+            for p, v, tolerance in zip(point, end, self._tolerance):
+                if abs(p - v * t) > tolerance:
+                    return False
+        return True
+
+    def _flush(self):
+        """ Finish current run.
+        :return: list of lines to output.
+        """
+        if not self._run:
+            return []
+        if len(self._run) == 1:
+            out = [self._run_lines[0]]
+        else:
+            out = [self._merged_line(self._run_command, self._run,
+                                      self._run_points[-1])]
+        self._moves_out += 1
+        out.extend(self._held)
+        self._run = []
+        self._run_lines = []
+        self._run_points = []
+        self._held = []
+        return out
+
+    def statistics(self):
+        """ Get merging statistics.
+        :return: dict with number of input moves, output moves and ratio of
+                 them.
+        """
+        ratio = 1.0
+        if self._moves_out > 0:
+            ratio = self._moves_in / self._moves_out
+        return {"moves_in": self._moves_in,
+                "moves_out": self._moves_out,
+                "merge_ratio": ratio}
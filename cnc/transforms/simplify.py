@@ -0,0 +1,162 @@
+from __future__ import division
+
+import math
+
+from cnc.transforms.base import *
+
+
+class PolylineSimplifier(GCodeTransform):
+    """ Remove redundant points of G1 polylines with Douglas-Peucker
+        algorithm.
+        Consecutive G1 moves with the same feed rate are collected into
+        polyline, any other command(travel move, tool change etc) finishes
+        it. Then the farthest point from line between the first and the last
+        point is found, if it deviates more than tolerance, polyline is split
+        in this point and both parts are processed in the same way, otherwise
+        all points between are removed. Deviation is checked for each axis
+        including E, so extrusion stays the same.
+    """
+    MAX_POINTS = SIMPLIFY_MAX_POINTS
+
+    def __init__(self, source, tolerance_mm=SIMPLIFY_TOLERANCE_MM):
+        """ Create object.
+        :param source: iterable object with gcode lines.
+        :param tolerance_mm: maximum deviation of removed points, one pulse
+                             of each axis by default.
+        """
+        super(PolylineSimplifier, self).__init__(source)
+        if tolerance_mm is None:
+            self._tolerance = tuple(1.0 / p for p in PULSES_PER_MM)
+        else:
+            self._tolerance = (tolerance_mm, ) * 4
+        self._run = []
+        self._run_lines = []
+        self._run_comments = []
+        # points relative to the beginning of polyline, the first one is zero
+        self._run_points = []
+        self._run_velocity = None
+        self._held = []
+        self._points_in = 0
+        self._points_removed = 0
+        self._max_deviation = 0.0
+
+    def _process(self, line, gcode):
+        """ Process line, see super class for details.
+        """
+        if gcode is None:
+            if self._run:
+                # comments are kept with the next move
+                self._held.append(line)
+                return []
+            return [line]
+        delta = None
+        if self.move_command(gcode) == 'G1':
+            delta = self._delta(gcode)
+        if delta is None:
+            out = self._flush()
+            out.append(line)
+            return out
+        self._points_in += 1
+        velocity = gcode.get('F', self._velocity)
+        out = []
+        if self._run and (velocity != self._run_velocity
+                          or len(self._run) >= self.MAX_POINTS):
+            out = self._flush()
+        if not self._run:
+            self._run_points = [[0.0, 0.0, 0.0, 0.0]]
+            self._run_velocity = velocity
+        self._run.append(gcode)
+        self._run_lines.append(line)
+        self._run_comments.append(self._held)
+        self._held = []
+        self._run_points.append([p + d for p, d in
+                                 zip(self._run_points[-1], delta)])
+        return out
+
+    def _finish(self):
+        """ Output buffered moves, see super class for details.
+        """
+        return self._flush()
+
+    def _deviation(self, point, start, end):
+        """ Find deviation of point from segment.
+        :return: Tuple of deviation relative to tolerance and deviation in mm.
+        """
+        d = [e - s for s, e in zip(start, end)]
+        length2 = sum(v * v for v in d)
+        t = 0.0
+        if length2 > 0.0:
+            t = sum((p - s) * v for p, s, v in zip(point, start, d)) / length2
+            t = min(max(t, 0.0), 1.0)
+        residual = [p - s - v * t for p, s, v in zip(point, start, d)]
+        return (max(abs(r) / tol for r, tol in zip(residual,
+                                                   self._tolerance)),
+                math.sqrt(sum(r * r for r in residual)))
+
+    def _simplify(self):
+        """ Find points to keep with Douglas-Peucker algorithm.
+        :return: list with boolean value for each point.
+        """
+        points = self._run_points
+        keep = [False] * len(points)
+        keep[0] = keep[-1] = True
+        stack = [(0, len(points) - 1)]
+        while stack:
+            first, last = stack.pop()
+            index = None
+            farthest = 1.0
+            for i in range(first + 1, last):
+                relative, _ = self._deviation(points[i], points[first],
+                                              points[last])
+                if relative > farthest:
+                    index, farthest = i, relative
+            if index is not None:
+                keep[index] = True
+                stack.append((first, index))
+                stack.append((index, last))
+        return keep
+
+    def _flush(self):
+        """ Finish current polyline.
+        :return: list of lines to output.
+        """
+        if not self._run:
+            return []
+        keep = self._simplify()
+        out = []
+        previous = 0
+        for i in range(1, len(keep)):
+            # comments are output before the move they belong to
+            out.extend(self._run_comments[i - 1])
+            if not keep[i]:
+                _, mm = self._deviation(self._run_points[i],
+                                        self._run_points[previous],
+                                        self._run_points[
+                                            keep.index(True, i)])
+                self._max_deviation = max(self._max_deviation, mm)
+                self._points_removed += 1
+                continue
+            if i - previous == 1:
+                out.append(self._run_lines[i - 1])
+            else:
+                delta = [e - s for s, e in zip(self._run_points[previous],
+                                               self._run_points[i])]
+                out.append(self._merged_line('G1', self._run[previous:i],
+                                             delta))
+            previous = i
+        out.extend(self._held)
+        self._run = []
+        self._run_lines = []
+        self._run_comments = []
+        self._run_points = []
+        self._held = []
+        return out
+
+    def statistics(self):
+        """ Get simplification statistics.
+        :return: dict with number of input points, removed points and
+                 maximum deviation of removed points in mm.
+        """
+        return {"points_in": self._points_in,
+                "points_removed": self._points_removed,
+                "max_deviation_mm": self._max_deviation}
@@ -0,0 +1,530 @@
+from __future__ import division
+
+import math
+
+from cnc.transforms.base import *
+
+# commands which draw stroke
+DRAWING_MOVES = ('G1', 'G2', 'G3', 'G5')
+
+
+class Stroke(object):
+    """ Sequence of drawing moves between travel(G0) moves.
+    """
+
+    def __init__(self, start, velocity, travel):
+        """ Create object.
+        :param start: position of the beginning in mm, list of four values.
+        :param velocity: feed rate on the beginning.
+        :param travel: original travel lines before stroke.
+        """
+        self.start = start
+        self.end = start
+        self.velocity = velocity
+        self.end_velocity = velocity
+        self.travel = travel
+        # list of tuples (line, GCode object or None for comments, end point)
+        self.lines = []
+        self.reversible = True
+        self.has_e = False
+        # stroke depends on previous stroke
+        self.fixed = False
+
+    def add(self, line, gcode, target, velocity):
+        """ Add line to stroke.
+        :param line: gcode line.
+        :param gcode: GCode object, None for comments.
+        :param target: position after this line.
+        :param velocity: feed rate after this line.
+        """
+        self.lines.append((line, gcode, target))
+        if gcode is None:
+            return
+        if gcode.has('E'):
+            self.has_e = True
+        if self.end is self.start and gcode.command() == 'G5' \
+                and not gcode.has('I') and not gcode.has('J'):
+            # control point is reflected from the previous spline
+            self.fixed = True
+        if gcode.command() not in (None, 'G1') or gcode.has('E') \
+                or target[2] != self.start[2] \
+                or (gcode.has('F') and len(self.lines) > 1):
+            self.reversible = False
+        self.end = target
+        self.end_velocity = velocity
+
+
+def distance(a, b):
+    """ Travel distance in XY plane.
+    """
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def nearest_neighbour(starts, ends, reversible, origin):
+    """ Order strokes with nearest neighbour heuristic. Endpoints are stored
+        in grid, so nearest one is found by checking cells around current
+        position ring by ring.
+    :param starts: list of stroke start points.
+    :param ends: list of stroke end points.
+    :param reversible: list of boolean values, True if stroke can be drawn
+                       from the end.
+    :param origin: position before the first stroke.
+    :return: list of tuples (stroke index, reversed).
+    """
+    n = len(starts)
+    if n == 0:
+        return []
+    points = list(starts) + list(ends)
+    min_x = min(p[0] for p in points)
+    min_y = min(p[1] for p in points)
+    size = max(max(p[0] for p in points) - min_x,
+               max(p[1] for p in points) - min_y)
+    cell = size / max(1, int(math.sqrt(n)))
+    if cell <= 0.0:
+        cell = 1.0
+
+    def key(p):
+        return int((p[0] - min_x) // cell), int((p[1] - min_y) // cell)
+
+    grid = {}
+    for k in range(2 * n):
+        if k >= n and not reversible[k - n]:
+            continue
+        grid.setdefault(key(points[k]), []).append(k)
+    order = []
+    position = origin
+    for _ in range(n):
+        cx, cy = key(position)
+        best = None
+        best_distance = None
+        r = 0
+        while True:
+            if 8 * r > len(grid):
+                # ring is larger than the rest of grid, check all of it
+                cells = list(grid.values())
+            elif r == 0:
+                cells = [grid.get((cx, cy))]
+            else:
+                cells = [grid.get((cx + i, cy + j))
+                         for i in range(-r, r + 1) for j in (-r, r)]
+                cells += [grid.get((cx + i, cy + j))
+                          for i in (-r, r) for j in range(-r + 1, r)]
+            for c in cells:
+                if c is None:
+                    continue
+                for k in c:
+                    d = distance(position, points[k])
+                    if best is None or d < best_distance:
+                        best, best_distance = k, d
+            if 8 * r > len(grid):
+                break
+            # points in the next rings are not closer than r cells
+            if best is not None and best_distance <= r * cell:
+                break
+            r += 1
+        index = best % n
+        for k in (index, index + n):
+            c = grid.get(key(points[k]))
+            if c is not None and k in c:
+                c.remove(k)
+                if not c:
+                    del grid[key(points[k])]
+        order.append((index, best >= n))
+        if best >= n:
+            position = starts[index]
+        else:
+            position = ends[index]
+    return order
+
+
+def travel_length(order, starts, ends, origin):
+    """ Calculate total travel distance.
+    :param order: list of tuples (stroke index, reversed).
+    :return: distance in mm.
+    """
+    length = 0.0
+    position = origin
+    for index, reverse in order:
+        if reverse:
+            length += distance(position, ends[index])
+            position = starts[index]
+        else:
+            length += distance(position, starts[index])
+            position = ends[index]
+    return length
+
+
+def improve_order(order, starts, ends, reversible, origin, allow_reverse,
+                  window=10, passes=1):
+    """ Improve strokes order with local search in window of neighbours.
+        With reversing 2-opt is used, i.e. part of route is drawn backward,
+        otherwise Or-opt is used, i.e. one to three consecutive strokes are
+        moved to another place.
+    :param order: list of tuples (stroke index, reversed).
+    :param window: maximum distance in route between changed strokes.
+    :param passes: maximum number of passes.
+    :return: improved order.
+    """
+    hypot = math.hypot
+    # route points, the first item is origin, so a[i] is drawn after a[i - 1]
+    route = [(None, False)] + list(order)
+    first = [tuple(origin[:2])]
+    last = [tuple(origin[:2])]
+    for index, reverse in order:
+        if reverse:
+            first.append(tuple(ends[index][:2]))
+            last.append(tuple(starts[index][:2]))
+        else:
+            first.append(tuple(starts[index][:2]))
+            last.append(tuple(ends[index][:2]))
+
+    def d(a, b):
+        return hypot(a[0] - b[0], a[1] - b[1])
+
+    n = len(route)
+    for _ in range(passes):
+        improved = False
+        for i in range(1, n):
+            if allow_reverse:
+                # 2-opt, reverse route[i..j]
+                if not reversible[route[i][0]]:
+                    continue
+                for j in range(i + 1, min(n, i + window)):
+                    if not reversible[route[j][0]]:
+                        break
+                    before = d(last[i - 1], first[i])
+                    after = d(last[i - 1], last[j])
+                    if j + 1 < n:
+                        before += d(last[j], first[j + 1])
+                        after += d(first[i], first[j + 1])
+                    if after < before - 1e-9:
+                        route[i:j + 1] = [(index, not reverse) for
+                                          index, reverse in
+                                          reversed(route[i:j + 1])]
+                        first[i:j + 1], last[i:j + 1] = \
+                            last[j:i - 1:-1], first[j:i - 1:-1]
+                        improved = True
+                continue
+            # Or-opt, move route[i..e] after route[k]
+            for length in (1, 2, 3):
+                e = i + length - 1
+                if e >= n:
+                    break
+                gain = d(last[i - 1], first[i])
+                if e + 1 < n:
+                    gain += d(last[e], first[e + 1]) \
+                            - d(last[i - 1], first[e + 1])
+                best, best_gain = None, 1e-9
+                fx, fy = first[i]
+                lx, ly = last[e]
+                for k in range(max(0, i - window), min(n, e + window)):
+                    if i - 1 <= k <= e:
+                        continue
+                    kx, ky = last[k]
+                    g = gain - hypot(kx - fx, ky - fy)
+                    if k + 1 < n:
+                        nx, ny = first[k + 1]
+                        g += hypot(kx - nx, ky - ny) - hypot(lx - nx, ly - ny)
+                    if g > best_gain:
+                        best, best_gain = k, g
+                if best is None:
+                    continue
+                for a in (route, first, last):
+                    segment = a[i:e + 1]
+                    del a[i:e + 1]
+                    a[best + 1 - (length if best > e else 0):
+                      best + 1 - (length if best > e else 0)] = segment
+                improved = True
+                break
+        if not improved:
+            break
+    return route[1:]
+
+
+class TravelOptimizer(GCodeTransform):
+    """ Reorder strokes to minimize travel between them.
+        Job is split into strokes, i.e. drawing moves between travel(G0)
+        moves. Lines which only set feed rate belong to stroke or travel
+        where they are. Any other command(tool change, modal commands,
+        relative mode etc) is a fence, strokes are never moved over it, so
+        order of tool groups is kept. Strokes between fences are ordered with nearest
+        neighbour heuristic using spatial grid and then improved with local
+        search. Travel moves are generated again, if original travels lift
+        Z, the same lift height is used. Absolute E values are rebased, so
+        extrusion of each stroke stays the same. Simple G1 strokes without
+        Z and E movement can be drawn backward if reversing is allowed.
+        Travel distance is measured in XY plane.
+    """
+    WINDOW = TRAVEL_OPTIMIZER_WINDOW
+    PASSES = TRAVEL_OPTIMIZER_PASSES
+
+    def __init__(self, source, allow_reverse=False):
+        """ Create object.
+        :param source: iterable object with gcode lines.
+        :param allow_reverse: allow drawing strokes backward.
+        """
+        super(TravelOptimizer, self).__init__(source)
+        self._allow_reverse = allow_reverse
+        self._strokes = []
+        self._stroke = None
+        self._travel = []
+        self._comments = []
+        self._section_start = None
+        self._section_velocity = None
+        self._lift_z = None
+        self._travel_before = 0.0
+        self._travel_after = 0.0
+        self._strokes_count = 0
+        self._sections = 0
+
+    def _target(self, gcode):
+        """ Get absolute position after move.
+        """
+        return [gcode.get(axis, position, self._multiply)
+                for axis, position in zip('XYZE', self._position)]
+
+    def _process(self, line, gcode):
+        """ Process line, see super class for details.
+        """
+        if gcode is None:
+            self._comments.append(line)
+            return []
+        modal = self.modal_only(gcode)
+        c = self.move_command(gcode)
+        if c is None and gcode and gcode.command() in DRAWING_MOVES:
+            c = gcode.command()
+        if (c is None and not modal) or not self._absolute or self._position[0] is None \
+                or self._position[1] is None \
+                or (c == 'G0' and gcode.has('E')):
+            return self._fence(line)
+        if self._section_start is None:
+            self._section_start = list(self._position)
+            self._section_velocity = self._velocity
+        if modal:
+            if self._stroke is None:
+                # travel lines are kept only if order isn't changed, feed
+                # rate is restored with the first line of stroke
+                self._travel.append(line)
+                return []
+            self._add_comments()
+            self._stroke.add(line, gcode, list(self._position),
+                             gcode.get('F', self._velocity))
+            return []
+        target = self._target(gcode)
+        if c == 'G0':
+            out = self._close_stroke()
+            self._travel.append(line)
+            if gcode.has('Z') and (self._lift_z is None
+                                   or target[2] > self._lift_z):
+                self._lift_z = target[2]
+            return out
+        if self._stroke is None:
+            self._stroke = Stroke(list(self._position), self._velocity,
+                                  self._travel)
+            self._travel = []
+        self._add_comments()
+        self._stroke.add(line, gcode, target,
+                         gcode.get('F', self._velocity))
+        return []
+
+    def _add_comments(self):
+        """ Move held comments to current stroke.
+        """
+        for comment in self._comments:
+            self._stroke.add(comment, None, None, None)
+        self._comments = []
+
+    def _finish(self):
+        """ Output buffered strokes, see super class for details.
+        """
+        # nothing depends on position at the end of file, don't restore it
+        out = self._flush_section(restore=False)
+        out.extend(self._comments)
+        self._comments = []
+        return out
+
+    def _fence(self, line):
+        out = self._flush_section()
+        out.extend(self._comments)
+        out.append(line)
+        self._comments = []
+        return out
+
+    def _close_stroke(self):
+        """ Finish current stroke. Strokes which can't be moved flush
+            section and are output as is.
+        :return: list of lines to output.
+        """
+        stroke = self._stroke
+        self._stroke = None
+        if stroke is None:
+            return []
+        if stroke.velocity is not None and not stroke.fixed \
+                and not (stroke.has_e and stroke.start[3] is None):
+            self._strokes.append(stroke)
+            return []
+        out = self._flush_section()
+        out.extend(stroke.travel)
+        out.extend(line for line, _, _ in stroke.lines)
+        self._section_start = list(stroke.end)
+        self._section_velocity = stroke.end_velocity
+        return out
+
+    def _flush_section(self, restore=True):
+        """ Output all strokes of section in optimized order.
+        :param restore: move to the original position after section.
+        :return: list of lines to output.
+        """
+        out = self._close_stroke()
+        strokes = self._strokes
+        travel = self._travel
+        origin = self._section_start
+        self._strokes = []
+        self._travel = []
+        self._section_start = None
+        if not strokes:
+            out.extend(travel)
+            return out
+        self._sections += 1
+        self._strokes_count += len(strokes)
+        starts = [s.start for s in strokes]
+        ends = [s.end for s in strokes]
+        reversible = [s.reversible and self._allow_reverse for s in strokes]
+        original = [(i, False) for i in range(len(strokes))]
+        order = nearest_neighbour(starts, ends, reversible, origin)
+        order = improve_order(order, starts, ends, reversible, origin,
+                              self._allow_reverse, self.WINDOW, self.PASSES)
+        before = travel_length(original, starts, ends, origin)
+        after = travel_length(order, starts, ends, origin)
+        last = strokes[-1]
+        restore = restore and order[-1] != (len(strokes) - 1, False)
+        if restore:
+            # the rest of file starts where the last stroke ends
+            index, reverse = order[-1]
+            finish = strokes[index].start if reverse else strokes[index].end
+            after += distance(finish, last.end)
+        if after >= before:
+            # keep file as is
+            for stroke in strokes:
+                out.extend(stroke.travel)
+                out.extend(line for line, _, _ in stroke.lines)
+            self._travel_before += before
+            self._travel_after += before
+            out.extend(travel)
+            return out
+        position = list(origin)
+        velocity = self._section_velocity
+        offset_e = 0.0
+        for index, reverse in order:
+            stroke = strokes[index]
+            if reverse:
+                begin, finish = stroke.end, stroke.start
+            else:
+                begin, finish = stroke.start, stroke.end
+            out.extend(self._travel_lines(position, begin))
+            if stroke.has_e:
+                offset_e = position[3] - stroke.start[3]
+            if reverse:
+                out.extend(self._reversed_lines(stroke, velocity))
+            else:
+                out.extend(self._stroke_lines(stroke, velocity, offset_e))
+            e = position[3]
+            position = list(finish)
+            if stroke.has_e:
+                position[3] = stroke.end[3] + offset_e
+            else:
+                position[3] = e
+            velocity = stroke.end_velocity
+        # restore original position and feed rate for the rest of file
+        if restore:
+            out.extend(self._travel_lines(position, last.end))
+        self._travel_before += before
+        self._travel_after += after
+        if velocity != last.end_velocity:
+            out.append('G1 F' + format_value(last.end_velocity))
+        out.extend(travel)
+        return out
+
+    def _travel_lines(self, position, target):
+        """ Make travel lines.
+        :param position: current position.
+        :param target: travel target.
+        :return: list of lines.
+        """
+        out = []
+        if position[0] == target[0] and position[1] == target[1] \
+                and position[2] == target[2]:
+            return out
+        z = position[2]
+        if self._lift_z is not None and z is not None and z < self._lift_z:
+            z = self._lift_z
+            out.append('G0 Z' + format_value(z / self._multiply))
+        line = 'G0 X' + format_value(target[0] / self._multiply) \
+               + ' Y' + format_value(target[1] / self._multiply)
+        if target[2] is not None and target[2] != z:
+            if self._lift_z is not None:
+                out.append(line)
+                line = 'G0'
+            line += ' Z' + format_value(target[2] / self._multiply)
+        out.append(line)
+        return out
+
+    @staticmethod
+    def _rewrite(gcode, values):
+        """ Make line from GCode object with replaced values.
+        """
+        params = dict(gcode.params)
+        params.update(values)
+        keys = list(gcode.params.keys())
+        keys += [k for k in values.keys() if k not in keys]
+        return SourceLine(' '.join(k + params[k] for k in keys), gcode.line)
+
+    def _stroke_lines(self, stroke, velocity, offset_e):
+        out = []
+        first = True
+        for line, gcode, _ in stroke.lines:
+            if gcode is None:
+                out.append(line)
+                continue
+            values = {}
+            if first and not gcode.has('F') and velocity != stroke.velocity:
+                values['F'] = format_value(stroke.velocity)
+            if gcode.has('E') and offset_e != 0.0:
+                values['E'] = format_value(
+                    gcode.get('E', 0.0, self._multiply) / self._multiply
+                    + offset_e / self._multiply)
+            first = False
+            if values:
+                out.append(self._rewrite(gcode, values))
+            else:
+                out.append(line)
+        return out
+
+    def _reversed_lines(self, stroke, velocity):
+        out = [line for line, gcode, _ in stroke.lines if gcode is None]
+        points = [stroke.start] + [target for _, gcode, target in
+                                   stroke.lines if gcode is not None]
+        for point in reversed(points[:-1]):
+            line = 'G1 X' + format_value(point[0] / self._multiply) \
+                   + ' Y' + format_value(point[1] / self._multiply)
+            if velocity != stroke.end_velocity:
+                line += ' F' + format_value(stroke.end_velocity)
+                velocity = stroke.end_velocity
+            out.append(line)
+        return out
+
+    def statistics(self):
+        """ Get optimization statistics.
+        :return: dict with number of strokes, sections between fences, travel
+                 distance before and after optimization in mm and saved
+                 percent.
+        """
+        saved = 0.0
+        if self._travel_before > 0.0:
+            saved = (100.0 * (self._travel_before - self._travel_after)
+                     / self._travel_before)
+        return {"strokes": self._strokes_count,
+                "sections": self._sections,
+                "travel_before_mm": self._travel_before,
+                "travel_after_mm": self._travel_after,
+                "saved_percent": saved}
@@ -0,0 +1,74 @@
+from __future__ import division
+import time
+import logging
+
+from cnc import self_benchmark
+from cnc.pulses import TICKS_PER_SECOND, PULSE_LENGTH_TICKS
+from cnc.config import *
+
+""" JIT warm-up. PyPy compiles code after it was run many times, so the first
+    moves of a job are generated by interpreter and may be too slow for
+    real time running. Warm-up generates synthetic moves and writes them to
+    hal's scratch buffer without any output until generation speed stops
+    changing.
+"""
+
+# number of rounds in a row with stable speed to finish warm-up
+STABLE_ROUNDS = 2
+
+
+def _round(moves, hal_warmup):
+    """ Generate all moves once.
+    :param moves: list of PulseGenerator objects.
+    :param hal_warmup: hal's warmup function or None.
+    :return: number of events.
+    """
+    count = 0
+    for g in moves:
+        events = g.gpio_events(TICKS_PER_SECOND, PULSE_LENGTH_TICKS)
+        if hal_warmup is None:
+            for _ in events:
+                count += 1
+        else:
+            count += hal_warmup(events)
+    return count
+
+
+def run(hal=None, max_time_s=JIT_WARMUP_MAX_TIME_S,
+        tolerance=JIT_WARMUP_TOLERANCE):
+    """ Run warm-up until speed of generation is stable.
+    :param hal: hal module, if it has 'warmup' function, events are also
+                written with it.
+    :param max_time_s: stop warm-up after this time even if speed still
+                       changes.
+    :param tolerance: relative change of speed between rounds which is
+                      considered as stable.
+    :return: dict with warm-up 'time_s', number of 'rounds', the last
+             'events_per_second' and 'stable' flag.
+    """
+    moves = self_benchmark.representative_moves()
+    hal_warmup = getattr(hal, "warmup", None)
+    st = time.time()
+    rounds = 0
+    stable = 0
+    rate = previous = None
+    while stable < STABLE_ROUNDS and time.time() - st < max_time_s:
+        rt = time.time()
+        count = _round(moves, hal_warmup)
+        rate = count / max(time.time() - rt, 1e-6)
+        rounds += 1
+        if previous is not None and abs(rate - previous) <= tolerance \
+                * previous:
+            stable += 1
+        else:
+            stable = 0
+        previous = rate
+    t = time.time() - st
+    if stable >= STABLE_ROUNDS:
+        logging.info("JIT warm-up took {}s, {} rounds".format(round(t, 2),
+                                                              rounds))
+    else:
+        logging.warning("JIT warm-up is stopped after {}s, generation speed "
+                        "is still unstable".format(round(t, 2)))
+    return {"time_s": t, "rounds": rounds, "events_per_second": rate,
+            "stable": stable >= STABLE_ROUNDS}
@@ -0,0 +1,215 @@
+from __future__ import division
+import random
+
+from cnc.config import *
+
+""" Seeded generators of production like gcode jobs for benchmarks, time
+    estimation and transformations. The same size and seed always give the
+    same lines. All moves are inside of table and don't need homing.
+    Each generator starts with G21 and G90 and returns head to zero at the
+    end, so they can be chained.
+"""
+
+MARGIN_MM = 10.0
+# painting height and lift height for travel moves
+DRAW_Z_MM = 1.0
+LIFT_Z_MM = 3.0
+TOOLS = len(EXTRUDER_CONFIG)
+ARC_RADIUS_STEP_MM = 0.25
+
+
+def _header():
+    return ["G21", "G90", "G17"]
+
+
+def _footer():
+    return ["G0 X0 Y0 Z0"]
+
+
+def _point(rnd, margin=MARGIN_MM):
+    return (round(rnd.uniform(margin, TABLE_SIZE_X_MM - margin), 2),
+            round(rnd.uniform(margin, TABLE_SIZE_Y_MM - margin), 2))
+
+
+def _clamp(v, size):
+    return round(min(max(v, MARGIN_MM), size - MARGIN_MM), 2)
+
+
+def painting(size=20000, seed=0, tool_change_every=500):
+    """ Short painting strokes: travel with lifted head, a few short lines
+        on drawing height, tool change after each tool_change_every strokes.
+    :param size: number of strokes.
+    :param seed: random seed.
+    :param tool_change_every: number of strokes with the same tool.
+    :return: generator of gcode lines.
+    """
+    rnd = random.Random(seed)
+    for line in _header():
+        yield line
+    tool = 0
+    yield "T0"
+    for i in range(size):
+        if i > 0 and i % tool_change_every == 0:
+            tool = (tool + 1) % TOOLS
+            yield "G0 Z{}".format(LIFT_Z_MM)
+            yield "T{}".format(tool)
+        x, y = _point(rnd)
+        yield "G0 X{} Y{} Z{}".format(x, y, LIFT_Z_MM)
+        yield "G1 Z{} F{}".format(DRAW_Z_MM, rnd.choice((300, 600)))
+        # feed is set on the first line of stroke, like exporters do
+        feed = " F{}".format(rnd.choice((900, 1200, 1800)))
+        for _ in range(rnd.randint(1, 6)):
+            x = _clamp(x + rnd.uniform(-3.0, 3.0), TABLE_SIZE_X_MM)
+            y = _clamp(y + rnd.uniform(-3.0, 3.0), TABLE_SIZE_Y_MM)
+            yield "G1 X{} Y{}{}".format(x, y, feed)
+            feed = ""
+        yield "G0 Z{}".format(LIFT_Z_MM)
+    for line in _footer():
+        yield line
+
+
+def arc_field(size=5000, seed=0):
+    """ Dense field of small quarter, half and full circles in all planes.
+        End points are exactly on circles, so arcs never fail checks.
+        Radii are multiples of ARC_RADIUS_STEP_MM, circular generator
+        yields pulses of two axises at the same time for some odd radii.
+    :param size: number of arcs.
+    :param seed: random seed.
+    :return: generator of gcode lines.
+    """
+    rnd = random.Random(seed)
+    for line in _header():
+        yield line
+    z = 2 * MARGIN_MM
+    yield "G0 Z{}".format(z)
+    yield "F{}".format(1200)
+    for i in range(size):
+        # arcs are grouped around the same point
+        if i % 50 == 0:
+            x, y = _point(rnd, 2 * MARGIN_MM)
+            yield "G17"
+            yield "G0 X{} Y{}".format(x, y)
+        r = ARC_RADIUS_STEP_MM * rnd.randint(1, 20)
+        g = rnd.choice(("G2", "G3"))
+        kind = rnd.random()
+        plane = rnd.random()
+        if plane < 0.8:
+            a, b, ca, cb = "X", "Y", "I", "J"
+            cmd = "G17"
+        elif plane < 0.9:
+            a, b, ca, cb = "Z", "X", "K", "I"
+            cmd = "G18"
+        else:
+            a, b, ca, cb = "Y", "Z", "J", "K"
+            cmd = "G19"
+        pos = {"X": x, "Y": y, "Z": z}
+        if kind < 0.4:
+            # quarter, center is shifted along the first axis
+            end = "{}{} {}{}".format(a, round(pos[a] + r, 2),
+                                     b, round(pos[b] + r, 2))
+        elif kind < 0.8:
+            # half of circle
+            end = "{}{} {}{}".format(a, round(pos[a] + 2 * r, 2),
+                                     b, pos[b])
+        else:
+            end = "{}{} {}{}".format(a, pos[a], b, pos[b])
+        yield cmd
+        yield "{} {} {}{} {}0".format(g, end, ca, r, cb)
+        # return to the group center for the next arc
+        yield "G1 X{} Y{} Z{}".format(x, y, z)
+    for line in _footer():
+        yield line
+
+
+def travel(size=500, seed=0):
+    """ Long rapid moves across the whole table with a dot at each point.
+    :param size: number of travel moves.
+    :param seed: random seed.
+    :return: generator of gcode lines.
+    """
+    rnd = random.Random(seed)
+    for line in _header():
+        yield line
+    for _ in range(size):
+        x, y = _point(rnd)
+        yield "G0 X{} Y{} Z{}".format(x, y, LIFT_Z_MM)
+        yield "G1 Z{} F600".format(DRAW_Z_MM)
+        yield "G1 Z{}".format(LIFT_Z_MM)
+    for line in _footer():
+        yield line
+
+
+def tiny_segments(size=20000, seed=0):
+    """ Polylines of segments which are shorter than a single pulse, as
+        exported from high resolution curves. Most of them are skipped
+        by machine and accumulated until the next pulse.
+    :param size: number of segments.
+    :param seed: random seed.
+    :return: generator of gcode lines.
+    """
+    rnd = random.Random(seed)
+    step = 1.0 / min(STEPPER_PULSES_PER_MM_X, STEPPER_PULSES_PER_MM_Y)
+    for line in _header():
+        yield line
+    x, y = _point(rnd)
+    yield "G0 X{} Y{} Z{}".format(x, y, DRAW_Z_MM)
+    yield "F{}".format(600)
+    dx = dy = 0.0
+    for i in range(size):
+        if i % 200 == 0:
+            dx = rnd.uniform(-1.0, 1.0) * step
+            dy = rnd.uniform(-1.0, 1.0) * step
+        x += dx * rnd.uniform(0.1, 0.9)
+        y += dy * rnd.uniform(0.1, 0.9)
+        if not (MARGIN_MM < x < TABLE_SIZE_X_MM - MARGIN_MM
+                and MARGIN_MM < y < TABLE_SIZE_Y_MM - MARGIN_MM):
+            dx, dy = -dx, -dy
+            continue
+        yield "G1 X{:.5f} Y{:.5f}".format(x, y)
+    for line in _footer():
+        yield line
+
+
+def mixed_units(size=50, seed=0, moves=40):
+    """ Sections of lines which switch between millimeters and inches.
+    :param size: number of sections.
+    :param seed: random seed.
+    :param moves: number of moves in section.
+    :return: generator of gcode lines.
+    """
+    rnd = random.Random(seed)
+    for line in _header():
+        yield line
+    yield "G0 Z{}".format(DRAW_Z_MM)
+    for i in range(size):
+        inches = i % 2 == 0
+        yield "G20" if inches else "G21"
+        yield "F{}".format(40 if inches else 1000)
+        for _ in range(moves):
+            x, y = _point(rnd)
+            if inches:
+                yield "G1 X{:.4f} Y{:.4f}".format(x / 25.4, y / 25.4)
+            else:
+                yield "G1 X{} Y{}".format(x, y)
+    yield "G21"
+    for line in _footer():
+        yield line
+
+
+WORKLOADS = {"painting": painting, "arc_field": arc_field,
+             "travel": travel, "tiny_segments": tiny_segments,
+             "mixed_units": mixed_units}
+
+
+def mixed(scale=1.0, seed=0):
+    """ All workloads one by one.
+    :param scale: multiplier for default size of each workload.
+    :param seed: random seed.
+    :return: generator of gcode lines.
+    """
+    defaults = {"painting": 20000, "arc_field": 5000, "travel": 500,
+                "tiny_segments": 20000, "mixed_units": 50}
+    for name in sorted(WORKLOADS):
+        size = max(1, int(defaults[name] * scale))
+        for line in WORKLOADS[name](size, seed):
+            yield line
@@ -0,0 +1,16 @@
+; circular and spline moves, see test_golden.py
+G21
+G90
+G0 X10 Y10
+G1 Z2 F1200
+G17
+G2 X14 Y14 I2 J2 F900
+G3 X14 Y14 I-1 J-1
+G2 X12 Y12 I-1 J-1 Z3 F600
+G18
+G2 X12 Z3 I1 K-1 F300
+G19
+G3 Y12 Z3 J-1 K1 F300
+G17
+G5 X16 Y10 I1 J2 P-1 Q2 F900
+G0 X0 Y0 Z0
@@ -0,0 +1,17 @@
+; linear and rapid moves, see test_golden.py
+G21
+G90
+G0 X5 Y5
+G1 X15 Y12 Z1 F1200
+G1 X20 Y12 E0.05 F1800
+G1 X20.05 Y12.03 ; tiny segments
+G1 X20.1 Y12.05
+G1 X20.12 Y12.1
+G91
+G1 X-3 Y-4 Z-0.5 F600
+G1 Y2 E-0.05
+G20
+G1 X0.2 Y0.1 F30
+G21
+G90
+G0 X0 Y0 Z0
@@ -0,0 +1,57 @@
+import unittest
+
+from cnc import bench
+from cnc import pulses
+from cnc import gmachine
+from cnc import workloads
+from cnc.config import *
+
+
+class TestBench(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_run(self):
+        res = bench.run(pulses_per_step=(4, 8), feeds=(1800,), lengths=(1,),
+                        planes=("XY", "ZX"))
+        # linear and two circular moves for each mode and microstepping
+        self.assertEqual(len(res["results"]), 2 * 3 * len(bench.MODES))
+        for r in res["results"]:
+            self.assertGreater(r["pulses"], 0)
+            self.assertGreater(r["rate"], 0)
+            if r["generator"] == "linear":
+                self.assertEqual(r["pulses"],
+                                 r["pulses_per_step"] * STEPPER_STEPS_PER_MM)
+        for mode in bench.MODES:
+            self.assertEqual(sorted(res["max_feed"][mode].keys()),
+                             ["4", "8"])
+        # microstepping is restored
+        self.assertEqual(pulses.STEPPER_PULSES_PER_MM_X,
+                         STEPPER_PULSES_PER_MM_X)
+
+    def test_pipeline(self):
+        hal = gmachine.hal
+        lines = list(workloads.painting(3, seed=1))
+        res = bench.pipeline(lines)
+        self.assertIs(gmachine.hal, hal)
+        self.assertEqual(res["lines"], len(lines))
+        self.assertGreaterEqual(res["metrics"]["moves"], res["moves"])
+        self.assertGreater(res["job_s"], 0)
+        for stage in ("parse", "plan", "generate", "encode", "hal"):
+            self.assertGreater(res[stage], 0)
+        self.assertAlmostEqual(res["ratio"],
+                               res["preparation"] / res["job_s"])
+
+    def test_max_feed(self):
+        results = [{"mode": "pulses", "pulses_per_step": 4, "feed": 600,
+                    "rate": 3.0},
+                   {"mode": "pulses", "pulses_per_step": 4, "feed": 1200,
+                    "rate": 1.0}]
+        self.assertEqual(bench.max_feed(results), {"pulses": {"4": 1200}})
+
+
+if __name__ == '__main__':
+    unittest.main()
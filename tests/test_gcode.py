@@ -135,6 +135,12 @@ class TestGCode(unittest.TestCase):
         self.assertEqual(gc.coordinates(self.default, 1).y, 3.0)
         self.assertEqual(gc.coordinates(self.default, 1).z, 4.0)
 
+    def test_source_line(self):
+        self.assertIsNone(GCode.parse_line("X1").line)
+        gc = GCode.parse_line(SourceLine("x1 ; comment", 5))
+        self.assertEqual(gc.line, 5)
+        self.assertEqual(gc.coordinates(self.default, 1).x, 1.0)
+
 
 if __name__ == '__main__':
     unittest.main()
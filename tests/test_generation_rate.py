@@ -0,0 +1,42 @@
+import unittest
+
+from cnc.generation_rate import *
+
+
+class TestGenerationRate(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_update(self):
+        r = GenerationRate()
+        self.assertIsNone(r.rate("linear"))
+        # too short measurement is ignored
+        self.assertIsNone(r.update("linear", 1.0, 0.0))
+        self.assertEqual(r.update("linear", 4.0, 1.0), 4.0)
+        self.assertIsNone(r.rate("circular"))
+        # speed up is smoothed
+        rate = r.update("linear", 8.0, 1.0)
+        self.assertGreater(rate, 4.0)
+        self.assertLess(rate, 8.0)
+        # slow down is taken immediately
+        self.assertEqual(r.update("linear", 1.0, 2.0), 0.5)
+        self.assertEqual(r.statistics()["linear"]["samples"], 3)
+
+    def test_preroll(self):
+        # unknown or fast generation needs margin only
+        self.assertEqual(GenerationRate.preroll(10.0, None, 0.1), 0.1)
+        self.assertEqual(GenerationRate.preroll(10.0, 2.0, 0.1), 0.1)
+        # generation never falls behind movement
+        for rate in (0.1, 0.5, 0.9):
+            p = GenerationRate.preroll(10.0, rate, 0.0)
+            self.assertAlmostEqual(p / rate + 10.0, 10.0 / rate)
+        self.assertAlmostEqual(GenerationRate.preroll(10.0, 0.5, 0.1), 5.1)
+        # too slow generation requires buffering of the whole move
+        self.assertGreaterEqual(GenerationRate.preroll(10.0, 0.0, 0.1), 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
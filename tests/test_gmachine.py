@@ -39,6 +39,22 @@ class TestGMachine(unittest.TestCase):
         m.do_command(None)
         self.assertEqual(m.position(), Coordinates(0, 0, 0, 0))
 
+    def test_source_line(self):
+        # generators get number of source line of their command
+        m = GMachine()
+        lines = []
+        move = hal.move
+        hal.move = lambda gen: lines.append(gen.line) or move(gen)
+        try:
+            m.do_command(GCode.parse_line(SourceLine("G1 X1 F600", 7)))
+            m.do_command(None)
+            m.do_command(GCode.parse_line("G2 X2 I0.5"))
+        finally:
+            hal.move = move
+        self.assertEqual(lines[0], 7)
+        self.assertTrue(len(lines) > 1)
+        self.assertEqual(set(lines[1:]), set([None]))
+
     def test_unknown(self):
         # Test commands which doesn't exists
         m = GMachine()
@@ -65,6 +81,22 @@ class TestGMachine(unittest.TestCase):
         self.assertRaises(GMachineException,
                           m.do_command, GCode.parse_line("G1 X0 Y0 Z-1"))
 
+    def test_g0_decoupled(self):
+        m = GMachine()
+        m.DECOUPLED_RAPIDS = True
+        m.do_command(GCode.parse_line("G0 X10 Y100 Z11"))
+        self.assertEqual(m.position(), Coordinates(10, 100, 11, 0))
+        m.do_command(GCode.parse_line("G0 X3 Z1"))
+        self.assertEqual(m.position(), Coordinates(3, 100, 1, 0))
+        m.RAPID_LIFT_Z_FIRST = False
+        m.do_command(GCode.parse_line("G0 X5 Y5 Z5"))
+        self.assertEqual(m.position(), Coordinates(5, 5, 5, 0))
+        # extruder moves are always coordinated
+        m.do_command(GCode.parse_line("G0 X3 Y2 Z1 E2"))
+        self.assertEqual(m.position(), Coordinates(3, 2, 1, 2))
+        self.assertRaises(GMachineException,
+                          m.do_command, GCode.parse_line("G0 X-1 Y0 Z0"))
+
     def test_feed_rate(self):
         PulseGenerator.AUTO_VELOCITY_ADJUSTMENT = False
         m = GMachine()
@@ -162,6 +194,67 @@ class TestGMachine(unittest.TestCase):
         self.assertRaises(GMachineException,
                           m.do_command, GCode.parse_line("G2 X2 I-1"))
 
+    def test_arc_linearization(self):
+        m = GMachine()
+        m.ARC_INTERPOLATION = 'linear'
+        m.do_command(GCode.parse_line("G1 X10 Y10"))
+        m.do_command(GCode.parse_line("G2 J1"))
+        m.do_command(GCode.parse_line("G3 X11 Y11 J1"))
+        self.assertEqual(m.position(), Coordinates(11, 11, 0, 0))
+        m.do_command(GCode.parse_line("G2 X13 Y11 Z2 I1"))
+        self.assertEqual(m.position(), Coordinates(13, 11, 2, 0))
+        m.do_command(GCode.parse_line("G18"))
+        m.do_command(GCode.parse_line("G2 X13 Z2 K1"))
+        m.do_command(GCode.parse_line("G19"))
+        m.do_command(GCode.parse_line("G3 Y13 Z2 J1"))
+        self.assertEqual(m.position(), Coordinates(13, 13, 2, 0))
+        m.do_command(GCode.parse_line("G17"))
+        segments = m._linearize_arc(Coordinates(0, 0, 0, 0),
+                                    Coordinates(0, 10, 0, 0), 100, CW)
+        self.assertEqual(len(segments), int(math.ceil(
+            2 * math.pi / (2 * math.acos(1.0 - ARC_TOLERANCE_MM / 10)))))
+        # small arc is converted in auto mode, but large one is not
+        m.ARC_INTERPOLATION = 'auto'
+        self.assertIsNotNone(m._linearize_arc(Coordinates(0, 0, 0, 0),
+                                              Coordinates(0.1, 0, 0, 0),
+                                              100, CW))
+        self.assertIsNone(m._linearize_arc(Coordinates(0, 0, 0, 0),
+                                           Coordinates(10, 0, 0, 0),
+                                           100, CW))
+        m.ARC_INTERPOLATION = 'exact'
+        self.assertIsNone(m._linearize_arc(Coordinates(0, 0, 0, 0),
+                                           Coordinates(0.1, 0, 0, 0),
+                                           100, CW))
+        # radius is less than a single pulse
+        m.do_command(GCode.parse_line("G1 X10 Y10 Z0 F600"))
+        m.do_command(GCode.parse_line("G2 X10.002 Y10 I0.001 J0"))
+        self.assertEqual(m.position(), Coordinates(10, 10, 0, 0)
+                         + Coordinates(0.002, 0, 0, 0).round_to_nearest_pulse())
+
+    def test_g5(self):
+        m = GMachine()
+        self.assertRaises(GMachineException,
+                          m.do_command, GCode.parse_line("G5 X10 P0 Q0"))
+        self.assertRaises(GMachineException,
+                          m.do_command, GCode.parse_line("G5 X10 I1 J1"))
+        m.do_command(GCode.parse_line("G1 X10 Y10"))
+        m.do_command(GCode.parse_line("G5 X20 Y10 I2 J5 P-2 Q5"))
+        self.assertEqual(m.position(), Coordinates(20, 10, 0, 0))
+        # first control point is reflection of the previous second one
+        m.do_command(GCode.parse_line("G5 X30 Y10 Z1 P-2 Q-5"))
+        self.assertEqual(m.position(), Coordinates(30, 10, 1, 0))
+        # reflection works only for sequence of splines
+        m.do_command(GCode.parse_line("G1 X40"))
+        self.assertRaises(GMachineException,
+                          m.do_command, GCode.parse_line("G5 X50 P0 Q5"))
+        # end points are in table, but curve is not
+        self.assertRaises(GMachineException, m.do_command,
+                          GCode.parse_line("G5 X50 Y10 I0 J-20 P0 Q-20"))
+        self.assertEqual(m.position(), Coordinates(40, 10, 1, 0))
+        m.do_command(GCode.parse_line("G19"))
+        self.assertRaises(GMachineException, m.do_command,
+                          GCode.parse_line("G5 X40 Y10 I0 J5 P0 Q5"))
+
     def test_g4(self):
         m = GMachine()
         st = time.time()
@@ -201,5 +294,18 @@ class TestGMachine(unittest.TestCase):
         m.do_command(GCode.parse_line("X1 Y1 Z1 E1"))
         self.assertEqual(m.position(), Coordinates(1, 1, 1, 1))
 
+    def test_m408(self):
+        m = GMachine()
+        moves = hal.get_metrics()["moves"]
+        # the same keys as Raspberry Pi hal returns
+        self.assertTrue(set(hal.get_metrics()).issuperset(
+            ["moves", "streamed_moves", "underruns", "min_lead_us", "sleep_s",
+             "wait_s", "last_move"]))
+        m.do_command(GCode.parse_line("G1X1"))
+        self.assertEqual(hal.get_metrics()["moves"], moves + 1)
+        answer = m.do_command(GCode.parse_line("M408"))
+        self.assertIn("moves:{}".format(moves + 1), answer)
+        self.assertIn("underruns:0", answer)
+
 if __name__ == '__main__':
     unittest.main()
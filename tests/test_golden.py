@@ -0,0 +1,115 @@
+import unittest
+import os
+import sys
+import glob
+import tempfile
+
+from cnc.gcode import *
+from cnc.gmachine import *
+from cnc.pulse_trace import *
+from cnc.config import *
+from cnc import hal
+from cnc import hal_virtual
+
+""" Compare pulses of reference gcode workloads with stored golden traces,
+    so any changes of pulses timings are noticed. Time tolerance in ticks can
+    be set with PYCNC_GOLDEN_TOLERANCE_TICKS environment variable. If changes
+    are expected, update golden traces with:
+    python -m tests.test_golden --update
+"""
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "golden")
+TOLERANCE_TICKS = int(os.environ.get("PYCNC_GOLDEN_TOLERANCE_TICKS", 1))
+
+
+def record(gcode_path, trace_path):
+    """ Run gcode file with virtual hal and record its pulses.
+    :param gcode_path: gcode file.
+    :param trace_path: trace file to write.
+    """
+    hal_virtual.set_validation('none')
+    hal_virtual.set_trace(open(trace_path, "wb"))
+    try:
+        m = GMachine()
+        with open(gcode_path, "r") as f:
+            for line in f:
+                m.do_command(GCode.parse_line(line))
+        m.release()
+    finally:
+        hal_virtual.set_trace(None)
+        hal_virtual.set_validation(VIRTUAL_HAL_VALIDATION)
+
+
+def workloads():
+    """ Get golden workloads.
+    :return: list of (gcode file, golden trace file).
+    """
+    return [(p, os.path.splitext(p)[0] + ".trace") for p in
+            sorted(glob.glob(os.path.join(GOLDEN_DIR, "*.gcode")))]
+
+
+def update():
+    for gcode_path, trace_path in workloads():
+        record(gcode_path, trace_path)
+        with open(trace_path, "rb") as f:
+            moves = list(read_trace(f))
+        print("{}: {} moves, {} pulses".format(
+            os.path.basename(trace_path), len(moves),
+            compare(moves, moves)["pulses"]))
+
+
+@unittest.skipUnless(hal.move == hal_virtual.move, "virtual hal only")
+class TestGolden(unittest.TestCase):
+    def setUp(self):
+        fd, self.trace = tempfile.mkstemp(suffix=".trace")
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.exists(self.trace):
+            os.remove(self.trace)
+
+    def test_workloads(self):
+        self.assertGreater(len(workloads()), 0)
+        for gcode_path, trace_path in workloads():
+            record(gcode_path, self.trace)
+            with open(trace_path, "rb") as e, open(self.trace, "rb") as a:
+                r = compare(read_trace(e), read_trace(a), TOLERANCE_TICKS)
+            self.assertGreater(r["pulses"], 0)
+            self.assertEqual(r["errors"], [], "{}, the worst deviations "
+                             "(ticks, move, axis, pulse): {}".format(
+                                 os.path.basename(gcode_path), r["worst"]))
+
+    def test_compare(self):
+        gcode_path, trace_path = workloads()[0]
+        with open(trace_path, "rb") as f:
+            moves = list(read_trace(f))
+        r = compare(moves, moves)
+        self.assertEqual(r["errors"], [])
+        self.assertEqual(r["max_deviation"], 0)
+        # shift one pulse
+        m = moves[1]
+        with open(trace_path, "rb") as f:
+            changed = list(read_trace(f))
+        i = [n for n, item in enumerate(m.items) if not item[0]][5]
+        item = list(m.items[i])
+        item[1:] = [None if t is None else t + 3.0 / TICKS_PER_SECOND
+                    for t in item[1:]]
+        changed[1].items[i] = tuple(item)
+        r = compare(moves, changed, 3)
+        self.assertEqual(r["errors"], [])
+        self.assertEqual(r["max_deviation"], 3)
+        self.assertEqual(r["worst"][0][1], 1)
+        r = compare(moves, changed, 2)
+        self.assertNotEqual(r["errors"], [])
+        # lose one pulse
+        del changed[1].items[i]
+        self.assertNotEqual(compare(moves, changed, 3)["errors"], [])
+        self.assertNotEqual(compare(moves, changed[1:])["errors"], [])
+
+
+if __name__ == '__main__':
+    if "--update" in sys.argv:
+        update()
+    else:
+        unittest.main()
@@ -0,0 +1,174 @@
+import os
+import json
+import tempfile
+import threading
+import time
+import unittest
+
+# other tests use virtual hal, import it before hardware emulation is enabled
+import cnc.hal
+os.environ["PYCNC_EMULATE_RPI"] = "1"
+from cnc.hal_raspberry import hal
+from cnc.hal_raspberry.rpgpio_emulator import emulator
+del os.environ["PYCNC_EMULATE_RPI"]
+from cnc.pulses import *
+from cnc.config import *
+from cnc.coordinates import *
+
+STEP_PINS = (STEP_PIN_MASK_X, STEP_PIN_MASK_Y, STEP_PIN_MASK_Z)
+
+
+class TestHalRaspberry(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        emulator.record = True
+        hal.init()
+
+    @classmethod
+    def tearDownClass(cls):
+        hal.deinit()
+        emulator.record = False
+
+    def setUp(self):
+        hal.join()
+        emulator.clear_timeline()
+
+    def tearDown(self):
+        hal.join()
+
+    def __pulses(self):
+        """ Check step pins timings in emulator timeline.
+        :return: dict with number of pulses of each step pin and time of the
+                 first and the last write.
+        """
+        length = STEPPER_PULSE_LENGTH_US * 1000
+        level = 0
+        changed = dict((m, None) for m in STEP_PINS)
+        pulses = dict((m, 0) for m in STEP_PINS)
+        first = last = None
+        for t, pins_set, pins_clear in emulator.timeline():
+            for m in STEP_PINS:
+                if pins_set & m and not level & m:
+                    if changed[m] is not None:
+                        self.assertGreaterEqual(t - changed[m], length)
+                    pulses[m] += 1
+                elif pins_clear & m and level & m:
+                    self.assertGreaterEqual(t - changed[m], length)
+                else:
+                    continue
+                changed[m] = t
+                if first is None:
+                    first = t
+                last = t
+            level = (level | pins_set) & ~pins_clear
+        self.assertEqual(level & (STEP_PIN_MASK_X | STEP_PIN_MASK_Y
+                                  | STEP_PIN_MASK_Z), 0)
+        return pulses, first, last
+
+    def test_move(self):
+        m = Coordinates(-10, 5, 2, 0)
+        g = PulseGeneratorLinear(m, 3000)
+        hal.move(g)
+        hal.join()
+        pulses, first, last = self.__pulses()
+        self.assertEqual(pulses[STEP_PIN_MASK_X],
+                         -m.x * STEPPER_PULSES_PER_MM_X)
+        self.assertEqual(pulses[STEP_PIN_MASK_Y], m.y * STEPPER_PULSES_PER_MM_Y)
+        self.assertEqual(pulses[STEP_PIN_MASK_Z], m.z * STEPPER_PULSES_PER_MM_Z)
+        self.assertLessEqual((last - first) / 1000000000.0,
+                             g.total_time_s())
+        self.assertGreater((last - first) / 1000000000.0,
+                           g.total_time_s() * 0.95)
+        levels = emulator.levels()
+        self.assertNotEqual(levels & DIR_PIN_MASK_X, 0)
+        self.assertEqual(levels & DIR_PIN_MASK_Y, 0)
+        self.assertEqual(levels & DIR_PIN_MASK_Z, 0)
+        self.assertEqual(hal.get_metrics()["last_move"]["underruns"], 0)
+
+    def test_move_records(self):
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        hal._records_file = open(path, "w")
+        try:
+            moves = (Coordinates(5, -3, 0, 0), Coordinates(0, 0, 1, 0))
+            for n, m in enumerate(moves):
+                g = PulseGeneratorLinear(m, 3000)
+                g.line = n + 10
+                hal.move(g)
+            hal.join()
+            records = hal.get_move_records()[-2:]
+        finally:
+            hal._records_file.close()
+            hal._records_file = None
+        for n, m in enumerate(moves):
+            r = records[n]
+            self.assertEqual(r["line"], n + 10)
+            self.assertEqual(r["generator"], "PulseGeneratorLinear")
+            self.assertEqual(r["pulses"],
+                             abs(m.x) * STEPPER_PULSES_PER_MM_X
+                             + abs(m.y) * STEPPER_PULSES_PER_MM_Y
+                             + abs(m.z) * STEPPER_PULSES_PER_MM_Z)
+            self.assertEqual(r["cma_bytes"], r["control_blocks"]
+                             * hal.dma.control_block_size())
+            self.assertGreater(r["generation_s"], 0.0)
+            self.assertAlmostEqual(r["dma_s"], r["estimated_s"], delta=0.1)
+        with open(path, "r") as f:
+            lines = [json.loads(l) for l in f]
+        os.remove(path)
+        self.assertEqual(lines, records)
+
+    def test_warmup(self):
+        g = PulseGeneratorLinear(Coordinates(10, 5, 0, 0), 3000)
+        events = list(g.gpio_events(hal.TICKS_PER_SECOND,
+                                    hal.PULSE_LENGTH_TICKS))
+        self.assertEqual(hal.warmup(iter(events)), len(events))
+        self.assertEqual(hal.dma.current_address(), 0)
+        self.assertFalse(hal.dma.is_active())
+        time.sleep(0.05)
+        pulses, _, _ = self.__pulses()
+        self.assertEqual(sum(pulses.values()), 0)
+
+    def test_calibrate(self):
+        # end stops are released, then triggered after a while
+        pins = (ENDSTOP_PIN_X, ENDSTOP_PIN_Y, ENDSTOP_PIN_Z)
+        for pin in pins:
+            emulator.set_input(pin, 0 if ENDSTOP_INVERTED_X else 1)
+
+        def trigger():
+            for p in pins:
+                emulator.set_input(p, 1 if ENDSTOP_INVERTED_X else 0)
+        timer = threading.Timer(0.2, trigger)
+        timer.start()
+        try:
+            self.assertTrue(hal.calibrate(True, True, False))
+        finally:
+            timer.cancel()
+            for pin in pins:
+                emulator.set_input(pin, None)
+        pulses, _, _ = self.__pulses()
+        self.assertGreater(pulses[STEP_PIN_MASK_X], 0)
+        self.assertGreater(pulses[STEP_PIN_MASK_Y], 0)
+        self.assertEqual(pulses[STEP_PIN_MASK_Z], 0)
+
+    def test_pwm(self):
+        pin = EXTRUDER_CONFIG[0]['pin']
+        hal.pwm.add_pin(pin, 25)
+        self.assertTrue(hal.pwm.is_active())
+        time.sleep(0.1)
+        hal.pwm.remove_pin(pin)
+        self.assertFalse(hal.pwm.is_active())
+        mask = 1 << pin
+        writes = [(t, s & mask) for t, s, c in emulator.timeline()
+                  if (s | c) & mask]
+        self.assertGreater(len(writes), 10)
+        # duty cycle
+        high = 0
+        for (t0, s), (t1, _) in zip(writes[:-1], writes[1:]):
+            if s:
+                high += t1 - t0
+        self.assertAlmostEqual(high / float(writes[-1][0] - writes[0][0]),
+                               0.25, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+from cnc.pulse_cache import *
+from cnc.pulses import *
+from cnc.config import *
+from cnc.coordinates import *
+
+
+class TestPulseCache(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_get_put(self):
+        c = PulseCache(16)
+        self.assertIsNone(c.get("a"))
+        self.assertTrue(c.put("a", [1, 2]))
+        self.assertEqual(c.get("a"), [1, 2])
+        self.assertIsNone(c.get(None))
+        self.assertFalse(c.put(None, [1]))
+        s = c.statistics()
+        self.assertEqual(s["hits"], 1)
+        self.assertEqual(s["misses"], 1)
+        self.assertEqual(s["entries"], 1)
+        self.assertEqual(s["size"], 2)
+        # data is stored with sequence and doesn't affect statistics
+        self.assertIsNone(c.data("a"))
+        c.put("b", [3], 5)
+        self.assertEqual(c.data("b"), 5)
+        self.assertIsNone(c.data("c"))
+        self.assertEqual(c.statistics()["hits"], 1)
+        self.assertEqual(c.statistics()["size"], 3)
+
+    def test_lru_eviction(self):
+        c = PulseCache(6, 3)
+        c.put("a", [1, 2, 3])
+        c.put("b", [4, 5])
+        # 'a' becomes the most recently used
+        self.assertIsNotNone(c.get("a"))
+        c.put("c", [6, 7])
+        self.assertIsNone(c.get("b"))
+        self.assertIsNotNone(c.get("a"))
+        self.assertIsNotNone(c.get("c"))
+        self.assertEqual(c.statistics()["evictions"], 1)
+        self.assertEqual(c.statistics()["size"], 5)
+        # too long sequence is never stored
+        self.assertFalse(c.put("d", [1, 2, 3, 4]))
+        self.assertIsNone(c.get("d"))
+        c.clear()
+        self.assertEqual(c.statistics()["size"], 0)
+        self.assertIsNone(c.get("a"))
+
+    def test_generator_keys(self):
+        v = min(MAX_VELOCITY_MM_PER_MIN_X, MAX_VELOCITY_MM_PER_MIN_Y,
+                MAX_VELOCITY_MM_PER_MIN_Z)
+        k1 = PulseGeneratorLinear(Coordinates(10, 5, 0, 0), v).cache_key()
+        k2 = PulseGeneratorLinear(Coordinates(10, 5, 0, 0), v).cache_key()
+        k3 = PulseGeneratorLinear(Coordinates(10, 5, 0, 0), v / 2).cache_key()
+        k4 = PulseGeneratorLinear(Coordinates(-10, 5, 0, 0), v).cache_key()
+        self.assertEqual(k1, k2)
+        self.assertEqual(hash(k1), hash(k2))
+        self.assertNotEqual(k1, k3)
+        self.assertNotEqual(k1, k4)
+        k1 = PulseGeneratorCircular(Coordinates(0, 0, 0, 0),
+                                    Coordinates(1, 0, 0, 0),
+                                    PLANE_XY, CW, v).cache_key()
+        k2 = PulseGeneratorCircular(Coordinates(0, 0, 0, 0),
+                                    Coordinates(1, 0, 0, 0),
+                                    PLANE_XY, CW, v).cache_key()
+        k3 = PulseGeneratorCircular(Coordinates(0, 0, 0, 0),
+                                    Coordinates(1, 0, 0, 0),
+                                    PLANE_XY, CCW, v).cache_key()
+        self.assertEqual(k1, k2)
+        self.assertNotEqual(k1, k3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import io
+
+from cnc.pulses import *
+from cnc.pulse_trace import *
+from cnc.coordinates import *
+from cnc import hal_virtual
+
+
+class TestPulseTrace(unittest.TestCase):
+    def setUp(self):
+        self.v = min(MAX_VELOCITY_MM_PER_MIN_X,
+                     MAX_VELOCITY_MM_PER_MIN_Y,
+                     MAX_VELOCITY_MM_PER_MIN_Z)
+        self.generators = [
+            PulseGeneratorLinear(Coordinates(2, -3, 0.5, 1), self.v),
+            PulseGeneratorCircular(Coordinates(0, 4, 0, -1),
+                                   Coordinates(-2, 2, 0, 0),
+                                   PLANE_XY, CW, self.v),
+            PulseGeneratorRapid(Coordinates(-5, 1, 0, 0))]
+
+    def tearDown(self):
+        pass
+
+    def __record(self):
+        f = io.BytesIO()
+        w = TraceWriter(f)
+        items = [list(w.record(g)) for g in self.generators]
+        self.assertEqual(w.statistics()["moves"], len(self.generators))
+        f.seek(0)
+        return f, items
+
+    def test_read(self):
+        f, items = self.__record()
+        moves = list(read_trace(f))
+        self.assertEqual(len(moves), len(self.generators))
+        tick = 1.0 / TICKS_PER_SECOND
+        for g, m, original in zip(self.generators, moves, items):
+            self.assertEqual(m.name, g.__class__.__name__)
+            self.assertEqual(m.delta(), g.delta())
+            self.assertEqual(m.total_time_s(), g.total_time_s())
+            self.assertEqual(len(m.items), len(original))
+            for a, b in zip(m.items, original):
+                self.assertEqual(a[0], b[0])
+                for ta, tb in zip(a[1:], b[1:]):
+                    if a[0] or tb is None:
+                        self.assertEqual(ta, tb)
+                    else:
+                        # times are rounded to the nearest tick
+                        self.assertAlmostEqual(ta, tb, delta=tick / 2 + 1e-12)
+        # the most of pulses should take two or three bytes
+        self.assertLess(len(f.getvalue()),
+                        sum(len(i) for i in items) * 3)
+
+    def test_read_chunks(self):
+        # records are split between chunks
+        from cnc import pulse_trace
+        f, items = self.__record()
+        moves = list(read_trace(f))
+        size = pulse_trace.READ_CHUNK_SIZE
+        pulse_trace.READ_CHUNK_SIZE = 3
+        try:
+            f.seek(0)
+            chunked = list(read_trace(f))
+        finally:
+            pulse_trace.READ_CHUNK_SIZE = size
+        self.assertEqual([m.items for m in chunked], [m.items for m in moves])
+        self.assertEqual(compare(moves, chunked)["errors"], [])
+        r = compare(moves, chunked[:-1])
+        self.assertEqual(r["errors"][0], "expected {} moves, got {}".format(
+            len(moves), len(moves) - 1))
+
+    def test_different_times(self):
+        class Generator(object):
+            def delta(self):
+                return Coordinates(0, 0, 0, 0)
+
+            def total_time_s(self):
+                return 1.0
+
+            def __iter__(self):
+                return iter([(True, 1, -1, 1, 1),
+                             (False, 0.5, 0.25, None, 0.5),
+                             (False, 0.75, None, 0.6, None)])
+        f = io.BytesIO()
+        items = list(TraceWriter(f).record(Generator()))
+        f.seek(0)
+        m = next(read_trace(f))
+        self.assertEqual(m.name, "Generator")
+        self.assertEqual(m.items, items)
+
+    def test_replay(self):
+        f, items = self.__record()
+        pulses = hal_virtual.get_metrics()["pulses"]
+        hal_virtual.replay(f)
+        self.assertEqual(hal_virtual.get_metrics()["pulses"] - pulses,
+                         sum(sum(p is not None for p in i[1:])
+                             for m in items for i in m if not i[0]))
+
+    def test_vcd(self):
+        f, items = self.__record()
+        out = io.StringIO()
+        export_vcd(read_trace(f), out)
+        lines = out.getvalue().splitlines()
+        self.assertIn("$enddefinitions $end", lines)
+        x = sum(1 for m in items for i in m if not i[0] and i[1] is not None)
+        self.assertEqual(lines.count("1s0"), x)
+        self.assertEqual(lines.count("0s0"), x + 1)
+        times = [int(l[1:]) for l in lines if l.startswith("#")]
+        self.assertEqual(times, sorted(times))
+
+
+if __name__ == '__main__':
+    unittest.main()
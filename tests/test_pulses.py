@@ -173,6 +173,26 @@ class TestPulses(unittest.TestCase):
         hal_virtual.move(PulseGeneratorCircular(delta, radius, PLANE_XY, CW,
                                                 self.v))
 
+    def test_hal_virtual_validation(self):
+        # Each validation level should count the same pulses.
+        self.assertRaises(ValueError, hal_virtual.set_validation, "wrong")
+        counts = []
+        for level in hal_virtual.VALIDATION_LEVELS:
+            hal_virtual.set_validation(level)
+            pulses = hal_virtual.get_metrics()["pulses"]
+            for i in range(3):
+                hal_virtual.move(PulseGeneratorCircular(
+                    Coordinates(0, 20, 0, 5), Coordinates(-10, 10, 0, 0),
+                    PLANE_XY, CW, self.v))
+                hal_virtual.move(PulseGeneratorLinear(
+                    Coordinates(2, -3, 1, 0), self.v))
+                hal_virtual.move(PulseGeneratorRapid(
+                    Coordinates(-1.5, 2, 0.5, 0)))
+            counts.append(hal_virtual.get_metrics()["pulses"] - pulses)
+        hal_virtual.set_validation(VIRTUAL_HAL_VALIDATION)
+        self.assertGreater(counts[0], 0)
+        self.assertEqual(counts.count(counts[0]), len(counts))
+
     def test_twice_faster_linear(self):
         # Checks if one axis moves exactly twice faster, pulses are correct.
         m = Coordinates(2, 4, 0, 0)
@@ -265,6 +285,96 @@ class TestPulses(unittest.TestCase):
         self.assertGreater(at, lt)
         self.assertGreater(bt, lt)
 
+    def test_centripetal_velocity(self):
+        # Check if velocity on small radius arcs is limited by centripetal
+        # acceleration, but not on large radius arcs.
+        velocity = 3000
+        radius = 0.5
+        g = PulseGeneratorCircular(Coordinates(0, 0, 0, 0),
+                                   Coordinates(radius, 0, 0, 0),
+                                   PLANE_XY, CW, velocity)
+        limit = math.sqrt(STEPPER_MAX_ACCELERATION_MM_PER_S2 * radius) * 60
+        self.assertAlmostEqual(g.max_velocity().x, limit, 3)
+        self.assertAlmostEqual(g.max_velocity().y, limit, 3)
+        self.assertGreater(g.total_time_s(),
+                           2 * math.pi * radius / velocity * 60)
+        g = PulseGeneratorCircular(Coordinates(0, 0, 0, 0),
+                                   Coordinates(50, 0, 0, 0),
+                                   PLANE_XY, CW, velocity)
+        self.assertAlmostEqual(g.max_velocity().x, velocity, 3)
+        # radius is less than a single pulse
+        g = PulseGeneratorCircular(Coordinates(0.002, 0, 0, 0),
+                                   Coordinates(0.001, 0, 0, 0),
+                                   PLANE_XY, CW, 600)
+        self.assertGreaterEqual(g.total_time_s(), 0.0)
+
+    def test_bezier(self):
+        # Check if curve pulses are correct for different shapes, including
+        # closed curve and curve with loop.
+        curves = ((Coordinates(10, 0, 1, 2), Coordinates(3, 5, 0, 0),
+                   Coordinates(7, 5, 0, 0)),
+                  (Coordinates(0, 0, 0, 0), Coordinates(10, 10, 0, 0),
+                   Coordinates(-10, 10, 0, 0)),
+                  (Coordinates(20, -3, 0, 0), Coordinates(0, 30, 0, 0),
+                   Coordinates(20, -30, 0, 0)),
+                  (Coordinates(0.01, 0.02, 0, 0), Coordinates(0, 0, 0, 0),
+                   Coordinates(0.01, 0.02, 0, 0)))
+        for delta, c1, c2 in curves:
+            g = PulseGeneratorBezier(delta, c1, c2, self.v)
+            hal_virtual.move(g)
+        # bounds include the whole curve
+        g = PulseGeneratorBezier(Coordinates(0, 0, 0, 0),
+                                 Coordinates(10, 10, 0, 0),
+                                 Coordinates(-10, 10, 0, 0), self.v)
+        low, high = g.bounds()
+        self.assertAlmostEqual(high.y, 7.5, 2)
+        self.assertAlmostEqual(low.x, -high.x, 2)
+        # curve with straight control points is straight line
+        delta = Coordinates(30, 40, 0, 0)
+        g = PulseGeneratorBezier(delta, delta / 3, delta * 2 / 3, self.v)
+        self.assertAlmostEqual(g.total_time_s(),
+                               PulseGeneratorLinear(delta,
+                                                    self.v).total_time_s(),
+                               3)
+
+    def test_rapid(self):
+        # Check if each axis moves with own profile and stops independently.
+        for delta in (Coordinates(50, -10, 0.01, 0), Coordinates(0, 0, -1, 0),
+                      Coordinates(1.0 / STEPPER_PULSES_PER_MM_X, 100, 30, 0)):
+            hal_virtual.move(PulseGeneratorRapid(delta))
+        delta = Coordinates(100, 10, 0, 0)
+        g = PulseGeneratorRapid(delta)
+        last_x = last_y = 0.0
+        for direction, px, py, pz, pe in g:
+            if direction:
+                continue
+            if px is not None:
+                last_x = px
+            if py is not None:
+                last_y = py
+        self.assertLess(last_y, last_x / 2)
+        self.assertAlmostEqual(last_x, g.total_time_s(), 2)
+        self.assertAlmostEqual(g.max_velocity().x, MAX_VELOCITY_MM_PER_MIN_X)
+        self.assertLess(g.total_time_s(),
+                        PulseGeneratorLinear(delta, self.v).total_time_s())
+
+    def test_ticks(self):
+        # Check if pulses times can be returned as integer ticks.
+        m = Coordinates(2, 3, 1, 0)
+        seconds = list(PulseGeneratorLinear(m, self.v))
+        ticks = list(PulseGeneratorLinear(m, self.v).ticks(4000000))
+        self.assertEqual(len(seconds), len(ticks))
+        for s, t in zip(seconds, ticks):
+            if s[0]:
+                self.assertEqual(s, t)
+                continue
+            for ts, tt in zip(s[1:], t[1:]):
+                if ts is None:
+                    self.assertIsNone(tt)
+                else:
+                    self.assertIsInstance(tt, int)
+                    self.assertEqual(tt, int(round(ts * 4000000)))
+
     def test_directions(self):
         # Check if directions are set up correctly.
         m = Coordinates(1, -2, 3, -4)
@@ -310,5 +420,78 @@ class TestPulses(unittest.TestCase):
         self.assertEqual(dir_changed, 4)
 
 
+    def __check_gpio_events(self, g, direction_pins=None):
+        """ Simulate pins levels with GPIO writes and check timings.
+        :return: dict with number of pulses of each step pin, number of
+                 writes of direction pins and total time.
+        """
+        length = 8
+        step = (STEP_PIN_MASK_X, STEP_PIN_MASK_Y, STEP_PIN_MASK_Z)
+        dirs = (DIR_PIN_MASK_X, DIR_PIN_MASK_Y, DIR_PIN_MASK_Z)
+        t = 0
+        level = 0
+        changed = dict((m, -length) for m in step + dirs)
+        pulses = dict((m, 0) for m in step)
+        dir_writes = 0
+        for delay, pins_set, pins_clear in g.gpio_events(4000000, length,
+                                                         direction_pins):
+            self.assertIsInstance(delay, int)
+            self.assertGreaterEqual(delay, 0)
+            self.assertEqual(pins_set & pins_clear, 0)
+            t += delay
+            for m, d in zip(step, dirs):
+                if pins_set & m:
+                    self.assertFalse(level & m)
+                    # low and direction setup time
+                    self.assertGreaterEqual(t - changed[m], length)
+                    self.assertGreaterEqual(t - changed[d], length)
+                    pulses[m] += 1
+                    changed[m] = t
+                elif pins_clear & m and level & m:
+                    # high time
+                    self.assertGreaterEqual(t - changed[m], length)
+                    changed[m] = t
+            for d in dirs:
+                if (pins_set | pins_clear) & d:
+                    dir_writes += 1
+                    changed[d] = t
+            level = (level | pins_set) & ~pins_clear
+        self.assertEqual(level & (STEP_PIN_MASK_X | STEP_PIN_MASK_Y
+                                  | STEP_PIN_MASK_Z), 0)
+        return pulses, dir_writes, t
+
+    def test_gpio_events(self):
+        # Check if pulses are converted to GPIO writes correctly.
+        m = Coordinates(10, 7, -3, 0)
+        g = PulseGeneratorLinear(m, self.v)
+        pulses, dir_writes, t = self.__check_gpio_events(g)
+        self.assertEqual(pulses[STEP_PIN_MASK_X], m.x * STEPPER_PULSES_PER_MM_X)
+        self.assertEqual(pulses[STEP_PIN_MASK_Y], m.y * STEPPER_PULSES_PER_MM_Y)
+        self.assertEqual(pulses[STEP_PIN_MASK_Z],
+                         -m.z * STEPPER_PULSES_PER_MM_Z)
+        self.assertEqual(dir_writes, 3)
+        self.assertLessEqual(t / 4000000.0, g.total_time_s())
+        self.assertGreater(t / 4000000.0, g.total_time_s() * 0.99)
+        state = g.direction_pins()
+        self.assertIsNotNone(state)
+        # the same directions are not written again
+        g = PulseGeneratorLinear(m, self.v)
+        pulses, dir_writes, _ = self.__check_gpio_events(g, state)
+        self.assertEqual(dir_writes, 0)
+        self.assertEqual(pulses[STEP_PIN_MASK_X], m.x * STEPPER_PULSES_PER_MM_X)
+        self.assertEqual(g.direction_pins(), state)
+        # only changed direction is written
+        g = PulseGeneratorLinear(Coordinates(10, 7, 3, 0), self.v)
+        _, dir_writes, _ = self.__check_gpio_events(g, state)
+        self.assertEqual(dir_writes, 1)
+        self.assertNotEqual(g.direction_pins(), state)
+        # circle changes directions during move
+        g = PulseGeneratorCircular(Coordinates(0, 20, 0, 0),
+                                   Coordinates(-10, 10, 0, 0), PLANE_XY, CW,
+                                   self.v)
+        pulses, dir_writes, _ = self.__check_gpio_events(g)
+        self.assertGreater(pulses[STEP_PIN_MASK_X], 0)
+        self.assertGreater(dir_writes, 2)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from cnc.self_benchmark import *
+from cnc.generation_rate import GenerationRate
+from cnc.pulses import *
+from cnc.coordinates import *
+
+
+class TestSelfBenchmark(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        PulseGenerator.MAX_PULSES_PER_SECOND = None
+
+    def test_clamp(self):
+        delta = Coordinates(50, 0, 0, 0)
+        g = PulseGeneratorLinear(delta, 3000)
+        t = g.total_time_s()
+        PulseGenerator.MAX_PULSES_PER_SECOND = \
+            STEPPER_PULSES_PER_MM_X * 3000 / SECONDS_IN_MINUTE / 2
+        g = PulseGeneratorLinear(delta, 3000)
+        self.assertAlmostEqual(g.max_velocity().x, 1500.0)
+        self.assertGreater(g.total_time_s(), t)
+        g = PulseGeneratorRapid(Coordinates(50, 50, 0, 0))
+        rate = (g.max_velocity().x * STEPPER_PULSES_PER_MM_X
+                + g.max_velocity().y * STEPPER_PULSES_PER_MM_Y)
+        self.assertLessEqual(rate / SECONDS_IN_MINUTE,
+                             PulseGenerator.MAX_PULSES_PER_SECOND + 1e-6)
+        # fits the limit
+        g = PulseGeneratorLinear(delta, 600)
+        self.assertAlmostEqual(g.max_velocity().x, 600.0)
+
+    def test_measure(self):
+        class Hal(object):
+            events = 0
+
+            @staticmethod
+            def warmup(events):
+                Hal.events += len(events)
+                return len(events)
+        g = PulseGeneratorLinear(Coordinates(10, -5, 1, 0), 3000)
+        pulses, t = measure(g, Hal)
+        self.assertEqual(pulses, 10 * STEPPER_PULSES_PER_MM_X
+                         + 5 * STEPPER_PULSES_PER_MM_Y
+                         + STEPPER_PULSES_PER_MM_Z)
+        self.assertEqual(Hal.events, len(list(g.gpio_events(
+            TICKS_PER_SECOND, PULSE_LENGTH_TICKS))))
+        self.assertEqual(measure(g)[0], pulses)
+
+    def test_run(self):
+        class Hal(object):
+            generation_rate = GenerationRate()
+        r = run(Hal, 0.05, 0.5, 'clamp')
+        self.assertGreater(r["max_pulses_per_second"], 0)
+        self.assertEqual(PulseGenerator.MAX_PULSES_PER_SECOND,
+                         r["max_pulses_per_second"])
+        self.assertEqual(r["max_pulses_per_second"],
+                         min(r["pulses_per_second"].values()) * 0.5)
+        for name in r["pulses_per_second"]:
+            self.assertIsNotNone(Hal.generation_rate.rate(name))
+        r = run(None, 0.05, 0.5, 'buffer')
+        self.assertIsNone(PulseGenerator.MAX_PULSES_PER_SECOND)
+        self.assertRaises(ValueError, run, None, 0.05, 0.5, 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+import unittest
+
+import math
+import random
+
+from cnc.transforms.arcs import *
+from cnc.transforms.coalesce import *
+from cnc.transforms.simplify import *
+from cnc.transforms.travel import *
+from cnc import workloads
+
+
+class TestTransforms(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_coalesce_absolute(self):
+        lines = ["G1 X0 Y0 Z0 F1000", "G1 X1 Y1", "G1 X2 Y2", "(comment)",
+                 "G1 X3 Y3 Z0", "G1 X4 Y3", "G1 X5 Y3 F500", "G0 X6 Y3",
+                 "M114", "G0 X7 Y3", "G0 X8 Y3"]
+        c = CollinearCoalescer(lines)
+        self.assertEqual(list(c), ["G1 X0 Y0 Z0 F1000", "G1 X3 Y3 Z0",
+                                   "(comment)", "G1 X4 Y3", "G1 X5 Y3 F500",
+                                   "G0 X6 Y3", "M114", "G0 X8 Y3"])
+        s = c.statistics()
+        self.assertEqual(s["moves_in"], 9)
+        self.assertEqual(s["moves_out"], 6)
+        self.assertAlmostEqual(s["merge_ratio"], 1.5)
+
+    def test_coalesce_source_lines(self):
+        lines = ["G1 X0 Y0 F1000", "G1 X1 Y1", "G1 X2 Y2", "(comment)",
+                 "G1 X2 Y3"]
+        lines = [SourceLine(l, n) for n, l in enumerate(lines, 1)]
+        out = list(CollinearCoalescer(lines))
+        self.assertEqual(out, ["G1 X0 Y0 F1000", "G1 X2 Y2", "(comment)",
+                               "G1 X2 Y3"])
+        self.assertEqual([l.number for l in out], [1, 2, 4, 5])
+
+    def test_coalesce_relative(self):
+        lines = ["G91", "G1 X1 E0.1", "X1 E0.1", "G1 X-1", "G1 X-2",
+                 "G20", "G1 Y0.5", "G1 Y0.5"]
+        self.assertEqual(list(CollinearCoalescer(lines)),
+                         ["G91", "G1 X2 E0.2", "G1 X-3", "G20", "G1 Y1"])
+
+    def test_coalesce_tolerance(self):
+        tolerance = 1.0 / STEPPER_PULSES_PER_MM_Y
+        lines = ["G1 X0 Y0", "G1 X1 Y" + str(tolerance / 2), "G1 X2 Y0"]
+        self.assertEqual(len(list(CollinearCoalescer(lines))), 2)
+        lines = ["G1 X0 Y0", "G1 X1 Y" + str(tolerance * 2), "G1 X2 Y0"]
+        self.assertEqual(len(list(CollinearCoalescer(lines))), 3)
+        # head should never go back
+        lines = ["G1 X0 Y0", "G1 X2", "G1 X1", "G1 X3"]
+        self.assertEqual(len(list(CollinearCoalescer(lines))), 4)
+        # bad lines are passed as is and finish merging
+        lines = ["G1 X0 Y0", "G1 X1", "G1 X2", "bad line", "G1 X3"]
+        self.assertEqual(list(CollinearCoalescer(lines)),
+                         ["G1 X0 Y0", "G1 X2", "bad line", "G1 X3"])
+        c = CollinearCoalescer(["G1 X0", "G1 X1", "G1 X2", "G1 X3"])
+        c.MAX_MOVES = 2
+        self.assertEqual(list(c), ["G1 X0", "G1 X2", "G1 X3"])
+
+    def test_arc_welder(self):
+        lines = ["G1 X70 Y50 E0 F1000"]
+        for i in range(1, 19):
+            a = math.pi / 2.0 * i / 18
+            lines.append("G1 X%.3f Y%.3f E%.3f" % (50 + 20 * math.cos(a),
+                                                    50 + 20 * math.sin(a),
+                                                    i * 0.1))
+        lines.append("G1 X60 Y70")
+        w = ArcWelder(lines)
+        self.assertEqual(list(w), ["G1 X70 Y50 E0 F1000",
+                                   "G3 X50.000 Y70.000 E1.800 I-20 J0",
+                                   "G1 X60 Y70"])
+        self.assertEqual(w.statistics()["arcs"], 1)
+        self.assertEqual(w.statistics()["moves_out"], 3)
+        # relative mode, ZX plane and clockwise
+        lines = ["G1 X10 Y10 Z10", "G91", "G18"]
+        for i in range(1, 10):
+            a = math.pi / 2.0 * i / 9
+            b = math.pi / 2.0 * (i - 1) / 9
+            lines.append("G1 Z%.4f X%.4f" % (5 * math.sin(a) - 5 * math.sin(b),
+                                             5 * math.cos(a) - 5 * math.cos(b)))
+        # each relative move is rounded to pulses like GMachine does
+        self.assertEqual(list(ArcWelder(lines))[3:],
+                         ["G2 X-5.01 Z5.01 K-0.03 I-5.04"])
+        # polygon is not an arc
+        lines = ["G1 X0 Y0", "G1 X10 Y0", "G1 X10 Y10", "G1 X0 Y10",
+                 "G1 X0 Y0"]
+        self.assertEqual(list(ArcWelder(lines)), lines)
+        # points are inside table, but arc is not
+        for x, count in ((4.99, 12), (5.01, 2)):
+            lines = []
+            for i in range(0, 12):
+                a = math.radians(97.5 + 15 * i)
+                lines.append("G1 X%.3f Y%.3f" % (x + 5 * math.cos(a),
+                                                 10 + 5 * math.sin(a)))
+            self.assertEqual(len(list(ArcWelder(lines))), count)
+
+    def test_simplify(self):
+        lines = ["G1 X10 Y10 F1000", "(polyline)"]
+        for i in range(1, 11):
+            lines.append("G1 X%.3f Y%.3f" % (10 + i * 0.1,
+                                             10 + 0.002 * (i % 2)))
+        lines += ["G1 X12 Y11", "G0 X0 Y0", "G91", "G1 X0.004",
+                  "G1 Y0.001", "G1 X1 E0.1"]
+        s = PolylineSimplifier(lines)
+        self.assertEqual(list(s), ["G1 X10 Y10 F1000", "(polyline)",
+                                   "G1 X11.000 Y10.000", "G1 X12 Y11",
+                                   "G0 X0 Y0", "G91", "G1 X1 Y0 E0.1"])
+        stat = s.statistics()
+        self.assertEqual(stat["points_in"], 14)
+        self.assertEqual(stat["points_removed"], 11)
+        self.assertAlmostEqual(stat["max_deviation_mm"], 0.002)
+        # extrusion is checked too
+        lines = ["G1 X0 Y0 E0", "G1 X1 E0.5", "G1 X2 E0.6"]
+        self.assertEqual(list(PolylineSimplifier(lines)), lines)
+
+    def test_travel_order(self):
+        starts = [(10, 0), (0, 10), (2, 0), (1, 10)]
+        ends = [(11, 0), (0, 11), (3, 0), (5, 10)]
+        o = nearest_neighbour(starts, ends, [False] * 4, (0, 0))
+        self.assertEqual(o, [(2, False), (0, False), (3, False), (1, False)])
+        self.assertLess(travel_length(o, starts, ends, (0, 0)),
+                        travel_length([(i, False) for i in range(4)],
+                                      starts, ends, (0, 0)))
+        o = nearest_neighbour(starts, ends, [True] * 4, (0, 0))
+        self.assertEqual(o[2], (3, True))
+        # route is never worse after improvement
+        random.seed(0)
+        starts = [(random.uniform(0, 100), random.uniform(0, 100))
+                  for _ in range(300)]
+        ends = [(x + random.uniform(-5, 5), y + random.uniform(-5, 5))
+                for x, y in starts]
+        for reverse in (False, True):
+            o = nearest_neighbour(starts, ends, [reverse] * 300, (0, 0))
+            i = improve_order(o, starts, ends, [reverse] * 300, (0, 0),
+                              reverse)
+            self.assertEqual(sorted(n for n, _ in i), list(range(300)))
+            self.assertLessEqual(travel_length(i, starts, ends, (0, 0)),
+                                 travel_length(o, starts, ends, (0, 0)))
+
+    def test_travel_optimizer(self):
+        lines = ["G90", "G0 X0 Y0 Z5 E0 F600", "G0 X50 Y0", "G0 Z0",
+                 "G1 X51 Y0 E1", "G0 Z5", "G0 X1 Y0", "G0 Z0",
+                 "; second", "G1 X2 Y0 E3", "G0 Z5", "T1", "G0 X9 Y9",
+                 "G1 X8 Y8 F300", "G0 X1 Y1", "G1 X2 Y2", "G0 X0 Y0"]
+        o = TravelOptimizer(lines)
+        # E is rebased, original position is restored before tool change,
+        # strokes are never moved over it
+        self.assertEqual(list(o), [
+            "G90", "G0 X0 Y0 Z5 E0 F600", "G0 X1 Y0", "G0 Z0", "; second",
+            "G1 X2 Y0 E2", "G0 Z5", "G0 X50 Y0", "G0 Z0", "G1 X51 Y0 E3",
+            "G0 Z5", "G0 X2 Y0", "G0 Z0", "G0 Z5", "T1", "G0 X9 Y9",
+            "G1 X8 Y8 F300", "G0 X1 Y1", "G1 X2 Y2", "G0 X0 Y0"])
+        s = o.statistics()
+        self.assertEqual(s["strokes"], 4)
+        self.assertEqual(s["sections"], 2)
+        self.assertAlmostEqual(s["travel_before_mm"], 100 + 7 * math.sqrt(2))
+        self.assertAlmostEqual(s["travel_after_mm"], 98 + 7 * math.sqrt(2))
+        # backward drawing
+        lines = ["G0 X0 Y0 F100", "G1 X5 Y0", "G1 X5 Y5", "G0 X0 Y1",
+                 "G1 X0 Y4"]
+        self.assertEqual(list(TravelOptimizer(lines, True)),
+                         ["G0 X0 Y0 F100", "G1 X5 Y0", "G1 X5 Y5", "G0 X0 Y4",
+                          "G1 X0 Y1"])
+        # relative mode and unknown position are not changed
+        lines = ["G0 X10 Y10", "G1 X0 Y0", "G91", "G0 X1", "G1 X1"]
+        self.assertEqual(list(TravelOptimizer(lines)), lines)
+        # feed rate lines are part of strokes and travels, not fences
+        lines = ["G0 X0 Y0 F600", "G0 X10 Y0", "F900", "G1 X11 Y0",
+                 "G0 X1 Y0", "F1200", "G1 X2 Y0", "F300", "G0 X0 Y5", "M5"]
+        o = TravelOptimizer(lines)
+        self.assertEqual(list(o), [
+            "G0 X0 Y0 F600", "G0 X1 Y0", "G1 X2 Y0 F1200", "F300",
+            "G0 X10 Y0", "G1 X11 Y0 F900", "G0 X2 Y0", "G1 F300",
+            "G0 X0 Y5", "M5"])
+        self.assertEqual(o.statistics()["sections"], 1)
+        # reordered strokes with return to the original end are longer
+        lines = ["G0 X0 Y0 F600", "G0 X3 Y0", "G1 X10 Y0", "G0 X1 Y0",
+                 "G1 X0 Y0", "M5"]
+        o = TravelOptimizer(lines)
+        self.assertEqual(list(o), lines)
+        s = o.statistics()
+        self.assertEqual(s["travel_after_mm"], s["travel_before_mm"])
+
+    def test_travel_optimizer_painting(self):
+        o = TravelOptimizer(workloads.painting(300))
+        for _ in o:
+            pass
+        s = o.statistics()
+        self.assertEqual(s["sections"], 1)
+        self.assertLess(s["travel_after_mm"], s["travel_before_mm"] / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
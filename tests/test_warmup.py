@@ -0,0 +1,36 @@
+import unittest
+
+from cnc.warmup import *
+
+
+class TestWarmup(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_run(self):
+        r = run(None, 10.0, 1.0)
+        self.assertTrue(r["stable"])
+        self.assertEqual(r["rounds"], STABLE_ROUNDS + 1)
+        self.assertGreater(r["events_per_second"], 0)
+
+    def test_hal(self):
+        class Hal(object):
+            events = 0
+
+            @staticmethod
+            def warmup(events):
+                n = len(list(events))
+                Hal.events += n
+                return n
+        # speed never is stable with zero tolerance
+        r = run(Hal, 0.2, 0.0)
+        self.assertFalse(r["stable"])
+        self.assertGreater(r["rounds"], 0)
+        self.assertGreater(Hal.events, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from cnc import workloads
+from cnc import hal_virtual
+from cnc.gcode import *
+from cnc.gmachine import *
+from cnc.coordinates import *
+from cnc.config import *
+from cnc.actuators.extruder import Extruder
+
+
+class TestWorkloads(unittest.TestCase):
+    def setUp(self):
+        # virtual hal extruders keep their position between machines, start
+        # with empty ones since workloads expect zero extruder position
+        self._extruders = list(hal_virtual.extruders)
+        hal_virtual.extruders[:] = [
+            Extruder(hal_virtual.MockServo(), EXTRUDER_LENGTH_MM,
+                     config['max_speed'] / 60.0)
+            for config in EXTRUDER_CONFIG]
+
+    def tearDown(self):
+        hal_virtual.extruders[:] = self._extruders
+
+    def test_seed(self):
+        for name, workload in workloads.WORKLOADS.items():
+            self.assertEqual(list(workload(5, 1)), list(workload(5, 1)))
+            self.assertNotEqual(list(workload(5, 1)), list(workload(5, 2)))
+        self.assertGreater(len(list(workloads.painting(20))),
+                           len(list(workloads.painting(10))))
+
+    def test_run(self):
+        # all moves should be valid for machine and pass pulses checks
+        for name, workload in sorted(workloads.WORKLOADS.items()):
+            m = GMachine()
+            moves = hal_virtual.get_metrics()["moves"]
+            for line in workload(2 if name == "mixed_units" else 60, 3):
+                m.do_command(GCode.parse_line(line))
+            self.assertEqual(m.position(), Coordinates(0, 0, 0, 0))
+            self.assertGreater(hal_virtual.get_metrics()["moves"], moves)
+
+    def test_features(self):
+        lines = list(workloads.mixed(0.01))
+        for command in ("T0", "G0", "G2", "G3", "G18", "G19", "G20"):
+            self.assertIn(command, [l.split(" ")[0] for l in lines])
+        self.assertIn("T2", workloads.painting(30, tool_change_every=10))
+        tiny = [l for l in workloads.tiny_segments(100) if l.startswith("G1")]
+        self.assertGreater(len(tiny), 90)
+
+
+if __name__ == '__main__':
+    unittest.main()